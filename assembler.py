@@ -0,0 +1,342 @@
+import io
+import os
+import re
+import sys
+import zlib
+import struct
+import argparse
+from array import array
+from utils import *
+from memory import *
+from config import *
+from isa import *
+
+IMAGE_MAGIC = b"CYIM"
+IMAGE_VERSION = 1
+
+# magic, version, opcode size, PROM word size, bytes per word, CRC32 of the operations list, word count, symbol count
+IMAGE_HEADER = struct.Struct("<4sHHHBIQI")
+# symbol value, name length
+SYMBOL = struct.Struct("<qH")
+
+SYMBOL_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*$")
+
+def getOperationsChecksum(cpu: CpuConfig) -> int:
+    """Returns a checksum of the operations list. Opcode numbers come from its order, so images check it on load."""
+    return zlib.crc32(",".join(operation.lower() for operation in cpu.operations).encode("utf-8"))
+
+def getWordBytes(wordSize: int) -> int:
+    """Returns how many bytes a PROM word takes in an image: the array item size of the bank, or whole bytes past 64 bits."""
+    typecode = getTypecode(wordSize)
+    if typecode is None:
+        return (wordSize + 7) // 8
+    return array(typecode).itemsize
+
+def getOpcodeNumbers(instructionSet: InstructionSet, cpu: CpuConfig) -> dict:
+    """Returns the opcode number of every mnemonic: its index in the operations list, or the class's `encoding` if it sets one.
+
+    Args:
+        instructionSet (InstructionSet): The instruction set.
+        cpu (CpuConfig): The config the instruction set was checked against.
+
+    Returns:
+        dict: Mnemonic to opcode number.
+    """
+    numbers = {}
+    used = {}
+    errors = []
+    for index, operation in enumerate(cpu.operations):
+        mnemonic = operation.lower()
+        instr_class = instructionSet.opcodes[mnemonic]
+        number = getattr(instr_class, "encoding", index)
+        if number < 0 or number > cpu.opcodeMask:
+            errors.append(f"Opcode {number} of {mnemonic} doesn't fit in {cpu.opcodeSize} bits")
+        elif number in used:
+            errors.append(f"{mnemonic} and {used[number]} both use opcode {number}")
+        elif sum(instr_class.operand_sizes) > cpu.promWordSize - cpu.opcodeSize:
+            errors.append(f"The operands of {mnemonic} ({sum(instr_class.operand_sizes)} bits) don't fit in a PROM word ({cpu.promWordSize - cpu.opcodeSize} bits after the opcode)")
+        used[number] = mnemonic
+        numbers[mnemonic] = number
+    if len(errors) > 0:
+        log("Unable to encode the instruction set:\n" + "\n".join(errors), "ERROR")
+    return numbers
+
+def encodeWord(number: int, fields: list[int], operandSizes: list[int], cpu: CpuConfig) -> int:
+    """Pack an opcode number and raw operand fields into a PROM word. The opcode takes the top opcode_size bits and the
+    operands follow it, most significant first, each taking the size its instruction class gives it."""
+    shift = cpu.promWordSize - cpu.opcodeSize
+    word = number << shift
+    for field, size in zip(fields, operandSizes):
+        shift -= size
+        word |= field << shift
+    return word
+
+def decodeWord(word: int, classes: dict, cpu: CpuConfig) -> tuple:
+    """Unpack a PROM word written by encodeWord().
+
+    Args:
+        word (int): The PROM word.
+        classes (dict): Opcode number to instruction class.
+        cpu (CpuConfig): The config of the processor.
+
+    Returns:
+        tuple: (instruction class, raw operand fields), or (None, None) if the opcode is unknown.
+    """
+    shift = cpu.promWordSize - cpu.opcodeSize
+    instr_class = classes.get(word >> shift)
+    if instr_class is None:
+        return None, None
+    fields = []
+    for size in instr_class.operand_sizes:
+        shift -= size
+        fields.append((word >> shift) & ((1 << size) - 1))
+    return instr_class, fields
+
+def assemble(lines: list[str], instructionSet: InstructionSet, cpu: CpuConfig) -> tuple[list[int], dict]:
+    """Assemble source lines into PROM words.
+
+    Besides the normal program format, a line can start with a label (`loop:`), which names the address of the next
+    instruction, and `.equ NAME VALUE` defines a constant. Operands can be numbers, labels or constants. Every
+    instruction takes one PROM word, so addresses count instructions, not source lines. All problems are reported together.
+
+    Args:
+        lines (list[str]): The source lines.
+        instructionSet (InstructionSet): The instruction set to assemble for.
+        cpu (CpuConfig): The config of the processor.
+
+    Returns:
+        tuple[list[int], dict]: The PROM words and the labels (name to address).
+    """
+    numbers = getOpcodeNumbers(instructionSet, cpu)
+    opcodes = instructionSet.opcodes
+    # (line index, message), sorted by line before they are reported
+    errors = []
+    labels = {}
+    constants = {}
+    instructions = []
+
+    # Pass 1: find every label, constant and instruction
+    for index, line in enumerate(lines):
+        words = line.split(";")[0].split()
+        while len(words) > 0 and words[0].endswith(":"):
+            name = words.pop(0)[:-1]
+            if SYMBOL_NAME.match(name) is None:
+                errors.append((index, f"Invalid label name: {name}"))
+            elif name in labels or name in constants:
+                errors.append((index, f"{name} is already defined"))
+            else:
+                labels[name] = len(instructions)
+        if len(words) == 0:
+            continue
+
+        if words[0].lower() == ".equ":
+            if len(words) != 3:
+                errors.append((index, "Expected .equ NAME VALUE"))
+            elif SYMBOL_NAME.match(words[1]) is None:
+                errors.append((index, f"Invalid constant name: {words[1]}"))
+            elif words[1] in labels or words[1] in constants:
+                errors.append((index, f"{words[1]} is already defined"))
+            else:
+                constants[words[1]] = (words[2], index)
+            continue
+
+        instr_class = opcodes.get(words[0].lower())
+        if instr_class is None:
+            errors.append((index, f"Unknown opcode: {words[0]}"))
+        elif len(words) - 1 != instr_class.operand_count:
+            errors.append((index, f"Expected {instr_class.operand_count} operands, got {len(words) - 1}"))
+        else:
+            instructions.append((index, words[0].lower(), instr_class, words[1:]))
+
+    if len(instructions) > cpu.prom:
+        errors.append((len(lines), f"The program has {len(instructions)} instructions, but the PROM only holds {cpu.prom} words"))
+
+    values = {}
+    def resolve(token: str, index: int, seen: tuple = ()):
+        try:
+            return int(token, 0)
+        except ValueError:
+            pass
+        if token in labels:
+            return labels[token]
+        if token in values:
+            return values[token]
+        if token not in constants:
+            errors.append((index, f"Unknown symbol or invalid operand: {token}"))
+            return None
+        if token in seen:
+            errors.append((constants[token][1], f"Constant {token} is defined in terms of itself"))
+            values[token] = None
+            return None
+        value = resolve(constants[token][0], constants[token][1], seen + (token,))
+        values[token] = value
+        return value
+
+    for name, (token, index) in constants.items():
+        resolve(name, index)
+
+    # Pass 2: resolve the operands and encode
+    words = []
+    for index, mnemonic, instr_class, tokens in instructions:
+        fields = []
+        for i, token in enumerate(tokens):
+            value = resolve(token, index)
+            if value is None:
+                break
+            size = instr_class.operand_sizes[i]
+            if value < 0 or value >= 1 << size:
+                errors.append((index, f"Operand {token} ({value}) at index {i} doesn't fit in {size} bits"))
+                break
+            fields.append(value)
+        if len(fields) == len(tokens):
+            words.append(encodeWord(numbers[mnemonic], fields, instr_class.operand_sizes, cpu))
+
+    if len(errors) > 0:
+        errors.sort(key=lambda error: error[0])
+        log("Unable to assemble program:\n" + "\n".join(f"Line {index + 1}: {message}" if index < len(lines) else message for index, message in errors), "ERROR")
+    log(f"Assembled {len(words)} instructions.", "INFO")
+    return words, labels
+
+def writeImage(f, words: list[int], symbols: dict, cpu: CpuConfig) -> None:
+    """Write PROM words to a binary image file object.
+
+    The image is a header followed by the words, little endian, each the size of a word of the PROM bank (so they can
+    be copied straight into it), then the symbol table (value, name length, name).
+
+    Args:
+        f (file): A binary file object open for writing.
+        words (list[int]): The PROM words.
+        symbols (dict): Symbol name to value, kept for the disassembler.
+        cpu (CpuConfig): The config the words were assembled for.
+    """
+    wordBytes = getWordBytes(cpu.promWordSize)
+    f.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, cpu.opcodeSize, cpu.promWordSize, wordBytes, getOperationsChecksum(cpu), len(words), len(symbols)))
+    typecode = getTypecode(cpu.promWordSize)
+    if typecode is not None:
+        data = array(typecode, words)
+        if sys.byteorder != "little":
+            data.byteswap()
+        f.write(data.tobytes())
+    else:
+        for word in words:
+            f.write(word.to_bytes(wordBytes, "little"))
+    for name, value in symbols.items():
+        encoded = name.encode("utf-8")
+        f.write(SYMBOL.pack(value, len(encoded)))
+        f.write(encoded)
+
+def readImage(data, cpu: CpuConfig) -> tuple[memoryview, int, dict]:
+    """Check an image written by writeImage() against a config and split it up.
+
+    Args:
+        data (bytes-like): The image.
+        cpu (CpuConfig): The config of the processor that will load it.
+
+    Returns:
+        tuple[memoryview, int, dict]: The raw little endian words, the word count and the symbols.
+    """
+    view = memoryview(data)
+    if len(view) < IMAGE_HEADER.size:
+        log("Not a CYAN image.", "ERROR")
+    magic, version, opcodeSize, promWordSize, wordBytes, checksum, count, symbolCount = IMAGE_HEADER.unpack_from(view, 0)
+    if magic != IMAGE_MAGIC:
+        log("Not a CYAN image.", "ERROR")
+    if version > IMAGE_VERSION:
+        log(f"Image is too new. Expected {IMAGE_VERSION}, got {version}", "ERROR")
+    if opcodeSize != cpu.opcodeSize or promWordSize != cpu.promWordSize or wordBytes != getWordBytes(cpu.promWordSize):
+        log(f"Image was built for {opcodeSize} bit opcodes in {promWordSize} bit words, the processor has {cpu.opcodeSize} bit opcodes in {cpu.promWordSize} bit words", "ERROR")
+    if checksum != getOperationsChecksum(cpu):
+        log("Image was built for a different operations list.", "ERROR")
+    if count > cpu.prom:
+        log(f"Image has {count} words, but the PROM only holds {cpu.prom}", "ERROR")
+
+    offset = IMAGE_HEADER.size
+    raw = view[offset:offset + count * wordBytes]
+    offset += count * wordBytes
+    symbols = {}
+    for _ in range(symbolCount):
+        value, length = SYMBOL.unpack_from(view, offset)
+        offset += SYMBOL.size
+        symbols[bytes(view[offset:offset + length]).decode("utf-8")] = value
+        offset += length
+    return raw, count, symbols
+
+def buildImage(words: list[int], symbols: dict, cpu: CpuConfig, filePath: str = None) -> bytes | None:
+    """Write an image to a file, or return it as bytes if no file is given."""
+    if filePath is None:
+        f = io.BytesIO()
+        writeImage(f, words, symbols, cpu)
+        return f.getvalue()
+    with open(filePath, "wb") as f:
+        writeImage(f, words, symbols, cpu)
+    return None
+
+def disassemble(words, instructionSet: InstructionSet, cpu: CpuConfig, symbols: dict = None) -> list[str]:
+    """Turn PROM words back into source lines that assemble to the same words.
+
+    Labels from symbols are written before the instructions at their addresses, but operands are always written as
+    numbers: operands have no types, so there's no telling a jump target from a value that happens to match it. .equ
+    constants aren't kept in images, so they don't come back either.
+
+    Args:
+        words (iterable[int]): The PROM words.
+        instructionSet (InstructionSet): The instruction set.
+        cpu (CpuConfig): The config of the processor.
+        symbols (dict, optional): Labels to put back in, name to address. Defaults to None.
+
+    Returns:
+        list[str]: The source lines. Words with an unknown opcode become comments.
+    """
+    numbers = getOpcodeNumbers(instructionSet, cpu)
+    classes = {numbers[mnemonic] : instructionSet.opcodes[mnemonic] for mnemonic in numbers}
+    names = {number : mnemonic for mnemonic, number in numbers.items()}
+    labels = {}
+    for name, address in (symbols or {}).items():
+        labels.setdefault(address, []).append(name)
+
+    lines = []
+    for address, word in enumerate(words):
+        for name in labels.get(address, []):
+            lines.append(f"{name}:")
+        instr_class, fields = decodeWord(word, classes, cpu)
+        if instr_class is None:
+            lines.append(f"    ; {address}: unknown word {word:#x}")
+        else:
+            lines.append("    " + " ".join([names[word >> (cpu.promWordSize - cpu.opcodeSize)]] + [str(field) for field in fields]))
+    return lines
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Assemble CYAN programs into PROM images, or disassemble images.")
+    parser.add_argument("source", help="The program to assemble, or the image to disassemble with -d.")
+    parser.add_argument("-c", "--config", required=True, help="The config file of the processor.")
+    parser.add_argument("-i", "--instructions", default="instructions.py", help="The instructions file. Defaults to instructions.py in configGroup.")
+    parser.add_argument("-o", "--output", default=None, help="Where to write the image (or the disassembly). Defaults to the source with a .cyim extension (or stdout).")
+    parser.add_argument("-d", "--disassemble", action="store_true", help="Disassemble an image instead.")
+    args = parser.parse_args()
+    configureLogger(printLevel="WARNING")
+
+    cpu = loadConfig(args.config)
+    instructionSet = InstructionSet(resolveInstructionsFile(args.instructions), cpu.raw)
+    if args.disassemble:
+        with open(args.source, "rb") as f:
+            raw, count, symbols = readImage(f.read(), cpu)
+        bank = MemoryBank("prom", count, cpu.promWordSize)
+        bank.loadBytes(raw, "little")
+        text = "\n".join(disassemble(bank, instructionSet, cpu, symbols)) + "\n"
+        if args.output is None:
+            sys.stdout.write(text)
+        else:
+            with open(args.output, "w") as f:
+                f.write(text)
+        return 0
+
+    with open(args.source, "r") as f:
+        lines = f.read().splitlines()
+    words, labels = assemble(lines, instructionSet, cpu)
+    output = args.output or os.path.splitext(args.source)[0] + ".cyim"
+    buildImage(words, labels, cpu, output)
+    print(f"Wrote {len(words)} words to {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import utils
+from utils import *
+from config import *
+from processor import *
+
+def readManifest(manifestPath: str) -> list[dict]:
+    """Returns the jobs in a JSONL manifest, one JSON object per line.
+
+    Each job needs "config" and "program" paths and can set "id", "instructions", "engine", "max_instructions",
+    "time_limit" and "include_ram". Relative paths are resolved against the folder of the manifest.
+
+    Args:
+        manifestPath (str): The path of the manifest.
+
+    Returns:
+        list[dict]: The jobs, with absolute paths and an id filled in.
+    """
+    base = os.path.dirname(os.path.abspath(manifestPath))
+    jobs = []
+    with open(manifestPath, "r") as f:
+        for index, line in enumerate(f):
+            if line.strip() == "":
+                continue
+            job = json.loads(line)
+            job.setdefault("id", str(index))
+            for key in ("config", "program", "instructions"):
+                if job.get(key) is not None:
+                    job[key] = os.path.join(base, job[key])
+            jobs.append(job)
+    return jobs
+
+def summarizeState(proc: Processor, includeRAM: bool = False) -> dict:
+    """Returns the final state of a processor as plain JSON-friendly values."""
+    summary = {
+        "pc" : proc.state["pc"],
+        "registers" : list(proc.state["registers"]),
+        "io" : list(proc.state["io"]),
+        "stack" : proc.state["stack"].items(),
+        "callstack" : proc.state["callstack"].items(),
+        "custom_regs" : {name : reg.get() for name, reg in proc.state["custom_regs"].items()},
+        "flags" : proc.getFlags()
+    }
+    if includeRAM:
+        summary["ram"] = list(proc.state["ram"])
+    return summary
+
+def runJob(job: dict, logDir: str = None, defaults: dict = None) -> dict:
+    """Run one job in a fresh Processor and return its result. Errors are caught and reported in the result.
+
+    Args:
+        job (dict): The job, as returned by readManifest().
+        logDir (str, optional): The folder for the per job log files. Defaults to None (no log file).
+        defaults (dict, optional): Values for any job keys that the job doesn't set. Defaults to None.
+
+    Returns:
+        dict: The id, exit reason, instruction count, run time and final state (or error) of the job.
+    """
+    job = {**(defaults or {}), **job}
+    utils.printLogs = False
+    configureLogger(filePath="" if logDir is None else os.path.join(logDir, f"{job['id']}.log"), printLevel="OFF")
+
+    result = {"id" : job["id"], "exit_reason" : None, "instructions" : 0, "elapsed" : 0.0}
+    start = time.perf_counter()
+    proc = None
+    try:
+        proc = Processor(loadConfig(job["config"]))
+        if job.get("instructions") is not None:
+            proc.setInstructionsFile(job["instructions"])
+        if not proc.loadProgram(job["program"]):
+            log(f"Unable to load program {job['program']}", "ERROR")
+        result["exit_reason"] = proc.run(job.get("engine", "interpreter"), job.get("max_instructions"), job.get("time_limit"))
+        result["state"] = summarizeState(proc, job.get("include_ram", False))
+    except Exception as e:
+        result["exit_reason"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        logger.flush()
+
+    result["elapsed"] = time.perf_counter() - start
+    if proc is not None:
+        result["instructions"] = proc.instructionCount
+        result["ticks"] = proc.ticks
+    return result
+
+def runBatch(manifestPath: str, resultsPath: str, workers: int = None, logDir: str = None, defaults: dict = None) -> int:
+    """Run every job of a manifest across a process pool and write one JSON result per line to resultsPath.
+
+    Results are written in manifest order as soon as they are available.
+
+    Args:
+        manifestPath (str): The JSONL manifest of jobs.
+        resultsPath (str): The JSONL file to write the results to.
+        workers (int, optional): The number of worker processes. Defaults to None (one per CPU).
+        logDir (str, optional): The folder for the per job log files. Defaults to None (no log files).
+        defaults (dict, optional): Values for any job keys that a job doesn't set. Defaults to None.
+
+    Returns:
+        int: The number of jobs that ended with an error.
+    """
+    jobs = readManifest(manifestPath)
+    if logDir is not None:
+        os.makedirs(logDir, exist_ok=True)
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(resultsPath, "w") as f:
+        results = executor.map(runJob, jobs, [logDir] * len(jobs), [defaults] * len(jobs))
+        for result in results:
+            if result["exit_reason"] == "error":
+                failures += 1
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+    return failures
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a manifest of CYAN jobs across a process pool.")
+    parser.add_argument("manifest", help="JSONL file with one job per line")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file to write the results to")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--log-dir", default=None, help="folder for the per job log files")
+    parser.add_argument("--engine", default="interpreter", choices=["interpreter", "compiled"], help="default engine")
+    parser.add_argument("--max-instructions", type=int, default=None, help="default instruction limit per job")
+    parser.add_argument("--time-limit", type=float, default=None, help="default time limit per job in seconds")
+    args = parser.parse_args(argv)
+
+    defaults = {"engine" : args.engine, "max_instructions" : args.max_instructions, "time_limit" : args.time_limit}
+    failures = runBatch(args.manifest, args.output, args.workers, args.log_dir, defaults)
+    return 1 if failures > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
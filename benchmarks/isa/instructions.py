@@ -0,0 +1,279 @@
+class zero:
+    def get(value) -> bool:
+        return value & 0xFFFF == 0
+
+class negative:
+    def get(value) -> bool:
+        return value & 0x8000 != 0 or value < 0
+
+class LDI:
+    opcode = "ldi"
+    operand_count = 2
+    operand_sizes = [3, 16]
+    signage = ["u", "u"]
+    reads = []
+    writes = [("reg", 0)]
+
+    def __init__(self, proc, operands):
+        proc.setReg(operands[0], operands[1], False)
+
+    def compile(proc, operands):
+        dest, value = operands
+        def ldi():
+            proc.setReg(dest, value, False)
+        return ldi
+
+    def vector(vproc, lanes, operands):
+        vproc.setRegV(lanes, operands[0], operands[1], False)
+
+class MOV:
+    opcode = "mov"
+    operand_count = 2
+    operand_sizes = [3, 3]
+    signage = ["u", "u"]
+    reads = [("reg", 0)]
+    writes = [("reg", 1), ("flags", None)]
+
+    def __init__(self, proc, operands):
+        proc.setReg(operands[1], proc.getReg(operands[0]), True)
+
+    def vector(vproc, lanes, operands):
+        vproc.setRegV(lanes, operands[1], vproc.getRegV(lanes, operands[0]), True)
+
+class ADD:
+    opcode = "add"
+    operand_count = 3
+    operand_sizes = [3, 3, 3]
+    signage = ["u", "u", "u"]
+    reads = [("reg", 0), ("reg", 1)]
+    writes = [("reg", 2), ("flags", None)]
+
+    def __init__(self, proc, operands):
+        proc.setReg(operands[2], proc.getReg(operands[0]) + proc.getReg(operands[1]), True)
+
+    def compile(proc, operands):
+        a, b, dest = operands
+        def add():
+            proc.setReg(dest, proc.getReg(a) + proc.getReg(b), True)
+        return add
+
+    def vector(vproc, lanes, operands):
+        vproc.setRegV(lanes, operands[2], vproc.getRegV(lanes, operands[0]) + vproc.getRegV(lanes, operands[1]), True)
+
+class SUB:
+    opcode = "sub"
+    operand_count = 3
+    operand_sizes = [3, 3, 3]
+    signage = ["u", "u", "u"]
+    reads = [("reg", 0), ("reg", 1)]
+    writes = [("reg", 2), ("flags", None)]
+
+    def __init__(self, proc, operands):
+        proc.setReg(operands[2], proc.getReg(operands[0]) - proc.getReg(operands[1]), True)
+
+    def vector(vproc, lanes, operands):
+        vproc.setRegV(lanes, operands[2], vproc.getRegV(lanes, operands[0]) - vproc.getRegV(lanes, operands[1]), True)
+
+class INC:
+    opcode = "inc"
+    operand_count = 1
+    operand_sizes = [3]
+    signage = ["u"]
+    reads = [("reg", 0)]
+    writes = [("reg", 0), ("flags", None)]
+
+    def __init__(self, proc, operands):
+        proc.setReg(operands[0], proc.getReg(operands[0]) + 1, True)
+
+    def compile(proc, operands):
+        (reg,) = operands
+        def inc():
+            proc.setReg(reg, proc.getReg(reg) + 1, True)
+        return inc
+
+    def vector(vproc, lanes, operands):
+        vproc.setRegV(lanes, operands[0], vproc.getRegV(lanes, operands[0]) + 1, True)
+
+class DEC:
+    opcode = "dec"
+    operand_count = 1
+    operand_sizes = [3]
+    signage = ["u"]
+    reads = [("reg", 0)]
+    writes = [("reg", 0), ("flags", None)]
+
+    def __init__(self, proc, operands):
+        proc.setReg(operands[0], proc.getReg(operands[0]) - 1, True)
+
+    def compile(proc, operands):
+        (reg,) = operands
+        def dec():
+            proc.setReg(reg, proc.getReg(reg) - 1, True)
+        return dec
+
+    def vector(vproc, lanes, operands):
+        vproc.setRegV(lanes, operands[0], vproc.getRegV(lanes, operands[0]) - 1, True)
+
+class LDR:
+    opcode = "ldr"
+    operand_count = 2
+    operand_sizes = [3, 3]
+    signage = ["u", "u"]
+    reads = [("reg", 0), ("ram", None)]
+    writes = [("reg", 1), ("flags", None)]
+
+    def __init__(self, proc, operands):
+        proc.setReg(operands[1], proc.getRAM(proc.getReg(operands[0])), True)
+
+    def vector(vproc, lanes, operands):
+        vproc.setRegV(lanes, operands[1], vproc.getRAMV(lanes, vproc.getRegV(lanes, operands[0])), True)
+
+class STR:
+    opcode = "str"
+    operand_count = 2
+    operand_sizes = [3, 3]
+    signage = ["u", "u"]
+    reads = [("reg", 0), ("reg", 1)]
+    writes = [("ram", None)]
+
+    def __init__(self, proc, operands):
+        proc.setRAM(proc.getReg(operands[1]), proc.getReg(operands[0]), False)
+
+    def vector(vproc, lanes, operands):
+        vproc.setRAMV(lanes, vproc.getRegV(lanes, operands[1]), vproc.getRegV(lanes, operands[0]), False)
+
+class IN:
+    opcode = "in"
+    operand_count = 2
+    operand_sizes = [2, 3]
+    signage = ["u", "u"]
+    reads = [("io", 0)]
+    writes = [("reg", 1), ("flags", None)]
+
+    def __init__(self, proc, operands):
+        proc.setReg(operands[1], proc.getIO(operands[0]), True)
+
+    def vector(vproc, lanes, operands):
+        vproc.setRegV(lanes, operands[1], vproc.getIOV(lanes, operands[0]), True)
+
+class OUT:
+    opcode = "out"
+    operand_count = 2
+    operand_sizes = [3, 2]
+    signage = ["u", "u"]
+    reads = [("reg", 0)]
+    writes = [("io", 1)]
+
+    def __init__(self, proc, operands):
+        proc.setIO(operands[1], proc.getReg(operands[0]))
+
+    def vector(vproc, lanes, operands):
+        vproc.setIOV(lanes, operands[1], vproc.getRegV(lanes, operands[0]))
+
+class JMP:
+    opcode = "jmp"
+    operand_count = 1
+    operand_sizes = [8]
+    signage = ["u"]
+    reads = []
+    writes = []
+    modifies_pc = True
+
+    def __init__(self, proc, operands):
+        proc.setPC(operands[0])
+
+    def vector(vproc, lanes, operands):
+        vproc.setPCV(lanes, operands[0])
+
+class JZ:
+    opcode = "jz"
+    operand_count = 1
+    operand_sizes = [8]
+    signage = ["u"]
+    reads = [("flags", None)]
+    writes = []
+    modifies_pc = True
+
+    def __init__(self, proc, operands):
+        if proc.getFlag("zero"):
+            proc.setPC(operands[0])
+
+    def vector(vproc, lanes, operands):
+        vproc.setPCV(lanes[vproc.getFlagV(lanes, "zero")], operands[0])
+
+class JNZ:
+    opcode = "jnz"
+    operand_count = 1
+    operand_sizes = [8]
+    signage = ["u"]
+    reads = [("flags", None)]
+    writes = []
+    modifies_pc = True
+
+    def __init__(self, proc, operands):
+        if not proc.getFlag("zero"):
+            proc.setPC(operands[0])
+
+    def vector(vproc, lanes, operands):
+        vproc.setPCV(lanes[~vproc.getFlagV(lanes, "zero")], operands[0])
+
+class HLT:
+    opcode = "hlt"
+    operand_count = 0
+    operand_sizes = []
+    signage = []
+    reads = []
+    writes = []
+    modifies_pc = True
+
+    def __init__(self, proc, operands):
+        proc.stop()
+
+    def vector(vproc, lanes, operands):
+        vproc.stopV(lanes)
+
+class PUSH:
+    opcode = "push"
+    operand_count = 1
+    operand_sizes = [3]
+    signage = ["u"]
+    reads = [("reg", 0), ("stack", None)]
+    writes = [("stack", None)]
+
+    def __init__(self, proc, operands):
+        proc.push(proc.getReg(operands[0]))
+
+class POP:
+    opcode = "pop"
+    operand_count = 1
+    operand_sizes = [3]
+    signage = ["u"]
+    reads = [("stack", None)]
+    writes = [("reg", 0), ("stack", None)]
+
+    def __init__(self, proc, operands):
+        proc.setReg(operands[0], proc.pop(), False)
+
+class CALL:
+    opcode = "call"
+    operand_count = 1
+    operand_sizes = [8]
+    signage = ["u"]
+    reads = [("callstack", None)]
+    writes = [("callstack", None)]
+    modifies_pc = True
+
+    def __init__(self, proc, operands):
+        proc.call(operands[0])
+
+class RET:
+    opcode = "ret"
+    operand_count = 0
+    operand_sizes = []
+    signage = []
+    reads = [("callstack", None)]
+    writes = [("callstack", None)]
+    modifies_pc = True
+
+    def __init__(self, proc, operands):
+        proc.ret()
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import utils
+from utils import *
+from config import *
+from processor import *
+from system import *
+from vector import *
+
+ISA_CONFIG = os.path.join(BENCHMARK_DIR, "isa", "config.json")
+ISA_INSTRUCTIONS = os.path.join(BENCHMARK_DIR, "isa", "instructions.py")
+PROGRAMS = ["add_loop", "ram_walk", "flag_branches", "io_poll", "recursion"]
+# "optimized" is the interpreter with run(optimize=True)
+ENGINES = ["interpreter", "compiled", "optimized"]
+STARTUP_SIZES = [2 ** 10, 2 ** 16, 2 ** 20]
+# The multi-core benchmark runs this program on every core of a System
+SYSTEM_PROGRAM = "add_loop"
+SYSTEM_CORES = 8
+SYSTEM_QUANTUM = 10000
+# The vector benchmark runs this program on many lanes of a VectorProcessor (needs NumPy), for a fixed number of steps
+VECTOR_PROGRAM = "add_loop"
+VECTOR_LANES = 1024
+VECTOR_STEPS = 10000
+
+def runEngine(proc: Processor, engine: str) -> None:
+    """Run a processor with one of ENGINES."""
+    if engine == "optimized":
+        proc.run(optimize=True)
+    else:
+        proc.run(engine)
+
+def benchmarkProgram(name: str, engine: str, repeat: int) -> dict:
+    """Run one reference program and return the best instructions/sec of a few runs and the peak traced memory."""
+    config = loadConfig(ISA_CONFIG)
+    best = None
+    for _ in range(repeat):
+        proc = Processor(config)
+        proc.setInstructionsFile(ISA_INSTRUCTIONS)
+        proc.loadProgram(os.path.join(BENCHMARK_DIR, "programs", f"{name}.txt"))
+        start = time.perf_counter()
+        runEngine(proc, engine)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    tracemalloc.start()
+    proc = Processor(config)
+    proc.setInstructionsFile(ISA_INSTRUCTIONS)
+    proc.loadProgram(os.path.join(BENCHMARK_DIR, "programs", f"{name}.txt"))
+    runEngine(proc, engine)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "instructions" : proc.instructionCount,
+        "seconds" : best,
+        "instructions_per_second" : proc.instructionCount / best,
+        "peak_memory_bytes" : peak
+    }
+
+def benchmarkSystem(name: str, engine: str, cores: int, repeat: int) -> dict:
+    """Run one reference program on every core of a System and return the same measurements as benchmarkProgram()."""
+    config = loadConfig(ISA_CONFIG)
+    best = None
+    for _ in range(repeat):
+        system = System(config, cores, SYSTEM_QUANTUM)
+        system.setInstructionsFile(ISA_INSTRUCTIONS)
+        system.loadProgram(os.path.join(BENCHMARK_DIR, "programs", f"{name}.txt"))
+        start = time.perf_counter()
+        system.run(engine)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    tracemalloc.start()
+    system = System(config, cores, SYSTEM_QUANTUM)
+    system.setInstructionsFile(ISA_INSTRUCTIONS)
+    system.loadProgram(os.path.join(BENCHMARK_DIR, "programs", f"{name}.txt"))
+    system.run(engine)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    instructions = system.getStats()["instructions"]
+    return {
+        "instructions" : instructions,
+        "seconds" : best,
+        "instructions_per_second" : instructions / best,
+        "peak_memory_bytes" : peak
+    }
+
+def benchmarkVector(name: str, lanes: int, steps: int, repeat: int) -> dict:
+    """Run one reference program on every lane of a VectorProcessor and return the same measurements as
+    benchmarkProgram(), counting the instructions of every lane."""
+    config = loadConfig(ISA_CONFIG)
+    best = None
+    for _ in range(repeat):
+        vproc = VectorProcessor(config, lanes)
+        vproc.setInstructionsFile(ISA_INSTRUCTIONS)
+        vproc.loadProgram(os.path.join(BENCHMARK_DIR, "programs", f"{name}.txt"))
+        start = time.perf_counter()
+        vproc.run(steps)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    tracemalloc.start()
+    vproc = VectorProcessor(config, lanes)
+    vproc.setInstructionsFile(ISA_INSTRUCTIONS)
+    vproc.loadProgram(os.path.join(BENCHMARK_DIR, "programs", f"{name}.txt"))
+    vproc.run(steps)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    instructions = int(vproc.instructionCount.sum())
+    return {
+        "instructions" : instructions,
+        "seconds" : best,
+        "instructions_per_second" : instructions / best,
+        "peak_memory_bytes" : peak
+    }
+
+def benchmarkStartup(size: int, repeat: int) -> dict:
+    """Time Processor.__init__ with the given number of RAM and PROM words and return the best time and peak memory."""
+    config = getConfig(ISA_CONFIG)
+    config["datapoints"]["ram"] = size
+    config["datapoints"]["prom"] = size
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Processor(config)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    tracemalloc.start()
+    proc = Processor(config)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del proc
+
+    return {"seconds" : best, "peak_memory_bytes" : peak}
+
+def runBenchmarks(repeat: int = 3, programs: list[str] = None, engines: list[str] = None) -> dict:
+    """Run the whole suite and return the results as a JSON-friendly dict."""
+    results = {
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "programs" : {},
+        "startup" : {}
+    }
+    for name in programs or PROGRAMS:
+        for engine in engines or ENGINES:
+            results["programs"][f"{name}/{engine}"] = benchmarkProgram(name, engine, repeat)
+    if programs is None or SYSTEM_PROGRAM in programs:
+        for engine in [engine for engine in engines or ENGINES if engine != "optimized"]:
+            results["programs"][f"{SYSTEM_PROGRAM}/{SYSTEM_CORES}_cores/{engine}"] = benchmarkSystem(SYSTEM_PROGRAM, engine, SYSTEM_CORES, repeat)
+    # Skipped without NumPy, or when only some engines were asked for
+    if np is not None and engines is None and (programs is None or VECTOR_PROGRAM in programs):
+        results["programs"][f"{VECTOR_PROGRAM}/{VECTOR_LANES}_lanes/vector"] = benchmarkVector(VECTOR_PROGRAM, VECTOR_LANES, VECTOR_STEPS, repeat)
+    for size in STARTUP_SIZES:
+        results["startup"][str(size)] = benchmarkStartup(size, repeat)
+    return results
+
+def compareResults(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Returns a message for every benchmark that got worse than the baseline by more than threshold (a fraction)."""
+    regressions = []
+    for key, result in results["programs"].items():
+        old = baseline.get("programs", {}).get(key)
+        if old is None:
+            continue
+        if result["instructions_per_second"] < old["instructions_per_second"] * (1 - threshold):
+            regressions.append(f"{key}: {result['instructions_per_second']:.0f} instructions/sec, baseline {old['instructions_per_second']:.0f}")
+        if result["peak_memory_bytes"] > old["peak_memory_bytes"] * (1 + threshold):
+            regressions.append(f"{key}: {result['peak_memory_bytes']} bytes peak memory, baseline {old['peak_memory_bytes']}")
+    for key, result in results["startup"].items():
+        old = baseline.get("startup", {}).get(key)
+        if old is None:
+            continue
+        if result["seconds"] > old["seconds"] * (1 + threshold):
+            regressions.append(f"startup {key}: {result['seconds'] * 1000:.2f} ms, baseline {old['seconds'] * 1000:.2f} ms")
+        if result["peak_memory_bytes"] > old["peak_memory_bytes"] * (1 + threshold):
+            regressions.append(f"startup {key}: {result['peak_memory_bytes']} bytes peak memory, baseline {old['peak_memory_bytes']}")
+    return regressions
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the CYAN emulator benchmark suite.")
+    parser.add_argument("-o", "--output", default=None, help="JSON file to write the results to (default: stdout)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per benchmark, the best one is kept")
+    parser.add_argument("--program", action="append", choices=PROGRAMS, help="only run these programs")
+    parser.add_argument("--engine", action="append", choices=ENGINES, help="only run these engines")
+    parser.add_argument("--compare", default=None, help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown before a regression is flagged (fraction)")
+    args = parser.parse_args(argv)
+
+    utils.printLogs = False
+    configureLogger(filePath="", level="OFF", printLevel="OFF")
+
+    results = runBenchmarks(args.repeat, args.program, args.engine)
+    output = json.dumps(results, indent=4)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compareResults(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if len(regressions) > 0:
+            return 1
+        print("No regressions.", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
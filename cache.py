@@ -0,0 +1,111 @@
+from array import array
+from utils import *
+
+class Cache:
+    def __init__(self, name: str, size: int, banks: int = 1, ways: int = 2, lineSize: int = 1, missPenalty: int = 1) -> None:
+        """A set associative cache simulation with LRU eviction and per bank hit/miss/eviction counters.
+
+        Only the tags are simulated, the data itself always comes from the memory bank. Tags and LRU ages are kept in
+        flat arrays (set * ways + way), so an access allocates nothing.
+
+        Args:
+            name (str): The name of the cache, used in messages and stats.
+            size (int): The capacity of the cache in words.
+            banks (int, optional): The number of banks. Sets are interleaved across banks. Defaults to 1.
+            ways (int, optional): The associativity. Defaults to 2.
+            lineSize (int, optional): The number of words per line. Defaults to 1.
+            missPenalty (int, optional): The extra ticks a miss costs. Defaults to 1.
+        """
+        self.name = name
+        self.lineSize = max(int(lineSize), 1)
+        self.ways = max(min(int(ways), int(size) // self.lineSize), 1)
+        self.sets = max(int(size) // (self.lineSize * self.ways), 1)
+        self.banks = max(int(banks), 1)
+        self.missPenalty = missPenalty
+        self.size = self.sets * self.ways * self.lineSize
+        self.reset()
+
+    def reset(self) -> None:
+        """Invalidate every line and clear the counters."""
+        self.tags = array("q", [-1]) * (self.sets * self.ways)
+        self.ages = array("Q", [0]) * (self.sets * self.ways)
+        self.clock = 0
+        self.hits = array("Q", [0]) * self.banks
+        self.misses = array("Q", [0]) * self.banks
+        self.evictions = array("Q", [0]) * self.banks
+
+    def access(self, address: int) -> int:
+        """Look up an address, filling its line on a miss.
+
+        Returns:
+            int: The extra ticks the access costs (0 on a hit, missPenalty on a miss).
+        """
+        line = address // self.lineSize
+        index = line % self.sets
+        tag = line // self.sets
+        base = index * self.ways
+        bank = index % self.banks
+        self.clock += 1
+
+        tags = self.tags
+        try:
+            way = tags.index(tag, base, base + self.ways)
+        except ValueError:
+            pass
+        else:
+            self.ages[way] = self.clock
+            self.hits[bank] += 1
+            return 0
+
+        # Miss: fill an invalid way if there is one, otherwise evict the least recently used
+        ages = self.ages
+        victim = base
+        for way in range(base, base + self.ways):
+            if tags[way] == -1:
+                victim = way
+                break
+            if ages[way] < ages[victim]:
+                victim = way
+        else:
+            self.evictions[bank] += 1
+        tags[victim] = tag
+        ages[victim] = self.clock
+        self.misses[bank] += 1
+        return self.missPenalty
+
+    def getStats(self) -> dict:
+        """Returns the configuration of the cache and the hit/miss/eviction counters per bank and in total."""
+        hits = sum(self.hits)
+        misses = sum(self.misses)
+        return {
+            "size" : self.size,
+            "sets" : self.sets,
+            "ways" : self.ways,
+            "line_size" : self.lineSize,
+            "miss_penalty" : self.missPenalty,
+            "hits" : hits,
+            "misses" : misses,
+            "evictions" : sum(self.evictions),
+            "hit_rate" : hits / (hits + misses) if hits + misses > 0 else 0.0,
+            "banks" : [
+                {"hits" : self.hits[i], "misses" : self.misses[i], "evictions" : self.evictions[i]} for i in range(self.banks)
+            ]
+        }
+
+def createCache(datapoints: dict, name: str) -> Cache | None:
+    """Create the cache described by the <name>, <name>_banks, <name>_ways, <name>_line and <name>_miss_penalty datapoints.
+
+    Returns:
+        Cache | None: The cache, or None if the config has no (or a zero sized) <name>.
+    """
+    size = datapoints.get(name)
+    if not size:
+        return None
+    return Cache(
+        name,
+        size,
+        datapoints.get(f"{name}_banks", 1),
+        datapoints.get(f"{name}_ways", 2),
+        datapoints.get(f"{name}_line", 1),
+        datapoints.get(f"{name}_miss_penalty", datapoints.get("delay") or 1)
+    )
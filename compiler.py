@@ -0,0 +1,118 @@
+from utils import *
+
+class BlockCompiler:
+    maxBlockSize = 64
+
+    def __init__(self, proc) -> None:
+        """Translates basic blocks of a decoded program into generated Python functions for the compiled engine.
+
+        A block is the run of instructions from a start PC up to and including the first instruction that declares
+        `modifies_pc = True` (or the end of the program, or maxBlockSize instructions). Instructions that change the PC
+        without declaring it are still handled, since the block exits as soon as the PC isn't where it expects.
+        Blocks are cached by start PC and the cache is dropped whenever the decoded program changes.
+
+        Args:
+            proc (Processor): The processor to compile blocks for.
+        """
+        self.proc = proc
+        self.blocks = {}
+        self.program = None
+
+    def invalidate(self) -> None:
+        """Drop every compiled block."""
+        self.blocks.clear()
+        self.program = None
+
+    def getBlock(self, pc: int):
+        """Returns the compiled block starting at pc, compiling it first if needed."""
+        if self.program is not self.proc.parsedProgram:
+            self.blocks.clear()
+            self.program = self.proc.parsedProgram
+
+        block = self.blocks.get(pc)
+        if block is None:
+            block = self.compileBlock(pc)
+            self.blocks[pc] = block
+        return block
+
+    def compileBlock(self, start: int):
+        """Generate the function for the block starting at start.
+
+        Each instruction is called through its `compile(proc, operands)` hook if the class has one (it should return a
+        function with no arguments that does the work of the instruction), otherwise the class is called the same way
+        the interpreter does it.
+
+        If an instruction raises, the instructions before it in the block are still counted and timed, as they would
+        be by the interpreter, before the error is passed on.
+
+        Returns:
+            function: A function with no arguments that runs the block and updates the PC, instruction count and ticks.
+        """
+        program = self.proc.parsedProgram
+        namespace = {"proc" : self.proc, "icache" : self.proc.icache}
+        lines = []
+        # Ticks of the instructions finished before each one, for when it raises
+        doneTicks = []
+
+        pc = start
+        count = 0
+        ticks = 0
+        while pc < len(program) and count < self.maxBlockSize:
+            entry = program[pc]
+            if entry is None:
+                pc += 1
+                continue
+
+            instr_class, operands = entry
+            # The PC is already at start when the block is entered
+            if pc != start:
+                lines.append(f"    state['pc'] = {pc}")
+            lines.append(f"    done = {count}")
+            doneTicks.append(ticks)
+
+            compile_ = getattr(instr_class, "compile", None)
+            if compile_ is not None:
+                namespace[f"f{count}"] = compile_(self.proc, operands)
+                lines.append(f"    f{count}()")
+            else:
+                namespace[f"c{count}"] = instr_class
+                namespace[f"o{count}"] = operands
+                lines.append(f"    c{count}(proc, o{count})")
+            # Fetches are charged after the instruction runs, like the interpreter does
+            if self.proc.icache is not None:
+                lines.append(f"    proc.ticks += icache.access({pc})")
+            count += 1
+            ticks += self.proc.instructionTicks[pc]
+
+            # Same rule as the interpreter: only step forward if the instruction left the PC alone
+            lines.append(f"    if state['pc'] != {pc}:")
+            lines.append(f"        proc.instructionCount += {count}")
+            lines.append(f"        proc.ticks += {ticks}")
+            lines.append(f"        return")
+            lines.append(f"    if not proc.isRunning:")
+            lines.append(f"        state['pc'] = {pc + 1}")
+            lines.append(f"        proc.instructionCount += {count}")
+            lines.append(f"        proc.ticks += {ticks}")
+            lines.append(f"        return")
+
+            pc += 1
+            if getattr(instr_class, "modifies_pc", False):
+                break
+
+        # Skip any trailing comments so the next block starts on an instruction
+        while pc < len(program) and program[pc] is None:
+            pc += 1
+        lines.append(f"    state['pc'] = {pc}")
+        lines.append(f"    proc.instructionCount += {count}")
+        lines.append(f"    proc.ticks += {ticks}")
+        namespace["doneTicks"] = tuple(doneTicks)
+        lines = ["def block():", "    state = proc.state", "    done = 0", "    try:"] + ["    " + line for line in lines] + [
+            "    except BaseException:",
+            "        proc.instructionCount += done",
+            "        proc.ticks += doneTicks[done]",
+            "        raise"
+        ]
+        exec(compile("\n".join(lines), f"<cyan block {start}>", "exec"), namespace)
+        if logger.minLevel <= DEBUG:
+            log(f"Compiled block at {start} with {count} instructions", "DEBUG")
+        return namespace["block"]
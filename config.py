@@ -1,4 +1,7 @@
+import os
 import json
+import pickle
+import hashlib
 from utils import *
 
 config_elements = [
@@ -14,6 +17,7 @@ config_elements = [
     "immediate_size",
     "stack_depth",
     "callstack_depth",
+    "stack_error",
     "io_count",
     "io_size",
     "reg_error",
@@ -22,39 +26,228 @@ config_elements = [
 ]
 
 
+CYAN_VERSION = 1
+
+class ConfigError(CyanError):
+    """Raised when a configuration fails validation. errors has one message per problem."""
+
+    def __init__(self, message: str, level: str = "ERROR") -> None:
+        super().__init__(message, level)
+        self.errors = [line.strip() for line in message.splitlines()[1:]]
+
+# (key, types, required, minimum). Bools are not accepted where ints are expected.
+METADATA_SCHEMA = [
+    ("name", (str,), True, None),
+    ("cyan_version", (int,), True, 1),
+    ("operations", (list,), True, None),
+    ("creator", (str,), False, None),
+    ("date", (str,), False, None),
+    ("description", (str,), False, None)
+]
+
+DATAPOINTS_SCHEMA = [
+    ("prom", (int,), True, 1),
+    ("registers", (int,), True, 1),
+    ("word_size", (int,), True, 1),
+    ("opcode_size", (int,), True, 1),
+    ("operand_count", (int,), True, 0),
+    ("operand_size", (int,), True, 0),
+    ("reg_error", (bool,), True, None),
+    ("ram_error", (bool,), True, None),
+    ("io_error", (bool,), True, None),
+    ("flags", (list,), True, None),
+    ("ram", (int,), False, 0),
+    ("speed", (int, float), False, 0),
+    ("delay", (int, float), False, 0),
+    ("immediate_size", (int,), False, 1),
+    ("stack_depth", (int,), False, 0),
+    ("callstack_depth", (int,), False, 0),
+    ("stack_error", (bool,), False, None),
+    ("io_count", (int,), False, 0),
+    ("io_size", (int,), False, 1),
+    ("zero_register", (bool,), False, None),
+    ("icache", (int,), False, 0),
+    ("dcache", (int,), False, 0)
+]
+
+CUSTOM_REG_SCHEMA = [
+    ("name", (str,), True, None),
+    ("size", (int,), True, 1),
+    ("should_accumulate", (bool,), True, None),
+    ("error", (bool,), True, None)
+]
+
+def checkFields(section: dict, schema: list, where: str, errors: list) -> None:
+    """Check one section of a configuration against a schema, adding a message to errors for every problem found.
+
+    Args:
+        section (dict): The section to check.
+        schema (list): (key, types, required, minimum) tuples.
+        where (str): The name of the section, used in the messages.
+        errors (list): The list the messages are added to.
+    """
+    for key, types, required, minimum in schema:
+        if key not in section:
+            if required:
+                errors.append(f"Missing required {where} field: {key}")
+            continue
+        value = section[key]
+        if (isinstance(value, bool) and bool not in types) or not isinstance(value, types):
+            errors.append(f"{where}.{key} must be {' or '.join(t.__name__ for t in types)}, got {type(value).__name__} ({value!r})")
+        elif minimum is not None and value < minimum:
+            errors.append(f"{where}.{key} must be at least {minimum}, got {value}")
+
+def collectConfigErrors(configDict: dict, version: int) -> list[str]:
+    """Returns every problem with a configuration: missing fields, wrong types, values out of range and settings that don't fit together.
+
+    Args:
+        configDict (dict): The configuration dictionary to be checked.
+        version (int): The newest cyan_version this emulator supports.
+
+    Returns:
+        list[str]: One message per problem. Empty if the configuration is valid.
+    """
+    if not isinstance(configDict, dict):
+        return [f"Config must be a JSON object, got {type(configDict).__name__}"]
+
+    errors = []
+    sections = {}
+    for name in ("metadata", "datapoints"):
+        sections[name] = configDict.get(name, {})
+        if not isinstance(sections[name], dict):
+            errors.append(f"{name} must be an object, got {type(sections[name]).__name__}")
+            sections[name] = {}
+    metadata = sections["metadata"]
+    datapoints = sections["datapoints"]
+
+    checkFields(metadata, METADATA_SCHEMA, "metadata", errors)
+    checkFields(datapoints, DATAPOINTS_SCHEMA, "datapoints", errors)
+    if len(errors) > 0:
+        # The checks below assume the types are right
+        return errors
+
+    if metadata["cyan_version"] > version:
+        errors.append(f"Config is too new. Expected {version}, got {metadata['cyan_version']}")
+    for key in ("operations", "flags"):
+        section = metadata if key == "operations" else datapoints
+        for entry in section[key]:
+            if not isinstance(entry, str):
+                errors.append(f"Every entry of {key} must be a string, got {entry!r}")
+    if len(metadata["operations"]) > 1 << datapoints["opcode_size"]:
+        errors.append(f"{len(metadata['operations'])} operations don't fit in an opcode_size of {datapoints['opcode_size']} bits")
+    if datapoints.get("io_count", 0) > 0 and "io_size" not in datapoints:
+        errors.append("datapoints.io_size is required when io_count is set")
+
+    customRegs = configDict.get("custom_regs", {})
+    if not isinstance(customRegs, dict):
+        errors.append(f"custom_regs must be an object, got {type(customRegs).__name__}")
+    else:
+        for key, reg in customRegs.items():
+            if not isinstance(reg, dict):
+                errors.append(f"custom_regs.{key} must be an object, got {type(reg).__name__}")
+            else:
+                checkFields(reg, CUSTOM_REG_SCHEMA, f"custom_regs.{key}", errors)
+    return errors
+
 def validateConfig(configDict: dict, version) -> bool:
     """This method checks the configuration of the configuration for a CYAN emulator.
 
+    Every problem is collected first and they are all reported together in one ConfigError.
+
     Args:
         configDict (dict): The configuration dictionary to be checked.
+        version (int): The newest cyan_version this emulator supports.
 
     Returns:
-        bool: True if the configuration is valid, False otherwise.
+        bool: True if the configuration is valid. Otherwise a ConfigError is raised.
     """
-    # Metadata required fields
-    metadata_required = ["name", "cyan_version"]
-    
-    # Datapoints required fields
-    datapoints_required = [
-        "prom", "registers", "word_size", "opcode_size", "operand_count", "operand_size", "reg_error", "ram_error", "io_error", "flags"
-    ]
-
-    # Check required metadata
-    for field in metadata_required:
-        if field not in configDict.get("metadata", {}):
-            log(f"Missing required metadata field: {field}", "FATAL")
-
-    # Check required datapoints
-    for field in datapoints_required:
-        if field not in configDict.get("datapoints", {}):
-            log(f"Missing required datapoints field: {field}", "FATAL")
-        
-    if configDict.get("metadata", {}).get("cyan_version") > version:
-        log(f"Config is too new. Expected {version}, got {configDict.get('metadata', {}).get('cyan_version')}", "ERROR")
+    errors = collectConfigErrors(configDict, version)
+    if len(errors) > 0:
+        log(f"Invalid config ({len(errors)} problem(s)):\n  " + "\n  ".join(errors), "ERROR", ConfigError)
 
     log("Configuration is valid.", "INFO")
     return True
 
+class CpuConfig:
+    """A validated, read only view of a configuration with typed fields and the derived values precomputed.
+
+    Fields are plain attributes, so reading one is a single attribute load instead of nested dict lookups. The original
+    dictionary is kept as raw (treat it as read only as well).
+    """
+
+    __slots__ = (
+        "raw", "name", "cyanVersion", "operations", "flags",
+        "ram", "prom", "registers", "wordSize", "wordMask",
+        "opcodeSize", "opcodeMask", "operandCount", "operandSize", "operandMask", "operandLimit",
+        "promWordSize", "promWordMask", "immediateSize", "immediateMask",
+        "ioCount", "ioSize", "ioMask", "regError", "ramError", "ioError",
+        "zeroRegister", "speed", "delay", "defaultTicks", "stackDepth", "callstackDepth", "stackError", "customRegs"
+    )
+
+    def __init__(self, configDict: dict, version: int = CYAN_VERSION) -> None:
+        """Validate a configuration dictionary and compile it.
+
+        Args:
+            configDict (dict): The configuration dictionary.
+            version (int, optional): The newest cyan_version this emulator supports. Defaults to CYAN_VERSION.
+        """
+        validateConfig(configDict, version)
+        metadata = configDict["metadata"]
+        datapoints = configDict["datapoints"]
+        fields = {
+            "raw" : configDict,
+            "name" : metadata["name"],
+            "cyanVersion" : metadata["cyan_version"],
+            "operations" : tuple(metadata["operations"]),
+            "flags" : tuple(getFlagNames(configDict)),
+            "ram" : datapoints.get("ram", 0),
+            "prom" : datapoints["prom"],
+            "registers" : datapoints["registers"],
+            "wordSize" : datapoints["word_size"],
+            "opcodeSize" : datapoints["opcode_size"],
+            "operandCount" : datapoints["operand_count"],
+            "operandSize" : datapoints["operand_size"],
+            "immediateSize" : datapoints.get("immediate_size", datapoints["operand_size"]),
+            "ioCount" : datapoints.get("io_count", 0),
+            "ioSize" : datapoints.get("io_size", 1),
+            "regError" : datapoints["reg_error"],
+            "ramError" : datapoints["ram_error"],
+            "ioError" : datapoints["io_error"],
+            "zeroRegister" : datapoints.get("zero_register", False),
+            "speed" : datapoints.get("speed"),
+            "delay" : datapoints.get("delay"),
+            "stackDepth" : datapoints.get("stack_depth", 0),
+            "callstackDepth" : datapoints.get("callstack_depth", 0),
+            "stackError" : datapoints.get("stack_error", datapoints["ram_error"]),
+            "customRegs" : tuple((reg["name"], reg["size"], reg["should_accumulate"], reg["error"]) for reg in configDict.get("custom_regs", {}).values())
+        }
+        fields["wordMask"] = (1 << fields["wordSize"]) - 1
+        fields["opcodeMask"] = (1 << fields["opcodeSize"]) - 1
+        fields["operandMask"] = (1 << fields["operandSize"]) - 1
+        fields["operandLimit"] = fields["operandMask"]
+        fields["promWordSize"] = fields["opcodeSize"] + fields["operandCount"] * fields["operandSize"]
+        fields["promWordMask"] = (1 << fields["promWordSize"]) - 1
+        fields["immediateMask"] = (1 << fields["immediateSize"]) - 1
+        fields["ioMask"] = (1 << fields["ioSize"]) - 1
+        fields["defaultTicks"] = fields["speed"] or fields["delay"] or 1
+        self.__setstate__(fields)
+
+    def __setattr__(self, name, value) -> None:
+        raise AttributeError(f"CpuConfig is read only (tried to set {name})")
+
+    def __delattr__(self, name) -> None:
+        raise AttributeError(f"CpuConfig is read only (tried to delete {name})")
+
+    def __getstate__(self) -> dict:
+        return {name : getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: dict) -> None:
+        for name in self.__slots__:
+            object.__setattr__(self, name, state[name])
+
+    def __repr__(self) -> str:
+        return f"CpuConfig({self.name!r}, word_size={self.wordSize}, prom={self.prom}, registers={self.registers}, ram={self.ram})"
+
 def getConfig(configPath: str) -> dict:
     """Returns a dict of the configuration from the given json file.
 
@@ -67,3 +260,101 @@ def getConfig(configPath: str) -> dict:
 
     with open(configPath, "r") as f:
         return json.load(f)
+
+# Configs loaded by this process, keyed by absolute path: (mtime_ns, size, CpuConfig)
+loadedConfigs = {}
+
+# Bump when CpuConfig works out its fields differently, so cached copies made by older code are compiled again
+CONFIG_CACHE_VERSION = 1
+
+class ConfigUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        """Only CpuConfig may be loaded from a cache file, anything else in the file is refused."""
+        if module == CpuConfig.__module__ and name == CpuConfig.__name__:
+            return CpuConfig
+        raise pickle.UnpicklingError(f"{module}.{name} isn't allowed in a config cache")
+
+def getConfigCacheFormat() -> tuple:
+    """Returns the tag a cache entry must have to be used: the cache version and the fields of CpuConfig."""
+    return (CONFIG_CACHE_VERSION, CpuConfig.__slots__)
+
+def getConfigCachePath(configPath: str) -> str:
+    """Returns where the compiled copy of a config file is cached: a __pycache__ folder next to it."""
+    folder, name = os.path.split(os.path.abspath(configPath))
+    return os.path.join(folder, "__pycache__", f"{name}.cyan-{CYAN_VERSION}.pickle")
+
+def loadConfig(configPath: str, useCache: bool = True) -> CpuConfig:
+    """Load, validate and compile a config file, reusing earlier work where the file hasn't changed.
+
+    Compiled configs are kept in memory for the process and pickled to a __pycache__ folder next to the file, so
+    other processes (like batch workers) can skip parsing and validation too. A cached copy is used when the file's
+    mtime and size match, or failing that, when the SHA-256 of its contents does. A cache file written for a different
+    cache version or CpuConfig layout, or one that can't be read, is ignored and the config is compiled again.
+
+    Args:
+        configPath (str): The absolute or relative path of the configuration file.
+        useCache (bool, optional): Set to False to always parse and validate the file. Defaults to True.
+
+    Returns:
+        CpuConfig: The compiled config.
+    """
+    path = os.path.abspath(configPath)
+    stat = os.stat(path)
+    if useCache:
+        cached = loadedConfigs.get(path)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    cachePath = getConfigCachePath(path)
+
+    cpuConfig = None
+    if useCache:
+        try:
+            with open(cachePath, "rb") as f:
+                entry = ConfigUnpickler(f).load()
+            if entry["format"] == getConfigCacheFormat() and entry["digest"] == digest and isinstance(entry["config"], CpuConfig):
+                cpuConfig = entry["config"]
+        except Exception as e:
+            if not isinstance(e, FileNotFoundError):
+                log(f"Ignoring the cached config at {cachePath}: {e}", "INFO")
+            cpuConfig = None
+
+    if cpuConfig is None:
+        try:
+            configDict = json.loads(raw)
+        except json.JSONDecodeError as e:
+            log(f"Invalid config ({configPath}):\n  Could not parse JSON: {e}", "ERROR", ConfigError)
+        cpuConfig = CpuConfig(configDict)
+        if useCache:
+            try:
+                os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+                temp = f"{cachePath}.{os.getpid()}.tmp"
+                with open(temp, "wb") as f:
+                    pickle.dump({"format" : getConfigCacheFormat(), "digest" : digest, "config" : cpuConfig}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp, cachePath)
+            except OSError as e:
+                log(f"Could not cache the compiled config at {cachePath}: {e}", "WARNING")
+    else:
+        log(f"Using the cached config for {configPath}.", "INFO")
+
+    loadedConfigs[path] = (stat.st_mtime_ns, stat.st_size, cpuConfig)
+    return cpuConfig
+
+def getFlagNames(configDict: dict) -> list[str]:
+    """Returns the flag names of a configuration. Entries written as one comma separated string ("zero, carry") are split up.
+
+    Args:
+        configDict (dict): The configuration dictionary.
+
+    Returns:
+        list[str]: The flag names in order.
+    """
+    names = []
+    for entry in configDict["datapoints"].get("flags", []):
+        for name in entry.split(","):
+            if name.strip() != "":
+                names.append(name.strip())
+    return names
@@ -0,0 +1,197 @@
+from utils import *
+
+# The accessors the debugger can watch, with the kind and direction they are
+WATCHED_ACCESSORS = {
+    "getReg" : ("registers", "read"),
+    "setReg" : ("registers", "write"),
+    "getRAM" : ("ram", "read"),
+    "setRAM" : ("ram", "write"),
+    "getIO" : ("io", "read"),
+    "setIO" : ("io", "write")
+}
+
+class Debugger:
+    def __init__(self, proc, traceSize: int = 64) -> None:
+        """PC breakpoints (optionally conditional), register/RAM/IO watchpoints and a trace of the last instructions.
+
+        The debugger only hooks into the processor while runUntilEvent() is running. Read accessors are only wrapped
+        for kinds that have a read watchpoint, and every watch check is a set lookup, so plain run() is unaffected.
+
+        Args:
+            proc (Processor): The processor to debug.
+            traceSize (int, optional): How many executed instructions the trace keeps. Defaults to 64.
+        """
+        self.proc = proc
+        self.breakpoints = set()
+        self.conditions = {}
+        self.watchpoints = {key : set() for key in WATCHED_ACCESSORS.values()}
+        self.traceSize = traceSize
+        self.clearTrace()
+        self.event = None
+        self.writes = None
+        self.shadowed = {}
+
+    def addBreakpoint(self, pc: int, condition = None) -> None:
+        """Stop before the instruction at pc runs.
+
+        Args:
+            pc (int): The program counter to stop at.
+            condition (function, optional): Only stop if condition(proc) returns True. Defaults to None.
+        """
+        self.breakpoints.add(pc)
+        if condition is None:
+            self.conditions.pop(pc, None)
+        else:
+            self.conditions[pc] = condition
+
+    def removeBreakpoint(self, pc: int) -> None:
+        self.breakpoints.discard(pc)
+        self.conditions.pop(pc, None)
+
+    def addWatchpoint(self, kind: str, address: int, access: str = "write") -> None:
+        """Stop after any instruction that accesses an address.
+
+        Args:
+            kind (str): "registers", "ram" or "io".
+            address (int): The address to watch.
+            access (str, optional): "read", "write" or "both". Defaults to "write".
+        """
+        for direction in (("read", "write") if access == "both" else (access,)):
+            if (kind, direction) not in self.watchpoints:
+                log(f"Unable to watch {direction}s of {kind}", "ERROR")
+            self.watchpoints[(kind, direction)].add(address)
+
+    def removeWatchpoint(self, kind: str, address: int, access: str = "write") -> None:
+        for direction in (("read", "write") if access == "both" else (access,)):
+            self.watchpoints[(kind, direction)].discard(address)
+
+    def clearTrace(self) -> None:
+        self.trace = [None] * self.traceSize
+        self.traceIndex = 0
+
+    def getTrace(self) -> list[dict]:
+        """Returns the traced instructions, oldest first. Each has the pc, opcode, operands and writes (kind, address, data)."""
+        if self.traceSize == 0:
+            return []
+        records = self.trace[self.traceIndex:] + self.trace[:self.traceIndex]
+        return [{"pc" : pc, "opcode" : opcode, "operands" : operands, "writes" : writes} for pc, opcode, operands, writes in (r for r in records if r is not None)]
+
+    def dumpTrace(self, filePath: str = None) -> str:
+        """Returns the trace as text, one instruction per line, and writes it to filePath if given."""
+        lines = []
+        for record in self.getTrace():
+            writes = ", ".join(f"{kind}[{address}]={data}" for kind, address, data in record["writes"])
+            lines.append(f"{record['pc']:>6}: {record['opcode']} {' '.join(str(operand) for operand in record['operands'])}" + (f" -> {writes}" if writes else ""))
+        text = "\n".join(lines)
+        if filePath is not None:
+            with open(filePath, "w") as f:
+                f.write(text + "\n")
+        return text
+
+    def install(self) -> None:
+        proc = self.proc
+        self.shadowed = {}
+        for name, (kind, direction) in WATCHED_ACCESSORS.items():
+            watched = self.watchpoints[(kind, direction)]
+            if direction == "read" and len(watched) == 0:
+                continue
+            self.shadowed[name] = proc.__dict__.get(name)
+            setattr(proc, name, self.wrapAccessor(getattr(proc, name), kind, direction, watched))
+        proc.instrumentation["debugger"] = self
+
+    def uninstall(self) -> None:
+        for name, previous in self.shadowed.items():
+            if previous is None:
+                self.proc.__dict__.pop(name, None)
+            else:
+                self.proc.__dict__[name] = previous
+        self.shadowed = {}
+        self.proc.instrumentation.pop("debugger", None)
+
+    def wrapAccessor(self, accessor, kind: str, direction: str, watched: set):
+        if direction == "read":
+            def watchedRead(address, *args):
+                value = accessor(address, *args)
+                if address in watched and self.event is None:
+                    self.event = {"type" : "watchpoint", "kind" : kind, "access" : "read", "address" : address, "value" : value}
+                return value
+            return watchedRead
+
+        def watchedWrite(address, data, *args):
+            result = accessor(address, data, *args)
+            if self.writes is not None:
+                self.writes.append((kind, address, data))
+            if address in watched and self.event is None:
+                self.event = {"type" : "watchpoint", "kind" : kind, "access" : "write", "address" : address, "value" : data}
+            return result
+        return watchedWrite
+
+    def runUntilEvent(self, maxInstructions: int = None) -> dict:
+        """Run until a breakpoint or watchpoint is hit, the processor stops or errors, or maxInstructions have run.
+
+        A breakpoint on the PC the processor is resuming from is skipped, so calling this again continues.
+
+        Args:
+            maxInstructions (int, optional): Stop after this many instructions. Defaults to None (no limit).
+
+        Returns:
+            dict: The event, with a "type" ("breakpoint", "watchpoint", "halted", "end_of_program",
+                "instruction_limit" or "error") and the pc and instruction count it happened at. Exceptions other than
+                CyanError are raised again after the trace is logged.
+        """
+        proc = self.proc
+        program = proc.parsedProgram
+        if program is None:
+            log("No program loaded.", "WARNING")
+            return None
+
+        self.event = None
+        limit = None if maxInstructions is None else proc.instructionCount + maxInstructions
+        proc.isRunning = True
+        proc.exitReason = None
+        resuming = True
+        self.install()
+        try:
+            while proc.isRunning:
+                pc = proc.state["pc"]
+                if not resuming and pc in self.breakpoints:
+                    condition = self.conditions.get(pc)
+                    if condition is None or condition(proc):
+                        self.event = {"type" : "breakpoint"}
+                        break
+                resuming = False
+                if limit is not None and proc.instructionCount >= limit:
+                    self.event = {"type" : "instruction_limit"}
+                    break
+
+                if self.traceSize > 0 and 0 <= pc < len(program) and program[pc] is not None:
+                    self.writes = []
+                    self.trace[self.traceIndex] = (pc, program[pc][0].__name__, program[pc][1], self.writes)
+                    self.traceIndex = (self.traceIndex + 1) % self.traceSize
+                proc.executeLine()
+                self.writes = None
+                if self.event is not None:
+                    break
+            else:
+                if proc.exitReason is None:
+                    proc.exitReason = "halted"
+                self.event = {"type" : proc.exitReason}
+        except CyanError as e:
+            self.event = {"type" : "error", "message" : str(e)}
+            proc.isRunning = False
+            proc.exitReason = "error"
+            log(f"Error at pc {proc.state['pc']}, last instructions:\n{self.dumpTrace()}", "WARNING")
+        except Exception as e:
+            # A bug in an instruction class (e.g. an IndexError from a bad address): keep the trace, then let it through
+            self.event = {"type" : "error", "message" : repr(e)}
+            proc.isRunning = False
+            proc.exitReason = "error"
+            log(f"{type(e).__name__} at pc {proc.state['pc']}, last instructions:\n{self.dumpTrace()}", "WARNING")
+            raise
+        finally:
+            self.writes = None
+            self.uninstall()
+
+        self.event["pc"] = proc.state["pc"]
+        self.event["instructions"] = proc.instructionCount
+        return self.event
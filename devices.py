@@ -0,0 +1,141 @@
+import asyncio
+from collections import deque
+from utils import *
+
+class IOWouldBlock(Exception):
+    """Raised by Processor.getIO() inside runAsync() when a bound device has no data yet."""
+
+    def __init__(self, port: int) -> None:
+        super().__init__(f"IO port {port} has no data")
+        self.port = port
+
+class Device:
+    pollInterval = 0.01
+
+    def read(self) -> int | None:
+        """Returns the next input value, or None if there isn't one yet (the port then keeps its last value, or blocks in runAsync())."""
+        return None
+
+    def write(self, value: int) -> None:
+        """Receives a value the processor wrote to the port."""
+        pass
+
+    async def waitReadable(self) -> None:
+        """Wait until read() may have data. The default polls every pollInterval seconds."""
+        await asyncio.sleep(self.pollInterval)
+
+    def close(self) -> None:
+        pass
+
+class QueueDevice(Device):
+    def __init__(self, inputs: list[int] = None) -> None:
+        """An in-process queue: values fed with put() are read by the processor, values it writes collect in outputs."""
+        self.inputs = deque(inputs or [])
+        self.outputs = deque()
+        self.ready = asyncio.Event()
+
+    def put(self, value: int) -> None:
+        self.inputs.append(value)
+        self.ready.set()
+
+    def read(self) -> int | None:
+        if len(self.inputs) == 0:
+            return None
+        return self.inputs.popleft()
+
+    def write(self, value: int) -> None:
+        self.outputs.append(value)
+
+    async def waitReadable(self) -> None:
+        if len(self.inputs) > 0:
+            return
+        self.ready.clear()
+        await self.ready.wait()
+
+class FileDevice(Device):
+    def __init__(self, inputPath: str = None, outputPath: str = None) -> None:
+        """Reads input bytes from a file (one byte per read, blocking at the end like `tail -f`) and writes each value
+        the processor outputs to another file as a line of text."""
+        self.input = None if inputPath is None else open(inputPath, "rb")
+        self.output = None if outputPath is None else open(outputPath, "a")
+
+    def read(self) -> int | None:
+        if self.input is None:
+            return None
+        data = self.input.read(1)
+        return data[0] if len(data) == 1 else None
+
+    def write(self, value: int) -> None:
+        if self.output is not None:
+            self.output.write(f"{value}\n")
+            self.output.flush()
+
+    def close(self) -> None:
+        for f in (self.input, self.output):
+            if f is not None:
+                f.close()
+
+class SocketDevice(Device):
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """A TCP connection: each received byte is one input value and each output value is sent as one byte.
+        Use `await SocketDevice.connect(host, port)`."""
+        self.reader = reader
+        self.writer = writer
+        self.inputs = deque()
+        self.ready = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, host: str, port: int) -> "SocketDevice":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def receive(self) -> None:
+        while True:
+            data = await self.reader.read(4096)
+            if len(data) == 0:
+                break
+            self.inputs.extend(data)
+            self.ready.set()
+
+    def read(self) -> int | None:
+        if len(self.inputs) == 0:
+            return None
+        return self.inputs.popleft()
+
+    def write(self, value: int) -> None:
+        self.writer.write(bytes([value & 0xFF]))
+
+    async def waitReadable(self) -> None:
+        if len(self.inputs) > 0:
+            return
+        self.ready.clear()
+        await self.ready.wait()
+
+    def close(self) -> None:
+        self.task.cancel()
+        self.writer.close()
+
+class DisplayDevice(Device):
+    def __init__(self, width: int = 32, text: bool = True) -> None:
+        """A simulated character display. Written values are appended to lines of width characters (as characters if
+        text is True, otherwise as numbers)."""
+        self.width = width
+        self.text = text
+        self.cells = []
+
+    def write(self, value: int) -> None:
+        self.cells.append(chr(value) if self.text else f"{value} ")
+
+    def render(self) -> str:
+        content = "".join(self.cells)
+        return "\n".join(content[i:i + self.width] for i in range(0, len(content), self.width))
+
+class KeyboardDevice(QueueDevice):
+    def __init__(self) -> None:
+        """A simulated keyboard. press() queues the key codes of a string (or a single code) for the processor to read."""
+        super().__init__()
+
+    def press(self, keys: str | int) -> None:
+        for key in ([keys] if isinstance(keys, int) else [ord(key) for key in keys]):
+            self.put(key)
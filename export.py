@@ -0,0 +1,149 @@
+from utils import *
+from memory import *
+from snapshot import *
+
+EXPORT_FORMATS = ("pretty", "json", "csv", "binary", "repr")
+
+# name, title in the pretty format, cells per row in the pretty format, separator after a cell in the pretty format
+EXPORT_BANKS = (
+    ("ram", "RAM", 10, " | "),
+    ("prom", "Program ROM", 10, "  | "),
+    ("registers", "Registers", 3, "  | "),
+    ("io", "I/O Ports", 3, "  | "),
+    ("stack", "Stack", 10, "  | "),
+    ("callstack", "Call Stack", 10, "  | ")
+)
+
+# Words per chunk when a bank is written out
+CHUNK_SIZE = 4096
+
+def getExportedWords(bank: MemoryBank, diff: bool) -> tuple[list[int], list[int] | None]:
+    """Returns the words of a bank to export, and their addresses if only some of them are (None means all of them).
+
+    Stacks only export the words that are on them. In diff mode, only the words written since the last export are
+    exported. The first diff export of a bank starts tracking writes to it and exports everything.
+    """
+    if not diff:
+        return (bank.items() if isinstance(bank, Stack) else bank.data), None
+    if bank.dirty is None:
+        bank.trackChanges()
+        return (bank.items() if isinstance(bank, Stack) else bank.data), None
+    limit = bank.pointer if isinstance(bank, Stack) else bank.size
+    addresses = [address for address in bank.getChanges() if address < limit]
+    return [bank.data[address] for address in addresses], addresses
+
+def writePrettyBank(f, bank: MemoryBank, title: str, perRow: int, separator: str, diff: bool, first: bool) -> None:
+    if isinstance(bank, Stack):
+        if bank.size == 0:
+            return
+        title += f" ({bank.pointer}/{bank.size}, bottom first{', changed' if diff else ''})"
+    elif diff:
+        title += " (changed)"
+    if not first:
+        f.write("\n")
+    f.write(f"{title}:\n| ")
+
+    words, addresses = getExportedWords(bank, diff)
+    width = len(str(bank.size)) + 3
+    count = len(words)
+    for start in range(0, count, perRow):
+        end = min(start + perRow, count)
+        cells = []
+        for i in range(start, end):
+            address = i if addresses is None else addresses[i]
+            cells.append(f"{address}:  {str(words[i]).rjust(width - len(str(address)))}{separator}")
+        f.write("".join(cells))
+        if end - start == perRow:
+            f.write("\n| ")
+    f.write("\n")
+
+def writePretty(proc, f, diff: bool) -> None:
+    for index, (name, title, perRow, separator) in enumerate(EXPORT_BANKS):
+        writePrettyBank(f, proc.state[name], title, perRow, separator, diff, index == 0)
+
+    f.write("\nFlags:\n| ")
+    for name, value in proc.getFlags().items():
+        f.write(f"{name}: {value}\n")
+    f.write("\n")
+
+def writeJSONWords(f, words) -> None:
+    f.write("[")
+    for start in range(0, len(words), CHUNK_SIZE):
+        if start > 0:
+            f.write(", ")
+        f.write(", ".join(map(str, words[start:start + CHUNK_SIZE])))
+    f.write("]")
+
+def writeJSON(proc, f, diff: bool) -> None:
+    f.write(f'{{"pc": {proc.state["pc"]}, "instructions": {proc.instructionCount}, "ticks": {proc.ticks}, "diff": {"true" if diff else "false"}')
+    for name, title, perRow, separator in EXPORT_BANKS:
+        words, addresses = getExportedWords(proc.state[name], diff)
+        f.write(f', "{name}": ')
+        if addresses is None:
+            writeJSONWords(f, words)
+        else:
+            f.write("{" + ", ".join(f'"{address}": {word}' for address, word in zip(addresses, words)) + "}")
+    f.write(', "custom_regs": {' + ", ".join(f'"{name}": {reg.get()}' for name, reg in proc.state["custom_regs"].items()) + "}")
+    f.write(', "flags": {' + ", ".join(f'"{name}": {"true" if value else "false"}' for name, value in proc.getFlags().items()) + "}")
+    f.write("}\n")
+
+def writeCSV(proc, f, diff: bool) -> None:
+    f.write("section,address,value\n")
+    f.write(f"pc,,{proc.state['pc']}\n")
+    for name, title, perRow, separator in EXPORT_BANKS:
+        words, addresses = getExportedWords(proc.state[name], diff)
+        if addresses is None:
+            addresses = range(len(words))
+        for start in range(0, len(words), CHUNK_SIZE):
+            f.write("".join(f"{name},{address},{word}\n" for address, word in zip(addresses[start:start + CHUNK_SIZE], words[start:start + CHUNK_SIZE])))
+    for name, reg in proc.state["custom_regs"].items():
+        f.write(f"custom_regs,{name},{reg.get()}\n")
+    for name, value in proc.getFlags().items():
+        f.write(f"flags,{name},{1 if value else 0}\n")
+
+def exportState(proc, filePath: str, format: str = "pretty", diff: bool = False, bufferSize: int = 1 << 16) -> None:
+    """Stream the state of a processor to a file through a buffered writer, one section at a time.
+
+    Args:
+        proc (Processor): The processor to export.
+        filePath (str): The file to write.
+        format (str, optional): "pretty" (the table written by exportState(path, True)), "json", "csv", "binary" (the
+            snapshot format) or "repr" (str() of the state dict). Defaults to "pretty".
+        diff (bool, optional): Only write the words of each bank written since the last diff export or snapshot. Not
+            available for the binary and repr formats. Defaults to False.
+        bufferSize (int, optional): The size of the write buffer in bytes. Defaults to 64 KiB.
+    """
+    if format not in EXPORT_FORMATS:
+        log(f"Unknown export format: {format}. Use one of {', '.join(EXPORT_FORMATS)}", "ERROR")
+    if diff and format in ("binary", "repr"):
+        log(f"Diff exports aren't available in the {format} format.", "ERROR")
+
+    if format == "binary":
+        with open(filePath, "wb", buffering=bufferSize) as f:
+            writeSnapshot(proc, f)
+        clearChanges(proc)
+        return
+
+    with open(filePath, "w", buffering=bufferSize) as f:
+        if format == "pretty":
+            writePretty(proc, f, diff)
+        elif format == "json":
+            writeJSON(proc, f, diff)
+        elif format == "csv":
+            writeCSV(proc, f, diff)
+        else:
+            f.write(str(proc.state))
+    clearChanges(proc)
+
+def clearChanges(proc) -> None:
+    """Forget the writes recorded for diff exports, on every bank that records them."""
+    for name, title, perRow, separator in EXPORT_BANKS:
+        if proc.state[name].dirty is not None:
+            proc.state[name].clearChanges()
+
+def markChanged(proc) -> None:
+    """Mark every word as written on every bank that records writes, e.g. after restoring a snapshot."""
+    for name, title, perRow, separator in EXPORT_BANKS:
+        bank = proc.state[name]
+        if bank.dirty is not None:
+            bank.dirty = bytearray(b"\x01") * bank.size
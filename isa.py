@@ -0,0 +1,81 @@
+import os
+import importlib.util
+from utils import *
+from config import *
+
+def resolveInstructionsFile(instructionsFile: str) -> str:
+    """Returns the path of an instructions file. Names are looked up in the configGroup folder first, then used as a path."""
+    inConfigGroup = os.path.join(os.getcwd(), "configGroup", instructionsFile)
+    if os.path.isfile(inConfigGroup):
+        return inConfigGroup
+    return instructionsFile
+
+class InstructionSet:
+    def __init__(self, path: str, config: dict) -> None:
+        """The instructions file of a processor, imported once and checked against its config.
+
+        Args:
+            path (str): The path of the instructions file.
+            config (dict): The configuration dictionary for the processor.
+        """
+        self.path = path
+        self.config = config
+        self.module = None
+        self.modified = None
+        self.opcodes = {}
+        self.flags = {}
+        self.eagerFlags = []
+        self.load()
+
+    def load(self) -> None:
+        """Import the instructions file and build the opcode and flag dispatch dicts.
+
+        Every missing or malformed instruction class and flag class is reported together.
+        """
+        log(f"Loading instruction set from {self.path}", "INFO")
+        moduleName = "cyan_isa_" + os.path.splitext(os.path.basename(self.path))[0]
+        spec = importlib.util.spec_from_file_location(moduleName, self.path)
+        if spec is None or not os.path.isfile(self.path):
+            log(f"Unable to find instructions file {self.path}", "ERROR")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        errors = []
+        opcodes = {}
+        for operation in self.config["metadata"]["operations"]:
+            instr_class = getattr(module, operation.upper(), None)
+            if instr_class is None:
+                errors.append(f"Missing instruction class {operation.upper()} for operation {operation}")
+                continue
+            for attribute in ("operand_count", "operand_sizes", "signage"):
+                if not hasattr(instr_class, attribute):
+                    errors.append(f"Instruction class {operation.upper()} has no {attribute}")
+            opcodes[operation.lower()] = instr_class
+
+        flags = {}
+        eagerFlags = []
+        for flag in getFlagNames(self.config):
+            flag_class = getattr(module, flag, None)
+            if flag_class is None or not hasattr(flag_class, "get"):
+                errors.append(f"Missing flag class {flag} with a get(value) method")
+                continue
+            flags[flag] = flag_class.get
+            if getattr(flag_class, "eager", False):
+                eagerFlags.append(flag)
+
+        if len(errors) > 0:
+            log(f"Invalid instruction set {self.path}:\n" + "\n".join(errors), "ERROR")
+
+        self.module = module
+        self.modified = os.path.getmtime(self.path)
+        self.opcodes = opcodes
+        self.flags = flags
+        self.eagerFlags = eagerFlags
+
+    def isStale(self) -> bool:
+        """Check if the instructions file has changed on disk since it was loaded."""
+        return os.path.getmtime(self.path) != self.modified
+
+    def reload(self) -> None:
+        """Import the instructions file again, picking up any changes."""
+        self.load()
@@ -1,11 +1,11 @@
+import os
 from config import *
 from processor import *
 
 # Define constants
-CYAN_VERSION = 1
-CONFIG_PATH = ".\configGroup\config.json"
+CONFIG_PATH = os.path.join(".", "configGroup", "config.json")
 
-config = getConfig(CONFIG_PATH)
+config = loadConfig(CONFIG_PATH)
 
 proc = Processor(config)
 
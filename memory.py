@@ -1,9 +1,20 @@
+import sys
+from array import array
+from itertools import compress
 from utils import *
 
+def getTypecode(wordSize: int) -> str | None:
+    """Returns the smallest unsigned array typecode that can hold a word of the given size, or None if there isn't one."""
+    for typecode in ("B", "H", "I", "L", "Q"):
+        if array(typecode).itemsize * 8 >= wordSize:
+            return typecode
+    return None
+
 class Memory:
     def __init__(self, address: int | str, wordSize: int, error: bool = False) -> None:
         self.address = address
         self.wordSize = wordSize
+        self.mask = (1 << wordSize) - 1
         self.data = 0
         self.error = error
 
@@ -14,10 +25,10 @@ class Memory:
         return self.data
     
     def set(self, data: int) -> None:
-        if data < (2 ** self.wordSize):
+        if 0 <= data <= self.mask:
             self.data = data
         elif not self.error:
-            self.data = (data.bit_length() - self.wordSize.bit_length()) & -1 << data
+            self.data = data & self.mask
         else:
             log("Data out of range", "ERROR")
 
@@ -45,17 +56,189 @@ class AccumulatedMemory(Memory):
         self.address = address
 
     def set(self, data: int) -> None:
-        overFlow = False
-        
-        self.data += data
-
-        if self.data > (2 ** self.wordSize) - 1:
-            overFlow = True
-        
-        if overFlow:
-            if not self.error:
-                self.data = data % (2 ** self.wordSize)
-            else:
-                log("Data out of range", "ERROR")
-
-        
\ No newline at end of file
+        total = self.data + data
+
+        if 0 <= total <= self.mask:
+            self.data = total
+        elif not self.error:
+            self.data = total & self.mask
+        else:
+            log("Data out of range", "ERROR")
+
+class MemoryBank:
+    def __init__(self, name: str, size: int, wordSize: int, error: bool = False) -> None:
+        """A bank of equally sized words stored in a single array, with a lock bit per word.
+
+        Words that fit in 64 bits are stored in an unsigned array.array, wider words fall back to a list of ints.
+
+        Args:
+            name (str): The name of the bank, used in messages.
+            size (int): The number of words in the bank.
+            wordSize (int): The size of each word in bits.
+            error (bool, optional): Error on overflow instead of wrapping. Defaults to False.
+        """
+        self.name = name
+        self.size = size
+        self.wordSize = wordSize
+        self.mask = (1 << wordSize) - 1
+        self.error = error
+        self.typecode = getTypecode(wordSize)
+        if self.typecode is not None:
+            self.data = array(self.typecode, [0]) * size
+        else:
+            self.data = [0] * size
+        self.locks = bytearray(size)
+        self.lockCount = 0
+        self.dirty = None
+
+    def __repr__(self):
+        return f"MemoryBank(Name={self.name}, Size={self.size}, Data={list(self.data)})"
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, address: int) -> int:
+        return self.data[address]
+
+    def get(self, address: int) -> int:
+        return self.data[address]
+
+    def set(self, address: int, data: int) -> None:
+        if self.lockCount and self.locks[address]:
+            log("Attemped to write to locked memory", "WARNING")
+            return
+        if 0 <= data <= self.mask:
+            self.data[address] = data
+        elif not self.error:
+            self.data[address] = data & self.mask
+        else:
+            log(f"Data out of range in {self.name} at {address}", "ERROR")
+
+    def setTracked(self, address: int, data: int) -> None:
+        MemoryBank.set(self, address, data)
+        self.dirty[address] = 1
+
+    def trackChanges(self) -> None:
+        """Start recording which words are written, in a bitmap with a byte per word (see getChanges()).
+
+        Until this is called, writes aren't tracked and cost nothing extra.
+        """
+        if self.dirty is None:
+            self.dirty = bytearray(self.size)
+            self.set = self.setTracked
+
+    def getChanges(self) -> list[int]:
+        """Returns the addresses written since tracking started or the last clearChanges(), in order."""
+        return list(compress(range(self.size), self.dirty))
+
+    def clearChanges(self) -> None:
+        self.dirty = bytearray(self.size)
+
+    def lock(self, address: int) -> None:
+        if not self.locks[address]:
+            self.locks[address] = 1
+            self.lockCount += 1
+
+    def unlock(self, address: int) -> None:
+        if self.locks[address]:
+            self.locks[address] = 0
+            self.lockCount -= 1
+
+    def isLocked(self, address: int) -> bool:
+        return self.locks[address] == 1
+
+    def toBytes(self) -> bytes | memoryview:
+        """Returns the raw words of the bank. Array backed banks are returned as a view in native byte order without copying."""
+        if self.typecode is not None:
+            return memoryview(self.data).cast("B")
+        width = (self.wordSize + 7) // 8
+        return b"".join(word.to_bytes(width, "little") for word in self.data)
+
+    def loadBytes(self, raw, byteorder: str = sys.byteorder, start: int = None) -> None:
+        """Replace the words of the bank with raw words in the layout written by toBytes().
+
+        Args:
+            raw (bytes-like): The raw words, which must be exactly the size of the bank unless start is given.
+            byteorder (str, optional): The byte order raw was written in. Defaults to the native byte order.
+            start (int, optional): Only replace the words from this address on, as many as raw holds. Defaults to None.
+        """
+        if self.typecode is not None:
+            data = array(self.typecode)
+            data.frombytes(raw)
+            if byteorder != sys.byteorder:
+                data.byteswap()
+        else:
+            width = (self.wordSize + 7) // 8
+            data = [int.from_bytes(raw[i:i + width], "little") for i in range(0, len(raw), width)]
+        if start is None:
+            if len(data) != self.size:
+                log(f"Expected {self.size} words for {self.name}, got {len(data)}", "ERROR")
+            self.data[:] = data
+        else:
+            if start < 0 or start + len(data) > self.size:
+                log(f"{len(data)} words don't fit in {self.name} at {start}", "ERROR")
+            self.data[start:start + len(data)] = data
+
+    def clear(self, start: int = 0) -> None:
+        """Zero every word from start to the end of the bank. Lock bits are unchanged."""
+        if start < self.size:
+            self.data[start:] = (array(self.typecode, [0]) if self.typecode is not None else [0]) * (self.size - start)
+
+    def loadLocks(self, raw) -> None:
+        """Replace the lock bits of the bank with one byte per word."""
+        if len(raw) != self.size:
+            log(f"Expected {self.size} lock bits for {self.name}, got {len(raw)}", "ERROR")
+        self.locks[:] = raw
+        self.lockCount = self.size - self.locks.count(0)
+
+class Stack(MemoryBank):
+    def __init__(self, name: str, size: int, wordSize: int, error: bool = False) -> None:
+        """A fixed capacity stack stored in a preallocated MemoryBank. pointer is the number of words on the stack.
+
+        Values wrap or error like any other bank. Pushing onto a full stack (or popping an empty one) wraps the pointer
+        around like a circular buffer, or raises an error if error is set.
+
+        Args:
+            name (str): The name of the stack, used in messages.
+            size (int): The maximum number of words on the stack.
+            wordSize (int): The size of each word in bits.
+            error (bool, optional): Error on overflow and underflow instead of wrapping. Defaults to False.
+        """
+        super().__init__(name, size, wordSize, error)
+        self.pointer = 0
+
+    def __repr__(self):
+        return f"Stack(Name={self.name}, Size={self.size}, Pointer={self.pointer}, Data={self.items()})"
+
+    def push(self, data: int) -> None:
+        pointer = self.pointer
+        if pointer >= self.size:
+            if self.error or self.size == 0:
+                log(f"{self.name} overflow ({self.size} words)", "ERROR")
+            pointer = 0
+        self.set(pointer, data)
+        self.pointer = pointer + 1
+
+    def pop(self) -> int:
+        pointer = self.pointer
+        if pointer <= 0:
+            if self.error or self.size == 0:
+                log(f"{self.name} underflow", "ERROR")
+            pointer = self.size
+        pointer -= 1
+        self.pointer = pointer
+        return self.data[pointer]
+
+    def peek(self) -> int:
+        if self.pointer <= 0:
+            if self.error or self.size == 0:
+                log(f"{self.name} underflow", "ERROR")
+            return self.data[self.size - 1]
+        return self.data[self.pointer - 1]
+
+    def items(self) -> list[int]:
+        """Returns the words on the stack, bottom first."""
+        return list(self.data[:self.pointer])
@@ -0,0 +1,194 @@
+from collections import Counter
+from utils import *
+
+class PeepholeOptimizer:
+    # Longest pattern first, so a triple wins over the pair it starts with
+    lengths = (3, 2)
+
+    def __init__(self, proc) -> None:
+        """Fuses frequent runs of two or three adjacent instructions into superinstructions, and drops writes to a
+        locked zero register, for run(optimize=True).
+
+        Each superinstruction is a generated function stored at the PC of its first instruction, so a run of instructions
+        is dispatched once. The entries of the instructions inside a pattern are left as they are, so jumping into the
+        middle of one runs the plain instructions from there. The PC, instruction count and ticks are updated exactly as
+        the interpreter does, and a superinstruction exits early if an instruction moves the PC or stops the processor.
+
+        Args:
+            proc (Processor): The processor whose loaded program is optimized.
+        """
+        self.proc = proc
+        self.table = None
+        self.program = None
+        self.patterns = Counter()
+        self.sites = {}
+        self.dropped = []
+
+    def isStale(self) -> bool:
+        """Check if the loaded program changed since optimize() last ran."""
+        return self.program is not self.proc.parsedProgram
+
+    def canDrop(self, entry: tuple) -> bool:
+        """Check if an instruction only writes the locked zero register, so running it changes nothing.
+
+        The class must declare its effects with `writes`, a list of ("reg", operand index) pairs, and `reads`, which may
+        only name registers, and not modify the PC. Classes that also set flags should list ("flags", None) in `writes`,
+        and ones that read RAM, IO or a stack should list it in `reads` (a device read takes input, and RAM reads go
+        through the cache), which stops them being dropped. A class without `reads` or `writes` is never dropped.
+        """
+        instr_class, operands = entry
+        reads = getattr(instr_class, "reads", None)
+        writes = getattr(instr_class, "writes", None)
+        if reads is None or writes is None or getattr(instr_class, "modifies_pc", False) or not self.proc.cpu.zeroRegister:
+            return False
+        if any(kind != "reg" for kind, index in reads):
+            return False
+        if not self.proc.state["registers"].isLocked(0):
+            return False
+        return len(writes) > 0 and all(kind == "reg" and operands[index] == 0 for kind, index in writes)
+
+    def getPattern(self, pc: int, length: int) -> tuple | None:
+        """Returns the opcode names of the instructions from pc if they can be fused into one superinstruction.
+
+        Every instruction must be there (no comments in between) and only the last one may declare `modifies_pc`.
+        """
+        program = self.proc.parsedProgram
+        if pc + length > len(program):
+            return None
+        entries = program[pc:pc + length]
+        if any(entry is None for entry in entries):
+            return None
+        if any(getattr(entry[0], "modifies_pc", False) for entry in entries[:-1]):
+            return None
+        return tuple(entry[0].__name__ for entry in entries)
+
+    def optimize(self, profiler=None, maxPatterns: int = 8, minCount: int = 1) -> dict:
+        """Build the superinstruction table for the loaded program.
+
+        Args:
+            profiler (Profiler, optional): Weight each pattern by how often its first instruction ran in a profiling
+                run, instead of how often it appears in the program. Defaults to None.
+            maxPatterns (int, optional): The most distinct patterns to fuse. Defaults to 8.
+            minCount (int, optional): Skip patterns seen (or run) fewer times than this. Defaults to 1.
+
+        Returns:
+            dict: The report, see getReport().
+        """
+        proc = self.proc
+        program = proc.parsedProgram
+        if program is None:
+            log("No program loaded.", "WARNING")
+            return None
+
+        counts = Counter()
+        for pc in range(len(program)):
+            weight = 1 if profiler is None else profiler.pcCounts.get(pc, 0)
+            if weight == 0:
+                continue
+            for length in self.lengths:
+                pattern = self.getPattern(pc, length)
+                if pattern is not None:
+                    counts[pattern] += weight
+        chosen = {pattern for pattern, count in counts.most_common(maxPatterns) if count >= minCount}
+
+        table = [None] * len(program)
+        self.patterns = Counter()
+        self.sites = {}
+        self.dropped = []
+        for pc in range(len(program)):
+            length = 1
+            for candidate in self.lengths:
+                if self.getPattern(pc, candidate) in chosen:
+                    length = candidate
+                    break
+            if program[pc] is None:
+                continue
+            drops = [self.canDrop(program[index]) for index in range(pc, pc + length)]
+            if length == 1 and not drops[0]:
+                continue
+            if drops[0]:
+                self.dropped.append(pc)
+            if length > 1:
+                key = self.getPattern(pc, length)
+                pattern = "+".join(key)
+                self.patterns[pattern] = counts[key]
+                self.sites.setdefault(pattern, []).append(pc)
+            table[pc] = self.compileSite(pc, length, drops)
+
+        self.table = table
+        self.program = program
+        log(f"Optimized program: {sum(len(sites) for sites in self.sites.values())} superinstruction(s), {len(self.dropped)} dropped write(s).", "INFO")
+        return self.getReport()
+
+    def compileSite(self, start: int, length: int, drops: list[bool]):
+        """Generate the function for the superinstruction (or single dropped instruction) at start. If an instruction
+        raises, the ones before it are still counted and timed."""
+        proc = self.proc
+        program = proc.parsedProgram
+        namespace = {"proc" : proc, "icache" : proc.icache}
+        lines = []
+        doneTicks = []
+
+        ticks = 0
+        for count, pc in enumerate(range(start, start + length), 1):
+            instr_class, operands = program[pc]
+            if pc != start:
+                lines.append(f"    state['pc'] = {pc}")
+            lines.append(f"    done = {count - 1}")
+            doneTicks.append(ticks)
+            ticks += proc.instructionTicks[pc]
+            if drops[count - 1]:
+                # A write to the locked zero register: counted and timed, but there is nothing to do
+                if proc.icache is not None:
+                    lines.append(f"    proc.ticks += icache.access({pc})")
+                continue
+
+            compile_ = getattr(instr_class, "compile", None)
+            if compile_ is not None:
+                namespace[f"f{count}"] = compile_(proc, operands)
+                lines.append(f"    f{count}()")
+            else:
+                namespace[f"c{count}"] = instr_class
+                namespace[f"o{count}"] = operands
+                lines.append(f"    c{count}(proc, o{count})")
+            if proc.icache is not None:
+                lines.append(f"    proc.ticks += icache.access({pc})")
+
+            lines.append(f"    if state['pc'] != {pc}:")
+            lines.append(f"        proc.instructionCount += {count}")
+            lines.append(f"        proc.ticks += {ticks}")
+            lines.append(f"        return")
+            lines.append(f"    if not proc.isRunning:")
+            lines.append(f"        state['pc'] = {pc + 1}")
+            lines.append(f"        proc.instructionCount += {count}")
+            lines.append(f"        proc.ticks += {ticks}")
+            lines.append(f"        return")
+
+        lines.append(f"    state['pc'] = {start + length}")
+        lines.append(f"    proc.instructionCount += {length}")
+        lines.append(f"    proc.ticks += {ticks}")
+        namespace["doneTicks"] = tuple(doneTicks)
+        lines = ["def fused():", "    state = proc.state", "    done = 0", "    try:"] + ["    " + line for line in lines] + [
+            "    except BaseException:",
+            "        proc.instructionCount += done",
+            "        proc.ticks += doneTicks[done]",
+            "        raise"
+        ]
+        exec(compile("\n".join(lines), f"<cyan superinstruction {start}>", "exec"), namespace)
+        return namespace["fused"]
+
+    def getReport(self) -> dict:
+        """Returns what was fused: each pattern with its weight (appearances, or runs when profiled) and the PCs it was
+        fused at, and the PCs of the dropped zero register writes."""
+        return {
+            "patterns" : {pattern : {"weight" : weight, "sites" : self.sites[pattern]} for pattern, weight in self.patterns.most_common()},
+            "dropped" : list(self.dropped)
+        }
+
+    def report(self) -> str:
+        """Returns the report as text."""
+        lines = ["Superinstructions:", f"{'pattern':<32} {'weight':>10} {'sites':>6}"]
+        for pattern, weight in self.patterns.most_common():
+            lines.append(f"{pattern:<32} {weight:>10} {len(self.sites[pattern]):>6}")
+        lines.append(f"Dropped zero register writes: {len(self.dropped)}" + (f" (at {', '.join(map(str, self.dropped))})" if self.dropped else ""))
+        return "\n".join(lines)
@@ -0,0 +1,294 @@
+from collections import Counter
+from utils import *
+
+# Kinds whose values come out of the memory stage rather than the execute stage
+MEMORY_KINDS = ("ram", "io", "stack", "callstack")
+
+STALL_CAUSES = ("data", "branch", "structural", "memory")
+
+# The accessors watched for instructions without reads/writes declarations, with the kind they access and whether they
+# read it, write it or both
+OBSERVED_ACCESSORS = {
+    "getReg" : ("reg", ("read",)),
+    "setReg" : ("reg", ("write",)),
+    "getRAM" : ("ram", ("read",)),
+    "setRAM" : ("ram", ("write",)),
+    "getIO" : ("io", ("read",)),
+    "setIO" : ("io", ("write",)),
+    "getCustomReg" : ("custom", ("read",)),
+    "setCustomReg" : ("custom", ("write",)),
+    "getFlag" : ("flags", ("read",)),
+    "push" : ("stack", ("read", "write")),
+    "pop" : ("stack", ("read", "write")),
+    "peek" : ("stack", ("read",)),
+    "call" : ("callstack", ("read", "write")),
+    "ret" : ("callstack", ("read", "write"))
+}
+
+class PipelineModel:
+    def __init__(self, proc, stages: int = 5, forwarding: bool = True, branchPenalty: int = None) -> None:
+        """Models how a program would run on an in-order pipeline with one instruction issued per cycle, while the
+        processor runs it as usual. The state and tick count of the processor are unchanged.
+
+        The stages follow the classic fetch, decode, execute, memory, write back layout: operands are read in stage 1,
+        results come out of stage 2 (stage 3 for instructions that read RAM, IO or a stack) and are written back in the
+        last stage, each clamped to the number of stages. An instruction that reads a register, the flags or memory
+        written by an earlier instruction stalls until the value is ready: right after the producing stage with
+        forwarding, or in its write back stage without. An instruction that moves the PC flushes the instructions
+        fetched after it. Instructions whose class sets cycles to more than one cycle hold the pipeline for longer, and
+        cache misses stall it.
+
+        Which registers, flags and memory an instruction reads and writes comes from the class attributes `reads` and
+        `writes`, lists of (kind, operand index) pairs, worked out once per PC. Kinds are "reg", "ram", "io", "flags",
+        "stack", "callstack" and "custom"; an index of None means the whole kind (or the only one). A class that sets
+        neither is watched the first time each of its PCs runs and its accesses are used from then on.
+
+        A cycle lasts speed ticks (the time between instructions) and an instruction takes delay ticks from issue to
+        output, so a run of n instructions with no stalls takes (n - 1) * speed + delay ticks.
+
+        Args:
+            proc (Processor): The processor to model.
+            stages (int, optional): The number of pipeline stages. Defaults to 5.
+            forwarding (bool, optional): Pass results straight to the instructions that need them. Defaults to True.
+            branchPenalty (int, optional): Cycles lost when an instruction moves the PC. Defaults to None (the
+                instructions fetched before the execute stage, 2 with 5 stages).
+        """
+        if stages < 1:
+            log(f"A pipeline needs at least one stage, got {stages}", "ERROR")
+        self.proc = proc
+        self.stages = stages
+        self.forwarding = forwarding
+        self.readStage = min(1, stages - 1)
+        self.executeStage = min(2, stages - 1)
+        self.memoryStage = min(3, stages - 1)
+        self.writebackStage = stages - 1
+        self.branchPenalty = self.executeStage if branchPenalty is None else branchPenalty
+        self.cycleTicks = proc.cpu.defaultTicks
+        self.latencyTicks = proc.cpu.delay if proc.cpu.delay else stages * self.cycleTicks
+        # The stage an instruction needs its operands in
+        self.consumeStage = self.executeStage if forwarding else self.readStage
+        self.enabled = False
+        self.table = None
+        self.program = None
+        self.observed = None
+        self.watching = False
+        self.shadowed = {}
+        self.wrappers = {}
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear the counters and the pipeline."""
+        self.instructions = 0
+        self.nextIssue = 0
+        self.ready = {}
+        self.stalls = Counter({cause : 0 for cause in STALL_CAUSES})
+        self.dataStalls = Counter()
+        self.pcStalls = Counter()
+        self.branches = 0
+
+    def getAccessSets(self, instr_class, operands) -> tuple | None:
+        """Returns the resources an instruction reads and writes from its class's `reads`/`writes`, or None if it sets neither."""
+        reads = getattr(instr_class, "reads", None)
+        writes = getattr(instr_class, "writes", None)
+        if reads is None and writes is None:
+            return None
+        return self.resolve(reads or [], operands), self.resolve(writes or [], operands)
+
+    def resolve(self, declared: list, operands: list) -> tuple:
+        resources = []
+        for kind, index in declared:
+            resource = (kind, None if index is None else operands[index])
+            # The locked zero register always reads 0, so nothing ever waits on it
+            if resource == ("reg", 0) and self.proc.cpu.zeroRegister:
+                continue
+            resources.append(resource)
+        return tuple(resources)
+
+    def getEntry(self, reads: tuple, writes: tuple, ticks: int) -> tuple:
+        """Precompute the timing of an instruction: its reads, its writes, the cycles until its results can be used and
+        the cycles it holds the pipeline for."""
+        producer = self.memoryStage if any(kind in MEMORY_KINDS for kind, index in reads) else self.executeStage
+        resultDelay = producer + 1 if self.forwarding else self.writebackStage
+        occupancy = max(1, -(-ticks // self.cycleTicks))
+        return reads, writes, resultDelay - self.consumeStage, occupancy
+
+    def build(self) -> None:
+        """Work out the entry of every PC of the loaded program."""
+        proc = self.proc
+        program = proc.parsedProgram
+        self.table = [None] * len(program)
+        for pc, entry in enumerate(program):
+            if entry is None:
+                continue
+            sets = self.getAccessSets(*entry)
+            if sets is not None:
+                self.table[pc] = self.getEntry(*sets, proc.instructionTicks[pc])
+            elif not self.watching:
+                self.watchAccessors()
+        self.program = program
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        proc = self.proc
+        if proc.parsedProgram is None:
+            log("No program loaded.", "WARNING")
+            return
+        # Keep whatever was on the instance before (another tool's wrappers) so disable() can put it back
+        self.shadowed = {"executeLine" : proc.__dict__.get("executeLine")}
+        self.wrappers = {}
+        executeLine = proc.executeLine
+        cycleTicks = self.cycleTicks
+
+        def pipelinedExecuteLine() -> None:
+            state = proc.state
+            pc = state["pc"]
+            count = proc.instructionCount
+            ticks = proc.ticks
+            if self.program is not proc.parsedProgram:
+                self.build()
+            entry = self.table[pc] if pc < len(self.table) else None
+            if entry is None and pc < len(self.table) and self.program[pc] is not None:
+                self.observed = {"read" : set(), "write" : set()}
+            executeLine()
+            if proc.instructionCount == count:
+                self.observed = None
+                return
+            if entry is None:
+                observed = self.observed
+                self.observed = None
+                entry = self.getEntry(tuple(observed["read"]), tuple(observed["write"]), proc.instructionTicks[pc])
+                self.table[pc] = entry
+            reads, writes, resultDelay, occupancy = entry
+
+            ready = self.ready
+            issue = self.nextIssue
+            cause = None
+            for resource in reads:
+                cycle = ready.get(resource, 0)
+                if cycle > issue:
+                    issue = cycle
+                    cause = resource[0]
+            stalls = self.stalls
+            if cause is not None:
+                stalled = issue - self.nextIssue
+                stalls["data"] += stalled
+                self.dataStalls[cause] += stalled
+                self.pcStalls[pc] += stalled
+            for resource in writes:
+                ready[resource] = issue + resultDelay
+
+            # Ticks past the instruction's own cost are cache misses
+            extra = proc.ticks - ticks - proc.instructionTicks[pc]
+            nextIssue = issue + occupancy
+            if occupancy > 1:
+                stalls["structural"] += occupancy - 1
+            if extra > 0:
+                missed = -(-extra // cycleTicks)
+                stalls["memory"] += missed
+                nextIssue += missed
+            if state["pc"] != pc + 1 and proc.isRunning:
+                self.branches += 1
+                stalls["branch"] += self.branchPenalty
+                nextIssue += self.branchPenalty
+            self.nextIssue = nextIssue
+            self.instructions += 1
+
+        proc.executeLine = pipelinedExecuteLine
+        self.wrappers["executeLine"] = pipelinedExecuteLine
+        self.watching = False
+        self.build()
+        proc.instrumentation["pipeline"] = self
+        self.enabled = True
+
+    def watchAccessors(self) -> None:
+        """Wrap the accessors to see what instructions without reads/writes declarations access."""
+        proc = self.proc
+        for name, (kind, directions) in OBSERVED_ACCESSORS.items():
+            self.shadowed[name] = proc.__dict__.get(name)
+            self.wrappers[name] = self.wrapAccessor(getattr(proc, name), kind, directions)
+            setattr(proc, name, self.wrappers[name])
+        self.watching = True
+
+    def wrapAccessor(self, accessor, kind: str, directions: tuple):
+        byAddress = kind in ("reg", "io", "custom")
+        setsFlags = kind in ("reg", "ram", "custom") and "write" in directions
+        zeroRegister = kind == "reg" and self.proc.cpu.zeroRegister
+        def observedAccessor(*args):
+            observed = self.observed
+            if observed is not None:
+                resource = (kind, args[0] if byAddress else None)
+                if not (zeroRegister and args[0] == 0):
+                    for direction in directions:
+                        observed[direction].add(resource)
+                if setsFlags and len(args) > 2 and args[2]:
+                    observed["write"].add(("flags", None))
+            return accessor(*args)
+        return observedAccessor
+
+    def disable(self) -> None:
+        if not self.enabled:
+            return
+        # Only put back what is still the pipeline's own wrapper, so tools enabled after it keep theirs
+        for name, previous in self.shadowed.items():
+            if self.proc.__dict__.get(name) is not self.wrappers[name]:
+                continue
+            if previous is None:
+                del self.proc.__dict__[name]
+            else:
+                self.proc.__dict__[name] = previous
+        self.shadowed = {}
+        self.wrappers = {}
+        del self.proc.instrumentation["pipeline"]
+        self.watching = False
+        self.enabled = False
+
+    def getCycles(self) -> int:
+        """Returns the cycles until the last instruction has left the pipeline."""
+        if self.instructions == 0:
+            return 0
+        return self.nextIssue + self.stages - 1
+
+    def getTicks(self) -> int:
+        """Returns the ticks the modelled run takes: (issue cycles - 1) * speed + delay."""
+        if self.instructions == 0:
+            return 0
+        return (self.nextIssue - 1) * self.cycleTicks + self.latencyTicks
+
+    def getStats(self) -> dict:
+        """Returns the instructions, cycles, CPI, ticks, branches and the stall cycles by cause, by the kind of value
+        waited for and by PC."""
+        cycles = self.getCycles()
+        return {
+            "stages" : self.stages,
+            "forwarding" : self.forwarding,
+            "instructions" : self.instructions,
+            "cycles" : cycles,
+            "cpi" : cycles / self.instructions if self.instructions else 0,
+            "ticks" : self.getTicks(),
+            "branches" : self.branches,
+            "stalls" : dict(self.stalls),
+            "data_stalls" : dict(self.dataStalls),
+            "pc_stalls" : {str(pc) : count for pc, count in sorted(self.pcStalls.items())}
+        }
+
+    def report(self, top: int = 10) -> str:
+        """Returns the stats as text, with the PCs that stalled most."""
+        stats = self.getStats()
+        lines = [
+            f"Pipeline: {self.stages} stages, {'forwarding' if self.forwarding else 'no forwarding'}, branch penalty {self.branchPenalty}",
+            f"Instructions: {stats['instructions']}  Cycles: {stats['cycles']}  CPI: {stats['cpi']:.3f}  Ticks: {stats['ticks']}",
+            f"Branches taken: {self.branches}",
+            "Stall cycles:"
+        ]
+        for cause in STALL_CAUSES:
+            lines.append(f"  {cause:<12} {self.stalls[cause]:>10}")
+        for kind, count in self.dataStalls.most_common():
+            lines.append(f"    {kind:<10} {count:>10}")
+        if len(self.pcStalls) > 0:
+            lines += ["", f"{'pc':>6} {'stalls':>10}  source"]
+            program = self.proc.program
+            for pc, count in self.pcStalls.most_common(top):
+                source = program[pc].strip() if program is not None and pc < len(program) else ""
+                lines.append(f"{pc:>6} {count:>10}  {source}")
+        return "\n".join(lines)
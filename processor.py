@@ -1,270 +1,571 @@
-import os
-import sys
 import time
+import asyncio
 from utils import *
 from memory import *
 from config import *
+from compiler import *
+from isa import *
+from snapshot import *
+from profiler import *
+from cache import *
+from debugger import *
+from replay import *
+from devices import *
+from assembler import *
+from export import *
+from optimizer import *
+from shared import *
+from pipeline import *
+
+# Return addresses on the call stack are stored as 32 bit words
+CALLSTACK_WORD_SIZE = 32
 
 class Processor:
-    def __init__(self, config: dict, stateDict: dict = None) -> None:
+    def __init__(self, config: dict, stateDict: dict = None, sharedBanks: dict = None) -> None:
         """The class constructor for any processor to be used with CYAN."
 
         Args:
-            config (dict): The configuration dictionary for the processor.
+            config (dict | CpuConfig): The configuration dictionary for the processor, or a CpuConfig (see loadConfig()).
             stateDict (dict, optional): The state to start in, if any. If incorrectly formatted, things may break. Defaults to None.
+            sharedBanks (dict, optional): Banks to use instead of making new ones, by state key ("ram", "io"), like the
+                banks the cores of a System share. Defaults to None.
         """
         # IMPORTANT STUFF
         resetLogger()
-        validateConfig(config, 1)
+        if not isinstance(config, CpuConfig):
+            config = CpuConfig(config)
 
-        self.config = config
+        self.cpu = config
+        self.config = config.raw
+        self.sharedBanks = {} if sharedBanks is None else sharedBanks
         if stateDict is not None:
             self.state = stateDict
         else:
             self.state = []; self.initState()
         self.program = None
         self.instructionsFile = None
+        self.instructionSet = None
         self.isRunning = False
         self.parsedProgram = None
-        self.flags = []
+        self.imageLength = None
+        self.symbols = {}
+        self.flagNames = []
+        self.flagValue = None
+        self.flagCache = {}
+        self.eagerFlags = []
+        self.instructionCount = 0
+        self.ticks = 0
+        self.instructionTicks = None
+        self.pacing = None
+        self.paceInterval = 0.05
+        self.exitReason = None
+        self.compiler = BlockCompiler(self)
+        self.optimizer = None
+        self.instrumentation = {}
+        self.profiler = None
+        self.pipeline = None
+        self.debugger = None
+        self.recorder = None
+        self.replayer = None
+        self.devices = {}
+        self.isAsync = False
+        self.system = None
+        self.coreId = 0
+        self.yielded = False
+        self.shared = None
+        self.icache = createCache(self.config["datapoints"], "icache")
+        self.dcache = createCache(self.config["datapoints"], "dcache")
         self.initFlags()
 
-    def initFlags(self) -> list[(str, bool)]:
-        """Initialize the processor flags with default values."""
-        for flag in self.config["datapoints"]["flags"]:
-            self.flags.append((flag, False))
+    def initFlags(self) -> list[str]:
+        """Initialize the processor flags. Every flag reads False until a value is written with setFlags."""
+        self.flagNames = list(self.cpu.flags)
+        self.flagValue = None
+        self.flagCache = {}
+        return self.flagNames
 
     def initState(self) -> dict:
         """Initialize the processor state with default values."""
 
+        cpu = self.cpu
+        shared = self.sharedBanks
         self.state = {
-            "ram" : [],
-            "prom" : [],
-            "registers" : [],
-            "io" : [],
+            "ram" : shared["ram"] if "ram" in shared else MemoryBank("ram", cpu.ram, cpu.wordSize, cpu.ramError),
+            "prom" : MemoryBank("prom", cpu.prom, cpu.promWordSize),
+            "registers" : MemoryBank("registers", cpu.registers, cpu.wordSize, cpu.regError),
+            "io" : shared["io"] if "io" in shared else MemoryBank("io", cpu.ioCount, cpu.ioSize, cpu.ioError),
+            "stack" : Stack("stack", cpu.stackDepth, cpu.wordSize, cpu.stackError),
+            "callstack" : Stack("callstack", cpu.callstackDepth, CALLSTACK_WORD_SIZE, cpu.stackError),
+            "custom_regs" : {},
             "pc" : 0
         }
 
-        for i in range(0, int(self.config["datapoints"]["ram"])):
-            self.state["ram"].append(Memory(i, self.config["datapoints"]["word_size"], self.config["datapoints"]["ram_error"]))
+        if cpu.zeroRegister:
+            self.state["registers"].lock(0)
 
-        for i in range(0, int(self.config["datapoints"]["prom"])):
-            self.state["prom"].append(Memory(i, self.config["datapoints"]["opcode_size"] + self.config["datapoints"]["operand_count"] * self.config["datapoints"]["operand_size"]))
-
-        for i in range(0, int(self.config["datapoints"]["registers"])): 
-            if i == 0:
-                if self.config["datapoints"]["zero_register"] == False:
-                    self.state["registers"].append(Memory(i, self.config["datapoints"]["word_size"], self.config["datapoints"]["reg_error"]))
-                else:
-                    zeroReg = LockableMemory(i, self.config["datapoints"]["word_size"], self.config["datapoints"]["reg_error"])
-                    zeroReg.lock()
-                    self.state["registers"].append(zeroReg)
-            else:
-                self.state["registers"].append(Memory(i, self.config["datapoints"]["word_size"], self.config["datapoints"]["reg_error"]))
-        try:
-            for i in range(0, int(self.config["datapoints"]["io_count"])):
-                self.state["io"].append(LockableMemory(i, self.config["datapoints"]["io_size"], self.config["datapoints"]["io_error"]))
-        except KeyError:
+        if cpu.ioCount == 0:
             log("No io defined in config. Skipping.", "WARNING")
 
-        try:
-            if self.config["datapoints"]["speed"] is None:
-                pass
-        except Exception as e:
-            log("No speed defined in config. Defaulting to 0.", "WARNING")
+        if cpu.speed is None:
+            log(f"No speed defined in config. Instructions default to {self.getDefaultTicks()} tick(s).", "WARNING")
 
-        try:
-            for reg_data in self.config["custom_registers"]:
-                if reg_data["should_accumulate"] == True:
-                    self.state["custom_regs"][reg_data["name"]].append(AccumulatedMemory(reg_data["name"], reg_data["word_size"], reg_data["wrapping"]))
-                else:
-                    self.state["custom_regs"][reg_data["name"]].append(Memory(reg_data["name"], reg_data["word_size"], reg_data["wrapping"]))
-        except KeyError:
+        if len(cpu.customRegs) == 0:
             log("No custom registers defined in config. Skipping.", "WARNING")
+        for name, size, shouldAccumulate, error in cpu.customRegs:
+            if shouldAccumulate:
+                self.state["custom_regs"][name] = AccumulatedMemory(name, size, error)
+            else:
+                self.state["custom_regs"][name] = Memory(name, size, error)
 
         log("Initialized state.", "INFO")
         return self.state
     
-    def run(self):
-        log("Starting processor.", "INFO")
+    def run(self, engine: str = "interpreter", maxInstructions: int = None, timeLimit: float = None, optimize: bool = False) -> str:
+        """Run the loaded program until it stops.
+
+        Args:
+            engine (str, optional): "interpreter" runs one decoded instruction at a time. "compiled" runs basic blocks
+                translated into Python functions by the BlockCompiler, with identical results. Defaults to "interpreter".
+            maxInstructions (int, optional): Stop after this many more instructions. The compiled engine checks this
+                between blocks, so it can go over by up to one block. Defaults to None (no limit).
+            timeLimit (float, optional): Stop after this many seconds of wall time. Defaults to None (no limit).
+            optimize (bool, optional): Run the interpreter with the superinstructions of optimizeProgram() (run with
+                the defaults first if it hasn't been). Like the compiled engine, it can go over maxInstructions by up to
+                two instructions. Defaults to False.
+
+        Returns:
+            str: Why the processor stopped: "halted", "end_of_program", "instruction_limit" or "time_limit".
+        """
+        if self.parsedProgram is None:
+            log("No program loaded.", "WARNING")
+            return None
+        if engine not in ("interpreter", "compiled"):
+            log(f"Unknown engine: {engine}", "ERROR")
+        if engine == "compiled" and len(self.instrumentation) > 0:
+            log(f"Using the interpreter instead of the compiled engine while {', '.join(self.instrumentation)} is attached.", "INFO")
+            engine = "interpreter"
+        if optimize and engine == "compiled":
+            log("The compiled engine already runs whole blocks, so optimize only applies to the interpreter.", "INFO")
+            optimize = False
+        if optimize and len(self.instrumentation) > 0:
+            log(f"Running without superinstructions while {', '.join(self.instrumentation)} is attached.", "INFO")
+            optimize = False
+        if optimize and (self.optimizer is None or self.optimizer.isStale()):
+            self.optimizeProgram()
+        log(f"Starting processor with the {engine} engine{' (optimized)' if optimize else ''}.", "INFO")
         self.isRunning = True
+        self.exitReason = None
+
+        step = self.executeBlock if engine == "compiled" else self.executeFused if optimize else self.executeLine
+        shared = self.shared
+        if shared is not None:
+            shared.publish()
+        if maxInstructions is None and timeLimit is None and self.pacing is None:
+            if shared is None:
+                while self.isRunning:
+                    step()
+            else:
+                while self.isRunning:
+                    self.runBatch(step, shared.publishEvery)
+                    shared.publish()
+        else:
+            self.runLimited(step, maxInstructions, timeLimit)
+        if shared is not None:
+            shared.publish(False)
+
+        if self.exitReason is None:
+            self.exitReason = "halted"
+        return self.exitReason
+
+    async def runAsync(self, yieldEvery: int = 1000, maxInstructions: int = None) -> str:
+        """Run the loaded program inside an asyncio event loop, so many processors and their devices can share one process.
+
+        The processor yields to the event loop every yieldEvery instructions. When an instruction reads a bound
+        device that has no data, only this processor waits for the device; the instruction is then run again from the
+        start, so instruction classes should read IO before they write anything.
+
+        Args:
+            yieldEvery (int, optional): Instructions between yields to the event loop. Defaults to 1000.
+            maxInstructions (int, optional): Stop after this many more instructions. Defaults to None (no limit).
+
+        Returns:
+            str: Why the processor stopped, as for run().
+        """
+        if self.parsedProgram is None:
+            log("No program loaded.", "WARNING")
+            return None
+        log("Starting processor in async mode.", "INFO")
+        limit = None if maxInstructions is None else self.instructionCount + maxInstructions
+        self.isRunning = True
+        self.exitReason = None
+        self.isAsync = True
+        try:
+            while self.isRunning:
+                for _ in range(yieldEvery):
+                    if not self.isRunning:
+                        break
+                    if limit is not None and self.instructionCount >= limit:
+                        self.exitReason = "instruction_limit"
+                        self.stop()
+                        break
+                    try:
+                        self.executeLine()
+                    except IOWouldBlock as e:
+                        await self.devices[e.port].waitReadable()
+                await asyncio.sleep(0)
+        finally:
+            self.isAsync = False
+
+        if self.exitReason is None:
+            self.exitReason = "halted"
+        return self.exitReason
+
+    def bindDevice(self, port: int, device: Device) -> None:
+        """Connect an IO port to a device. Reads of the port take the device's input, writes are passed on to it."""
+        if port < 0 or port >= len(self.state["io"]):
+            log(f"IO port {port} doesn't exist.", "ERROR")
+        log(f"Binding IO {port} to {type(device).__name__}", "INFO")
+        self.devices[port] = device
+
+    def unbindDevice(self, port: int) -> Device | None:
+        return self.devices.pop(port, None)
+
+    def runLimited(self, step, maxInstructions: int = None, timeLimit: float = None) -> None:
+        limit = None if maxInstructions is None else self.instructionCount + maxInstructions
+        deadline = None if timeLimit is None else time.perf_counter() + timeLimit
+
+        # Pacing sleeps once per batch of ticks (about paceInterval seconds worth) instead of once per instruction
+        pacing = self.pacing
+        if pacing is not None:
+            batchTicks = max(pacing * self.paceInterval, 1)
+            startTicks = self.ticks
+            startTime = time.perf_counter()
+            nextPace = self.ticks + batchTicks
+
+        shared = self.shared
+        if shared is not None:
+            nextPublish = self.instructionCount + shared.publishEvery
+
+        steps = 0
         while self.isRunning:
+            if limit is not None and self.instructionCount >= limit:
+                self.exitReason = "instruction_limit"
+                self.stop()
+                break
+            # Reading the clock is slow compared to an instruction, so only do it every so often
+            steps += 1
+            if deadline is not None and steps % 1024 == 0 and time.perf_counter() >= deadline:
+                self.exitReason = "time_limit"
+                self.stop()
+                break
+            step()
+
+            if pacing is not None and self.ticks >= nextPace:
+                ahead = startTime + (self.ticks - startTicks) / pacing - time.perf_counter()
+                if ahead > 0:
+                    time.sleep(ahead)
+                nextPace = self.ticks + batchTicks
+
+            if shared is not None and self.instructionCount >= nextPublish:
+                shared.publish()
+                nextPublish = self.instructionCount + shared.publishEvery
+
+    def runBatch(self, step, count: int) -> None:
+        """Run up to count more instructions with step (executeLine or executeBlock), without any of the other checks
+        of run(). Used by System to run a quantum on a core."""
+        limit = self.instructionCount + count
+        while self.isRunning and self.instructionCount < limit:
+            step()
+
+    def executeBlock(self):
+        pc = self.state["pc"]
+        if pc >= len(self.parsedProgram):
+            log(f"Program counter {pc} is past the end of the program.", "WARNING")
+            self.exitReason = "end_of_program"
+            self.stop()
+            return
+        self.compiler.getBlock(pc)()
+
+    def executeFused(self):
+        pc = self.state["pc"]
+        table = self.optimizer.table
+        if pc < len(table) and table[pc] is not None:
+            table[pc]()
+        else:
             self.executeLine()
 
     def executeLine(self):
-        # Remove whitespace before the line
-        line = self.program[self.state["pc"]]
-        while line.startswith(" "):
-            line = line[1:]
-
-        # Check for comments or empty lines
-        if line.startswith(";") or line == "\n" or line == "":
-            self.state["pc"] += 1
-            log("Skipping comment or empty line.", "INFO")
-
-        if ";" in line:
-            line = line.split(";")[0]
-            log("Removing comment.", "INFO")
-        
-        else:
-            log(f"Executing instruction at {self.state['pc']}", "INFO")
-            rpc = self.state["pc"]
-            temp = self.execute()
-            if self.state["pc"] == rpc:
-                self.state["pc"] += 1
-            log(f"Instruction executed: {temp}", "INFO")
-
-            try:
-                time.sleep(0.1 * self.config["speed"])
-            except: 
-                pass
-
-    def runSteps(self):
+        pc = self.state["pc"]
+        if pc >= len(self.parsedProgram):
+            log(f"Program counter {pc} is past the end of the program.", "WARNING")
+            self.exitReason = "end_of_program"
+            self.stop()
+            return
+
+        # Comments and empty lines are decoded to None and just advance the PC
+        if self.parsedProgram[pc] is None:
+            self.state["pc"] = pc + 1
+            return
+
+        if logger.minLevel <= DEBUG:
+            log(f"Executing instruction at {pc}", "DEBUG")
+        temp = self.execute()
+        # The fetch is charged once the instruction has run, so one that blocks on IO and is run again pays only once
+        if self.icache is not None:
+            self.ticks += self.icache.access(pc)
+        self.instructionCount += 1
+        self.ticks += self.instructionTicks[pc]
+        if self.state["pc"] == pc:
+            self.state["pc"] = pc + 1
+        if logger.minLevel <= DEBUG:
+            log(f"Instruction executed: {temp}", "DEBUG")
+
+    def runSteps(self, maxInstructions: int = None) -> dict:
+        """Run until a debugger event: a breakpoint, a watchpoint, a stop or an error. See getDebugger().
+
+        Args:
+            maxInstructions (int, optional): Also stop after this many instructions. Defaults to None (no limit).
+
+        Returns:
+            dict: The event that stopped the processor.
+        """
         log("Starting processor in step mode.", "INFO")
-        self.isRunning = True
-        while self.isRunning:
-            self.executeLine()
-            input("Press enter to continue to next line...")
+        return self.getDebugger().runUntilEvent(maxInstructions)
+
+    def optimizeProgram(self, profiler: Profiler = None, maxPatterns: int = 8, minCount: int = 1) -> dict:
+        """Find the most common runs of two or three instructions in the loaded program and fuse them into
+        superinstructions for run(optimize=True). See PeepholeOptimizer.
+
+        Args:
+            profiler (Profiler, optional): Use the counts of a profiling run (e.g. self.profiler) to pick the patterns
+                that ran most, instead of the ones that appear most. Defaults to None.
+            maxPatterns (int, optional): The most distinct patterns to fuse. Defaults to 8.
+            minCount (int, optional): Skip patterns seen (or run) fewer times than this. Defaults to 1.
+
+        Returns:
+            dict: What was fused and dropped, see PeepholeOptimizer.getReport().
+        """
+        if self.optimizer is None:
+            self.optimizer = PeepholeOptimizer(self)
+        return self.optimizer.optimize(profiler, maxPatterns, minCount)
+
+    def shareState(self, name: str = None, path: str = None, publishEvery: int = 10000) -> SharedState:
+        """Move RAM, registers and IO into a shared memory segment (or a memory mapped file) that other local processes
+        can open with SharedStateReader, to watch the state and write IO inputs while the processor runs.
+
+        Args:
+            name (str, optional): The name of the shared memory segment. Defaults to None (a random name, see .name).
+            path (str, optional): Map this file instead of a shared memory segment. Defaults to None.
+            publishEvery (int, optional): Instructions between updates of the pc, instruction count and ticks in the
+                segment while running. Defaults to 10000.
+
+        Returns:
+            SharedState: The shared segment.
+        """
+        if self.shared is not None:
+            log(f"State is already shared in {self.shared.name}.", "WARNING")
+            return self.shared
+        self.shared = SharedState(self, name, path, publishEvery)
+        return self.shared
+
+    def unshareState(self, unlink: bool = True) -> None:
+        """Stop sharing the state. The banks keep their words, and the segment is removed unless unlink is False."""
+        if self.shared is None:
+            return
+        self.shared.close(unlink)
+        self.shared = None
+
+    def getDebugger(self, traceSize: int = 64) -> Debugger:
+        """Returns the debugger of the processor, creating it (with a trace of traceSize instructions) if needed."""
+        if self.debugger is None:
+            self.debugger = Debugger(self, traceSize)
+        return self.debugger
+
+    def pause(self, seconds: int):
+        log(f"Pausing for {seconds} seconds.", "INFO")
+        time.sleep(seconds)
+
+    def setPacing(self, ticksPerSecond: float = 10, interval: float = 0.05) -> None:
+        """Throttle run() to a target number of redstone ticks per second of wall time, for watching a program run.
+
+        Instructions run at full speed in batches and the processor sleeps between batches to stay on target.
 
-    def pause(self, time: int):
-        log(f"Pausing for {time} seconds.", "INFO")
-        time.sleep(time)
+        Args:
+            ticksPerSecond (float, optional): The target rate, or None to run at full speed. Defaults to 10 (real redstone speed).
+            interval (float, optional): Roughly how many seconds of ticks to run between sleeps. Defaults to 0.05.
+        """
+        log(f"Setting pacing to {ticksPerSecond} ticks per second.", "INFO")
+        self.pacing = ticksPerSecond
+        self.paceInterval = interval
+
+    def getDefaultTicks(self) -> int:
+        """Returns the ticks an instruction takes if its class doesn't set cycles: the speed, else the delay, else 1."""
+        return self.cpu.defaultTicks
+
+    def getCacheStats(self) -> dict:
+        """Returns the stats of the simulated caches (see Cache.getStats()), keyed by "icache" and "dcache"."""
+        return {cache.name : cache.getStats() for cache in (self.icache, self.dcache) if cache is not None}
+
+    def getTicks(self) -> int:
+        """Returns the number of redstone ticks the processor has spent so far."""
+        return self.ticks
 
     def stop(self):
         log("Stopping processor.", "INFO")
         self.isRunning = False
 
-    def exportState(self, filePath: str, pretty: bool) -> bool:
-        log(f"Exporting state to {filePath}", "INFO")
+    def exportState(self, filePath: str, pretty: bool = True, format: str = None, diff: bool = False) -> bool:
+        """Write the state to a file. Sections are streamed through a buffered writer, so large RAM exports quickly.
 
-        # RAM
-        ramHeader = str("RAM:\n")
-        ramBody = "| "
-        for i, ram in enumerate(self.state["ram"]):
-            padding = " " * ((len(str(self.config["datapoints"]["ram"])) + 3) - (len(str(self.state["ram"][i].get())) + len(str(i))))
-            ramBody += f"{i}: {padding} {ram.get()} | "
-            if (i + 1) % 10 == 0:
-                ramBody += "\n| "
-
-        #PROM
-        romHeader = str("\nProgram ROM:\n")
-        romBody = "| "
-        for i, rom in enumerate(self.state["prom"]):
-            padding = " " * ((len(str(self.config["datapoints"]["prom"])) + 3) - (len(str(self.state["prom"][i].get())) + len(str(i))))
-            romBody += f"{i}: {padding} {rom.get()}  | "
-            if (i + 1) % 10 == 0:
-                romBody += "\n| "
-        
-
-        # REGISTERS
-        regHeader = str("\nRegisters:\n")
-        regBody = "| "
-        for i, reg in enumerate(self.state["registers"]):
-            padding = " " * ((len(str(self.config["datapoints"]["registers"])) + 3) - (len(str(self.state["registers"][i].get())) + len(str(i))))
-            regBody += f"{i}: {padding} {reg.get()}  | "
-            if (i + 1) % 3 == 0:
-                regBody += "\n| "
-
-        # I/O PORTS
-        portsHeader = str("\nI/O Ports:\n")
-        portsBody = "| "
-        for i, ports in enumerate(self.state["io"]):
-            padding = " " * ((len(str(self.config["datapoints"]["io_count"])) + 3) - (len(str(self.state["io"][i].get())) + len(str(i))))
-            portsBody += f"{i}: {padding} {ports.get()}  | "
-            if (i + 1) % 3 == 0:
-                portsBody += "\n| "
-
-        flagsHeader = str("\nFlags:\n")
-        flagsBody = "| "
-        for i, flag in enumerate(self.flags):
-            flagsBody += f"{flag[0]}: {flag[1]}\n"
+        Args:
+            filePath (str): The file to write.
+            pretty (bool, optional): Write the pretty table if True, or str() of the state dict if False. Defaults to True.
+            format (str, optional): "pretty", "json", "csv" or "binary" (the snapshot format), instead of pretty. Defaults to None.
+            diff (bool, optional): Only write the words written since the last export or snapshot. Defaults to False.
 
+        Returns:
+            bool: True if the file was written.
+        """
+        log(f"Exporting state to {filePath}", "INFO")
+        if format is None:
+            format = "pretty" if pretty else "repr"
         try:
-            with open(filePath, "w") as f:
-                if pretty == False:
-                        f.write(str(self.state))
-                else:
-                    f.write(ramHeader)        
-                    f.write(ramBody + "\n")
+            exportState(self, filePath, format, diff)
+            return True
+        except OSError as e:
+            log(f"Unable to export state to {filePath}: {e}", "WARNING")
+            return False
 
-                    f.write(romHeader)        
-                    f.write(romBody + "\n")
+    def enableProfiling(self) -> Profiler:
+        """Start counting executions and time per opcode and PC, and accesses per address. Returns the Profiler.
 
-                    f.write(regHeader)        
-                    f.write(regBody + "\n")
+        While profiling, run(engine="compiled") uses the interpreter so every instruction is counted.
+        """
+        if self.profiler is None:
+            self.profiler = Profiler(self)
+        self.profiler.enable()
+        log("Profiling enabled.", "INFO")
+        return self.profiler
+
+    def disableProfiling(self) -> None:
+        """Stop profiling. The counters are kept on self.profiler."""
+        if self.profiler is not None:
+            self.profiler.disable()
+        log("Profiling disabled.", "INFO")
+
+    def enablePipeline(self, stages: int = 5, forwarding: bool = True, branchPenalty: int = None) -> PipelineModel:
+        """Start modelling the program on an in-order pipeline with data hazards and branch penalties. Returns the
+        PipelineModel, whose getStats() and report() give the CPI, stalls and ticks. See PipelineModel.
+
+        While modelling, run(engine="compiled") uses the interpreter so every instruction is timed.
+        """
+        if self.pipeline is not None:
+            self.pipeline.disable()
+        self.pipeline = PipelineModel(self, stages, forwarding, branchPenalty)
+        self.pipeline.enable()
+        log(f"Pipeline model enabled ({stages} stages).", "INFO")
+        return self.pipeline
+
+    def disablePipeline(self) -> None:
+        """Stop modelling the pipeline. The stats are kept on self.pipeline."""
+        if self.pipeline is not None:
+            self.pipeline.disable()
+        log("Pipeline model disabled.", "INFO")
+
+    def startRecording(self, filePath: str) -> Recorder:
+        """Record every IO read, write and lock change into a journal file, starting from a snapshot of the current state.
+
+        While recording, run(engine="compiled") uses the interpreter so every event has an exact instruction index.
+        """
+        log(f"Recording IO to {filePath}", "INFO")
+        self.recorder = Recorder(self, filePath)
+        return self.recorder
 
-                    f.write(portsHeader)        
-                    f.write(portsBody + "\n")
+    def stopRecording(self) -> None:
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
-                    f.write(flagsHeader)        
-                    f.write(flagsBody + "\n")
-                    
-                return True
-        except Exception as e:
-            print(e)
-            return False
+    def startReplay(self, filePath: str, snapshotInterval: int = 100000, maxSnapshots: int = 64) -> Replayer:
+        """Restore the state a journal was recorded from and feed its IO back in, checking that the run matches it.
 
-    def dumpState(self) -> None:
-        log("Dumping state.", "INFO")
-        dumpOutput(dict_of_lists_to_pretty_string(self.state))
+        Args:
+            filePath (str): The journal written by startRecording().
+            snapshotInterval (int, optional): Instructions between the snapshots used by stepBack(). Defaults to 100000.
+            maxSnapshots (int, optional): How many of those snapshots are kept. Defaults to 64.
+        """
+        log(f"Replaying IO from {filePath}", "INFO")
+        self.replayer = Replayer(self, filePath, snapshotInterval, maxSnapshots)
+        return self.replayer
 
-    def reset(self):
-        self.initState()
+    def stopReplay(self) -> None:
+        if self.replayer is not None:
+            self.replayer.close()
+            self.replayer = None
 
-    def execute(self) -> bool:
-        log("Executing instruction.", "INFO")
-        if self.program is None:
-            print("No program loaded.", "WARNING")
-            return False
-        line = self.program[self.state["pc"]]
-        log(f"Executing instruction: {line}", "INFO")
-        
-        line = line.split(" ")
-        opcode = line[0]
-        if not (opcode in self.config["metadata"]["operations"]):
-            log(f"Unknown opcode: {opcode}", "ERROR")
-        log(f"Opcode: {opcode}", "INFO")
-        
-        sys.path.append(f"{os.getcwd()}/configGroup") 
-        if self.instructionsFile is None:
-            self.instructionsFile = "instructions.py"
-        module = __import__(str(self.instructionsFile).strip(".py"))
+    def stepBack(self, steps: int = 1) -> None:
+        """Go back the given number of instructions while replaying, by restoring a snapshot and replaying forward."""
+        if self.replayer is None:
+            log("Stepping back needs a replay. Use startReplay() first.", "ERROR")
+        self.replayer.stepBack(steps)
 
-        class_ = getattr(module, opcode.upper())
-        instr_class = class_
-        log(f"Instruction class: {instr_class}", "INFO")
+    def snapshot(self, filePath: str = None) -> bytes | None:
+        """Save the full state of the processor in the binary snapshot format.
 
-        operands = line[1:]
-        for operand in operands:
-            if operand == "":
-                operands.remove(operand)
-        
-        for i, operand in enumerate(operands):
-            if instr_class.signage[i] == "u":
-                operands[i] = int(operand, 0)
-            elif instr_class.signage[i] == "s":
-                operands[i] = int(operand, 0) - (2 ** (instr_class.operand_sizes[i] - 1))
-            else:
-                log("Unknown signage.", "ERROR")
+        Args:
+            filePath (str, optional): The file to write. Defaults to None, which returns the snapshot as bytes instead.
 
+        Returns:
+            bytes | None: The snapshot if no file was given.
+        """
+        log(f"Saving snapshot{'' if filePath is None else ' to ' + filePath}", "INFO")
+        snapshot = saveSnapshot(self, filePath)
+        clearChanges(self)
+        return snapshot
 
-        if isSizedCorrectly(instr_class.operand_sizes, operands, instr_class.signage) == False:
-            log("Operand size mismatch.", "ERROR")
-        else:
-            log("Operand size match.", "INFO")
+    def restore(self, source: str | bytes) -> None:
+        """Load a snapshot made by snapshot() from a file path or bytes. The processor must use the same config.
 
-        if len(operands) != instr_class.operand_count:
-            log(f"Expected {instr_class.operand_count} operands, got {len(operands)}", "ERROR")
-    
-        for i in range(0, len(operands)):
-            try:
-                operands[i] = int(operands[i])
-            except Exception as e:
-                log(f"Invalid operand {operands[i]} at index {i}", "ERROR")
+        Args:
+            source (str | bytes): The snapshot file (loaded through mmap) or the snapshot bytes.
+        """
+        log(f"Restoring snapshot{' from ' + source if isinstance(source, str) else ''}", "INFO")
+        loadSnapshot(self, source)
+        markChanged(self)
+        if self.shared is not None:
+            self.shared.publish(False)
 
-        log(f"Operands: {operands}", "INFO")
+    def dumpState(self) -> None:
+        """Print the state as a key/value table."""
+        log("Dumping state.", "INFO")
+        table = {"pc" : self.state["pc"]}
+        for name in ("ram", "prom", "registers", "io"):
+            table[name] = list(self.state[name])
+        for name in ("stack", "callstack"):
+            if self.state[name].size > 0:
+                table[name] = self.state[name].items()
+        for name, reg in self.state["custom_regs"].items():
+            table[name] = reg.get()
+        for name, value in self.getFlags().items():
+            table[f"flag {name}"] = value
+        dumpOutput(table)
 
+    def reset(self):
+        self.initState()
+        self.instructionCount = 0
+        self.ticks = 0
+        if self.shared is not None:
+            self.shared.attach()
+        for cache in (self.icache, self.dcache):
+            if cache is not None:
+                cache.reset()
 
+    def execute(self) -> bool:
+        if self.parsedProgram is None:
+            log("No program loaded.", "WARNING")
+            return False
+
+        instr_class, operands = self.parsedProgram[self.state["pc"]]
         instr_class(self, operands)
         return True
 
@@ -281,89 +582,401 @@ class Processor:
         for index, line in enumerate(self.program):
             self.program[index] = self.program[index].strip("\n")
 
+        self.imageLength = None
+        self.symbols = {}
+        self.decodeProgram()
+        return True
+
+    def loadImage(self, source: str | bytes) -> int:
+        """Load a PROM image built by the assembler (see assembler.py). The words are copied into state["prom"] in one
+        go and the program is decoded from there, so the source isn't parsed again.
+
+        Args:
+            source (str | bytes): The image file or the image bytes.
+
+        Returns:
+            int: The number of instructions loaded.
+        """
+        log(f"Loading image{' from ' + source if isinstance(source, str) else ''}", "INFO")
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        raw, count, symbols = readImage(source, self.cpu)
+        prom = self.state["prom"]
+        prom.loadBytes(raw, "little", 0)
+        prom.clear(count)
+        self.program = None
+        self.imageLength = count
+        self.symbols = symbols
+        self.decodeProm()
+        return count
+
+    def assembleProgram(self, programFile: str, imageFile: str = None) -> bytes | None:
+        """Assemble a program with labels and constants (see assemble()) and load the result with loadImage().
+
+        Args:
+            programFile (str): The program to assemble.
+            imageFile (str, optional): Also save the image to this file. Defaults to None, which returns the image as bytes instead.
+
+        Returns:
+            bytes | None: The image if no file was given.
+        """
+        log(f"Assembling program from {programFile}", "INFO")
+        if self.instructionSet is None:
+            self.loadInstructionSet()
+        with open(programFile, "r") as f:
+            lines = f.read().splitlines()
+        words, labels = assemble(lines, self.instructionSet, self.cpu)
+        image = buildImage(words, labels, self.cpu)
+        if imageFile is not None:
+            with open(imageFile, "wb") as f:
+                f.write(image)
+        self.loadImage(image)
+        return image if imageFile is None else None
+
+    def disassembleProgram(self, filePath: str = None) -> list[str]:
+        """Disassemble the PROM (the loaded image, or all of it) back into source lines. Labels saved in the image are
+        put back, but operands are written as numbers (see disassemble()).
+
+        Args:
+            filePath (str, optional): Also write the lines to this file. Defaults to None.
+
+        Returns:
+            list[str]: The source lines.
+        """
+        if self.instructionSet is None:
+            self.loadInstructionSet()
+        prom = self.state["prom"]
+        words = prom.data[:self.imageLength] if self.imageLength is not None else prom.data
+        lines = disassemble(words, self.instructionSet, self.cpu, self.symbols)
+        if filePath is not None:
+            with open(filePath, "w") as f:
+                f.write("\n".join(lines) + "\n")
+        return lines
+
+    def decodeProgram(self) -> list:
+        """Decode the loaded program into a table of (instruction class, operands) indexed by PC.
+
+        Comments and empty lines decode to None. Every line is checked before anything is executed and all
+        problems are reported together with their line numbers.
+
+        Returns:
+            list: The decoded program.
+        """
+        log("Decoding program.", "INFO")
+        if self.instructionSet is None:
+            self.loadInstructionSet()
+        opcodes = self.instructionSet.opcodes
+
+        defaultTicks = self.getDefaultTicks()
+        decoded = []
+        ticks = []
+        errors = []
+        for index, line in enumerate(self.program):
+            decoded.append(None)
+            ticks.append(0)
+            words = line.split(";")[0].split()
+            if len(words) == 0:
+                continue
+
+            opcode = words[0]
+            instr_class = opcodes.get(opcode.lower())
+            if instr_class is None:
+                errors.append(f"Line {index + 1}: Unknown opcode: {opcode}")
+                continue
+
+            if len(words) - 1 != instr_class.operand_count:
+                errors.append(f"Line {index + 1}: Expected {instr_class.operand_count} operands, got {len(words) - 1}")
+                continue
+
+            operands = []
+            for i, operand in enumerate(words[1:]):
+                try:
+                    value = int(operand, 0)
+                except ValueError:
+                    errors.append(f"Line {index + 1}: Invalid operand {operand} at index {i}")
+                    break
+
+                if instr_class.signage[i] == "u":
+                    operands.append(value)
+                elif instr_class.signage[i] == "s":
+                    operands.append(value - (2 ** (instr_class.operand_sizes[i] - 1)))
+                else:
+                    errors.append(f"Line {index + 1}: Unknown signage {instr_class.signage[i]} at index {i}")
+                    break
+            if len(operands) != instr_class.operand_count:
+                continue
+
+            if isSizedCorrectly(instr_class.operand_sizes, operands, instr_class.signage) == False:
+                errors.append(f"Line {index + 1}: Operand size mismatch: {words[1:]}")
+                continue
+
+            decoded[index] = (instr_class, operands)
+            ticks[index] = getattr(instr_class, "cycles", defaultTicks)
+
+        if len(errors) > 0:
+            log("Unable to decode program:\n" + "\n".join(errors), "ERROR")
+
+        self.parsedProgram = decoded
+        self.instructionTicks = ticks
+        log(f"Decoded {len(decoded)} lines.", "INFO")
+        return decoded
+
+    def decodeProm(self) -> list:
+        """Decode the words of a loaded image from state["prom"] into the program table, one instruction per PC.
+
+        Returns:
+            list: The decoded program.
+        """
+        log("Decoding PROM.", "INFO")
+        if self.instructionSet is None:
+            self.loadInstructionSet()
+        numbers = getOpcodeNumbers(self.instructionSet, self.cpu)
+        classes = {numbers[mnemonic] : self.instructionSet.opcodes[mnemonic] for mnemonic in numbers}
+        cpu = self.cpu
+
+        defaultTicks = self.getDefaultTicks()
+        decoded = []
+        ticks = []
+        errors = []
+        for address, word in enumerate(self.state["prom"].data[:self.imageLength]):
+            instr_class, fields = decodeWord(word, classes, cpu)
+            if instr_class is None:
+                errors.append(f"Word {address}: Unknown opcode {word >> (cpu.promWordSize - cpu.opcodeSize)}")
+                decoded.append(None)
+                ticks.append(0)
+                continue
+            operands = [field - (1 << (size - 1)) if sign == "s" else field for field, size, sign in zip(fields, instr_class.operand_sizes, instr_class.signage)]
+            decoded.append((instr_class, operands))
+            ticks.append(getattr(instr_class, "cycles", defaultTicks))
+
+        if len(errors) > 0:
+            log("Unable to decode PROM:\n" + "\n".join(errors), "ERROR")
+
+        self.parsedProgram = decoded
+        self.instructionTicks = ticks
+        log(f"Decoded {len(decoded)} words.", "INFO")
+        return decoded
+
+    def redecode(self) -> None:
+        """Decode the loaded program or image again, e.g. after the instruction set changed."""
+        if self.program is not None:
+            self.decodeProgram()
+        elif self.imageLength is not None:
+            self.decodeProm()
+
     def updateFlags(self, value: int) -> None: 
-        for i, flag in enumerate(self.flags):
-            module = __import__(str(self.instructionsFile).strip(".py"))
-            class_ = getattr(module, flag[0])
-            self.flags[i] = (flag[0], class_.get(value))
-            
+        """Record the value the flags are computed from. Flags are only computed when getFlag() asks for them, except
+        for flag classes that set `eager = True`, which are computed straight away."""
+        self.flagValue = value
+        if self.flagCache:
+            self.flagCache.clear()
+        for name, getter in self.eagerFlags:
+            self.flagCache[name] = getter(value)
 
     def setInstructionsFile(self, instructionsFile: str) -> bool:
         log(f"Setting instructions file to {instructionsFile}", "INFO")
         self.instructionsFile = instructionsFile
+        self.loadInstructionSet()
+        self.redecode()
+        return True
+
+    def loadInstructionSet(self) -> InstructionSet:
+        """Import the instructions file (instructions.py in configGroup by default) and check it against the config."""
+        if self.instructionsFile is None:
+            self.instructionsFile = "instructions.py"
+        self.instructionSet = InstructionSet(resolveInstructionsFile(self.instructionsFile), self.config)
+        self.initEagerFlags()
+        return self.instructionSet
+
+    def initEagerFlags(self) -> None:
+        self.eagerFlags = [(name, self.instructionSet.flags[name]) for name in self.instructionSet.eagerFlags]
+        self.flagCache.clear()
+
+    def reloadInstructions(self, onlyIfChanged: bool = False) -> bool:
+        """Import the instructions file again and re-decode the loaded program with the new classes.
+
+        Args:
+            onlyIfChanged (bool, optional): Only reload if the file changed on disk since it was loaded. Defaults to False.
+
+        Returns:
+            bool: True if the instruction set was reloaded.
+        """
+        if self.instructionSet is None:
+            self.loadInstructionSet()
+        elif onlyIfChanged and not self.instructionSet.isStale():
+            return False
+        else:
+            self.instructionSet.reload()
+            self.initEagerFlags()
+        log("Reloaded instruction set.", "INFO")
+        self.redecode()
         return True
 
     def setReg(self, address: int, data: int, setFlags : bool) -> None:
-        log(f"Setting register {address} to {data}", "INFO")
-        self.state["registers"][address].set(data)
+        if logger.minLevel <= DEBUG:
+            log(f"Setting register {address} to {data}", "DEBUG")
+        self.state["registers"].set(address, data)
         if setFlags:
             self.updateFlags(data)
     
     def setIO(self, address: int, data: int) -> None:
-        log(f"Setting IO {address} to {data}", "INFO")
-        self.state["io"][address].set(data)
+        if logger.minLevel <= DEBUG:
+            log(f"Setting IO {address} to {data}", "DEBUG")
+        self.state["io"].set(address, data)
+        if self.devices and address in self.devices and not self.state["io"].isLocked(address):
+            self.devices[address].write(data)
 
     def setRAM(self, address: int, data: int, setFlags : bool) -> None:
-        log(f"Setting RAM {address} to {data}", "INFO")
-        self.state["ram"][address].set(data)
+        if logger.minLevel <= DEBUG:
+            log(f"Setting RAM {address} to {data}", "DEBUG")
+        if self.dcache is not None:
+            self.ticks += self.dcache.access(address)
+        self.state["ram"].set(address, data)
         if setFlags:
             self.updateFlags(data)
 
     def setCustomReg(self, name: str, data: int, setFlags : bool) -> None:
-        log(f"Setting custom register {name} to {data}", "INFO")
+        if logger.minLevel <= DEBUG:
+            log(f"Setting custom register {name} to {data}", "DEBUG")
         self.state["custom_regs"][name].set(data)
         if setFlags:
             self.updateFlags(data)
 
     def getFlag(self, name: str) -> bool:
-        for i, flag in enumerate(self.flags):
-            if flag[0] == name:
-                return flag[1]
-        log(f"Unable to locate {name} flag", "WARNING")
-        return False
+        try:
+            return self.flagCache[name]
+        except KeyError:
+            pass
+
+        if name not in self.flagNames:
+            log(f"Unable to locate {name} flag", "WARNING")
+            return False
+        if self.flagValue is None:
+            return False
+        if self.instructionSet is None:
+            self.loadInstructionSet()
+        value = self.instructionSet.flags[name](self.flagValue)
+        self.flagCache[name] = value
+        return value
 
+    def getFlags(self) -> dict[str, bool]:
+        """Returns the value of every flag, in config order."""
+        return {name : self.getFlag(name) for name in self.flagNames}
 
     def getReg(self, address: int) -> int:
-        log(f"Getting register {address}", "INFO")
-        return self.state["registers"][address].get()
+        if logger.minLevel <= DEBUG:
+            log(f"Getting register {address}", "DEBUG")
+        return self.state["registers"].get(address)
     
     def getIO(self, address: int) -> int:
-        log(f"Getting IO {address}", "INFO")
-        return self.state["io"][address].get()
+        if logger.minLevel <= DEBUG:
+            log(f"Getting IO {address}", "DEBUG")
+        if self.devices and address in self.devices:
+            value = self.devices[address].read()
+            if value is not None:
+                # Input from the device goes straight into the port, like any other outside source
+                self.state["io"].data[address] = value & self.state["io"].mask
+                if self.state["io"].dirty is not None:
+                    self.state["io"].dirty[address] = 1
+            elif self.isAsync:
+                raise IOWouldBlock(address)
+        return self.state["io"].get(address)
     
     def getRAM(self, address: int) -> int:
-        log(f"Getting RAM {address}", "INFO")
-        return self.state["ram"][address].get()
+        if logger.minLevel <= DEBUG:
+            log(f"Getting RAM {address}", "DEBUG")
+        if self.dcache is not None:
+            self.ticks += self.dcache.access(address)
+        return self.state["ram"].get(address)
     
     def getProm(self, address: int) -> int:
-        log(f"Getting PROM {address}", "INFO")
-        return self.state["prom"][address].get()
+        if logger.minLevel <= DEBUG:
+            log(f"Getting PROM {address}", "DEBUG")
+        return self.state["prom"].get(address)
     
     def getCustomReg(self, name: str) -> int:
-        log(f"Getting custom register {name}", "INFO")
+        if logger.minLevel <= DEBUG:
+            log(f"Getting custom register {name}", "DEBUG")
         return self.state["custom_regs"][name].get()
 
 
     def setIOLock(self, address: int, lockState: bool) -> None:
-        log(f"Setting IO {address} lock to {lockState}", "INFO")
+        if logger.minLevel <= DEBUG:
+            log(f"Setting IO {address} lock to {lockState}", "DEBUG")
         if lockState:
-            self.state["io"][address].lock()
+            self.state["io"].lock(address)
         else:
-            self.state["io"][address].unlock()
+            self.state["io"].unlock(address)
     
 
+    def push(self, data: int) -> None:
+        if logger.minLevel <= DEBUG:
+            log(f"Pushing {data}", "DEBUG")
+        self.state["stack"].push(data)
+
+    def pop(self) -> int:
+        if logger.minLevel <= DEBUG:
+            log("Popping", "DEBUG")
+        return self.state["stack"].pop()
+
+    def peek(self) -> int:
+        if logger.minLevel <= DEBUG:
+            log("Peeking", "DEBUG")
+        return self.state["stack"].peek()
+
+    def call(self, address: int) -> None:
+        """Push the address of the next instruction onto the call stack and jump to address."""
+        if logger.minLevel <= DEBUG:
+            log(f"Calling {address}", "DEBUG")
+        self.state["callstack"].push(self.state["pc"] + 1)
+        self.state["pc"] = address
+
+    def ret(self) -> None:
+        """Jump back to the address on top of the call stack."""
+        if logger.minLevel <= DEBUG:
+            log("Returning", "DEBUG")
+        self.state["pc"] = self.state["callstack"].pop()
+
+    def getCoreId(self) -> int:
+        """Returns the index of this core in its System, or 0 for a processor on its own."""
+        return self.coreId
+
+    def acquireLock(self, lockId: int) -> bool:
+        """Take a lock shared by the cores of a System, if it is free. A core that doesn't get the lock gives up the
+        rest of its quantum, so spin on it (test and branch). Always succeeds on a processor on its own.
+
+        Returns:
+            bool: True if this core now holds the lock.
+        """
+        if logger.minLevel <= DEBUG:
+            log(f"Acquiring lock {lockId}", "DEBUG")
+        if self.system is None:
+            return True
+        return self.system.acquireLock(self.coreId, lockId)
+
+    def releaseLock(self, lockId: int) -> None:
+        if logger.minLevel <= DEBUG:
+            log(f"Releasing lock {lockId}", "DEBUG")
+        if self.system is not None:
+            self.system.releaseLock(self.coreId, lockId)
+
     def getPC(self) -> int:
-        log("Getting PC", "INFO")
+        if logger.minLevel <= DEBUG:
+            log("Getting PC", "DEBUG")
         return self.state["pc"]
     
     def setPC(self, address: int) -> None:
-        log(f"Setting PC to {address}", "INFO")
+        if logger.minLevel <= DEBUG:
+            log(f"Setting PC to {address}", "DEBUG")
         self.state["pc"] = address
 
     def offsetPC(self, offset: int) -> None:
-        log(f"Offsetting PC by {offset}", "INFO")
+        if logger.minLevel <= DEBUG:
+            log(f"Offsetting PC by {offset}", "DEBUG")
         self.state["pc"] += offset
 
     def incrementPC(self) -> None:
-        log("Incrementing PC", "INFO")
+        if logger.minLevel <= DEBUG:
+            log("Incrementing PC", "DEBUG")
         self.state["pc"] += 1
@@ -0,0 +1,133 @@
+import json
+import time
+from collections import Counter
+from utils import *
+
+# The accessors the profiler wraps, with the kind and direction they count
+ACCESSORS = {
+    "getReg" : ("registers", "read"),
+    "setReg" : ("registers", "write"),
+    "getRAM" : ("ram", "read"),
+    "setRAM" : ("ram", "write"),
+    "getIO" : ("io", "read"),
+    "setIO" : ("io", "write"),
+    "getCustomReg" : ("custom_regs", "read"),
+    "setCustomReg" : ("custom_regs", "write")
+}
+
+class Profiler:
+    def __init__(self, proc) -> None:
+        """Counts executions and wall time per opcode and per PC, accesses per address and flag updates of a processor.
+
+        The profiler works by shadowing execute(), updateFlags() and the get/set accessors with wrappers on the
+        processor instance while it is enabled, so a processor that isn't being profiled runs the plain methods.
+
+        Args:
+            proc (Processor): The processor to profile.
+        """
+        self.proc = proc
+        self.enabled = False
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear every counter."""
+        self.opcodeCounts = Counter()
+        self.opcodeTimes = Counter()
+        self.pcCounts = Counter()
+        self.pcTimes = Counter()
+        self.accesses = {(kind, direction) : Counter() for kind, direction in ACCESSORS.values()}
+        self.flagUpdates = 0
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        proc = self.proc
+        execute = proc.execute
+        updateFlags = proc.updateFlags
+        opcodeCounts, opcodeTimes, pcCounts, pcTimes = self.opcodeCounts, self.opcodeTimes, self.pcCounts, self.pcTimes
+        perf_counter = time.perf_counter
+
+        def profiledExecute() -> bool:
+            pc = proc.state["pc"]
+            start = perf_counter()
+            result = execute()
+            elapsed = perf_counter() - start
+            name = proc.parsedProgram[pc][0].__name__
+            opcodeCounts[name] += 1
+            opcodeTimes[name] += elapsed
+            pcCounts[pc] += 1
+            pcTimes[pc] += elapsed
+            return result
+
+        def profiledUpdateFlags(value: int) -> None:
+            self.flagUpdates += 1
+            updateFlags(value)
+
+        # Keep whatever was on the instance before (another tool's wrappers) so disable() can put it back
+        self.shadowed = {name : proc.__dict__.get(name) for name in ["execute", "updateFlags", *ACCESSORS]}
+        proc.execute = profiledExecute
+        proc.updateFlags = profiledUpdateFlags
+        for name, key in ACCESSORS.items():
+            setattr(proc, name, self.wrapAccessor(getattr(proc, name), self.accesses[key]))
+        proc.instrumentation["profiler"] = self
+        self.enabled = True
+
+    def wrapAccessor(self, accessor, counter: Counter):
+        def profiledAccessor(address, *args):
+            counter[address] += 1
+            return accessor(address, *args)
+        return profiledAccessor
+
+    def disable(self) -> None:
+        if not self.enabled:
+            return
+        for name, previous in self.shadowed.items():
+            if previous is None:
+                # Another tool may already have taken its own wrapper off
+                self.proc.__dict__.pop(name, None)
+            else:
+                self.proc.__dict__[name] = previous
+        del self.proc.instrumentation["profiler"]
+        self.enabled = False
+
+    def toDict(self) -> dict:
+        """Returns every counter as JSON-friendly values. Times are in seconds."""
+        return {
+            "opcodes" : {name : {"count" : self.opcodeCounts[name], "seconds" : self.opcodeTimes[name]} for name in self.opcodeCounts},
+            "pcs" : {str(pc) : {"count" : self.pcCounts[pc], "seconds" : self.pcTimes[pc]} for pc in sorted(self.pcCounts)},
+            "accesses" : {f"{kind}/{direction}" : {str(address) : count for address, count in counter.items()} for (kind, direction), counter in self.accesses.items()},
+            "flag_updates" : self.flagUpdates
+        }
+
+    def exportJSON(self, filePath: str) -> None:
+        with open(filePath, "w") as f:
+            json.dump(self.toDict(), f, indent=4)
+
+    def exportCollapsed(self, filePath: str) -> None:
+        """Write the time per opcode and PC in the collapsed stack format used by flamegraph tools, in microseconds."""
+        with open(filePath, "w") as f:
+            for pc, seconds in sorted(self.pcTimes.items()):
+                name = self.proc.parsedProgram[pc][0].__name__ if self.proc.parsedProgram[pc] is not None else "unknown"
+                f.write(f"cyan;{name};pc_{pc} {round(seconds * 1000000)}\n")
+
+    def report(self, top: int = 10) -> str:
+        """Returns a text report of the opcodes, PCs and addresses with the most time or accesses."""
+        total = sum(self.opcodeTimes.values()) or 1
+        lines = ["Opcodes:", f"{'opcode':<12} {'count':>10} {'total ms':>10} {'avg us':>8} {'time':>6}"]
+        for name, seconds in self.opcodeTimes.most_common():
+            count = self.opcodeCounts[name]
+            lines.append(f"{name:<12} {count:>10} {seconds * 1000:>10.2f} {seconds / count * 1000000:>8.2f} {seconds / total:>6.1%}")
+
+        lines += ["", "Program lines:", f"{'pc':>6} {'count':>10} {'total ms':>10} {'time':>6}  source"]
+        for pc, seconds in self.pcTimes.most_common(top):
+            source = self.proc.program[pc].strip() if self.proc.program is not None and pc < len(self.proc.program) else ""
+            lines.append(f"{pc:>6} {self.pcCounts[pc]:>10} {seconds * 1000:>10.2f} {seconds / total:>6.1%}  {source}")
+
+        lines += ["", "Accesses:"]
+        for (kind, direction), counter in self.accesses.items():
+            if len(counter) == 0:
+                continue
+            hottest = ", ".join(f"{address}: {count}" for address, count in counter.most_common(top))
+            lines.append(f"{kind} {direction}s ({sum(counter.values())}): {hottest}")
+        lines.append(f"Flag updates: {self.flagUpdates}")
+        return "\n".join(lines)
@@ -0,0 +1,197 @@
+import struct
+from collections import deque
+from utils import *
+from snapshot import *
+
+JOURNAL_MAGIC = b"CYRJ"
+JOURNAL_VERSION = 1
+
+# magic, version, length of the initial snapshot that follows the header
+JOURNAL_HEADER = struct.Struct("<4sHQ")
+# kind, instruction index, port, value
+RECORD = struct.Struct("<BQIq")
+
+READ = 0
+WRITE = 1
+LOCK = 2
+KIND_NAMES = {READ : "read", WRITE : "write", LOCK : "lock"}
+
+IO_ACCESSORS = ("getIO", "setIO", "setIOLock")
+
+class IOHook:
+    def __init__(self, proc, name: str) -> None:
+        """Shared plumbing for the recorder and replayer: wrapping the IO accessors and attaching to the processor."""
+        self.proc = proc
+        self.name = name
+        self.shadowed = {}
+
+    def install(self) -> None:
+        proc = self.proc
+        self.shadowed = {name : proc.__dict__.get(name) for name in IO_ACCESSORS}
+        getIO, setIO, setIOLock = proc.getIO, proc.setIO, proc.setIOLock
+        proc.getIO = lambda address: self.onRead(getIO, address)
+        proc.setIO = lambda address, data: self.onWrite(setIO, address, data)
+        proc.setIOLock = lambda address, lockState: self.onLock(setIOLock, address, lockState)
+        proc.instrumentation[self.name] = self
+
+    def uninstall(self) -> None:
+        for name, previous in self.shadowed.items():
+            if previous is None:
+                self.proc.__dict__.pop(name, None)
+            else:
+                self.proc.__dict__[name] = previous
+        self.shadowed = {}
+        self.proc.instrumentation.pop(self.name, None)
+
+class Recorder(IOHook):
+    def __init__(self, proc, filePath: str, bufferSize: int = 1 << 16) -> None:
+        """Records every IO read, write and lock change with its instruction index into a binary journal.
+
+        The journal starts with a snapshot of the processor, so a replay can start from the same state. Records are
+        fixed size and go through a buffered file, so memory use doesn't grow with the length of the run.
+
+        Args:
+            proc (Processor): The processor to record.
+            filePath (str): The journal file to write.
+            bufferSize (int, optional): The write buffer size in bytes. Defaults to 64 KiB.
+        """
+        super().__init__(proc, "recorder")
+        self.filePath = filePath
+        self.records = 0
+        # Not proc.snapshot(), which would reset the change tracking of an export in progress
+        initial = saveSnapshot(proc)
+        self.file = open(filePath, "wb", buffering=bufferSize)
+        self.file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, len(initial)))
+        self.file.write(initial)
+        self.install()
+
+    def write(self, kind: int, address: int, value: int) -> None:
+        self.file.write(RECORD.pack(kind, self.proc.instructionCount, address, value))
+        self.records += 1
+
+    def onRead(self, getIO, address: int) -> int:
+        value = getIO(address)
+        self.write(READ, address, value)
+        return value
+
+    def onWrite(self, setIO, address: int, data: int) -> None:
+        self.write(WRITE, address, data)
+        return setIO(address, data)
+
+    def onLock(self, setIOLock, address: int, lockState: bool) -> None:
+        self.write(LOCK, address, 1 if lockState else 0)
+        return setIOLock(address, lockState)
+
+    def close(self) -> None:
+        """Stop recording and flush the journal."""
+        self.uninstall()
+        self.file.close()
+        log(f"Recorded {self.records} IO events to {self.filePath}", "INFO")
+
+class Replayer(IOHook):
+    def __init__(self, proc, filePath: str, snapshotInterval: int = 100000, maxSnapshots: int = 64, restoreInitial: bool = True) -> None:
+        """Feeds a recorded journal back into a processor and checks that the run matches it.
+
+        IO reads return the recorded values, and writes and lock changes must match the recording (same port, value and
+        instruction index), otherwise a CyanError is raised. The journal is read sequentially through a buffered file.
+
+        For reverse stepping, a snapshot is kept every snapshotInterval instructions, up to maxSnapshots of them.
+        stepBack() restores the nearest one and replays forward to the target instruction.
+
+        Args:
+            proc (Processor): The processor to replay into. It must use the same config and program as the recording.
+            filePath (str): The journal file to read.
+            snapshotInterval (int, optional): Instructions between snapshots. Defaults to 100000.
+            maxSnapshots (int, optional): The number of snapshots kept, oldest dropped first. Defaults to 64.
+            restoreInitial (bool, optional): Restore the snapshot at the start of the journal. Defaults to True.
+        """
+        super().__init__(proc, "replayer")
+        self.filePath = filePath
+        self.file = open(filePath, "rb")
+        magic, version, snapshotLength = JOURNAL_HEADER.unpack(self.file.read(JOURNAL_HEADER.size))
+        if magic != JOURNAL_MAGIC:
+            log(f"{filePath} is not a CYAN journal.", "ERROR")
+        if version > JOURNAL_VERSION:
+            log(f"Journal is too new. Expected {JOURNAL_VERSION}, got {version}", "ERROR")
+        initial = self.file.read(snapshotLength)
+        self.recordsStart = self.file.tell()
+        self.position = 0
+        if restoreInitial:
+            proc.restore(initial)
+
+        self.snapshotInterval = snapshotInterval
+        self.snapshots = deque(maxlen=maxSnapshots)
+        self.nextSnapshot = proc.instructionCount
+        self.install()
+
+    def install(self) -> None:
+        super().install()
+        self.shadowed["executeLine"] = self.proc.__dict__.get("executeLine")
+        executeLine = self.proc.executeLine
+        def replayedExecuteLine() -> None:
+            if self.proc.instructionCount >= self.nextSnapshot:
+                self.takeSnapshot()
+            executeLine()
+        self.proc.executeLine = replayedExecuteLine
+
+    def takeSnapshot(self) -> None:
+        count = self.proc.instructionCount
+        if len(self.snapshots) == 0 or self.snapshots[-1][0] < count:
+            self.snapshots.append((count, self.position, saveSnapshot(self.proc)))
+        self.nextSnapshot = count + self.snapshotInterval
+
+    def next(self, kind: int, address: int, value: int = None) -> int:
+        raw = self.file.read(RECORD.size)
+        if len(raw) < RECORD.size:
+            log(f"Replay diverged at instruction {self.proc.instructionCount}: IO {KIND_NAMES[kind]} of port {address} after the end of the journal", "ERROR")
+        recordKind, index, recordAddress, recordValue = RECORD.unpack(raw)
+        self.position += 1
+        if recordKind != kind or index != self.proc.instructionCount or recordAddress != address or (value is not None and value != recordValue):
+            log(f"Replay diverged at instruction {self.proc.instructionCount}: IO {KIND_NAMES[kind]} of port {address}" + ("" if value is None else f" = {value}") + f", recorded {KIND_NAMES.get(recordKind)} of port {recordAddress} = {recordValue} at instruction {index}", "ERROR")
+        return recordValue
+
+    def onRead(self, getIO, address: int) -> int:
+        value = self.next(READ, address)
+        # The recorded value came from outside the processor, so it goes straight into the port
+        self.proc.state["io"].data[address] = value
+        if self.proc.state["io"].dirty is not None:
+            self.proc.state["io"].dirty[address] = 1
+        return value
+
+    def onWrite(self, setIO, address: int, data: int) -> None:
+        self.next(WRITE, address, data)
+        return setIO(address, data)
+
+    def onLock(self, setIOLock, address: int, lockState: bool) -> None:
+        self.next(LOCK, address, 1 if lockState else 0)
+        return setIOLock(address, lockState)
+
+    def isFinished(self) -> bool:
+        """Check if every record of the journal has been replayed."""
+        here = self.file.tell()
+        finished = len(self.file.read(1)) == 0
+        self.file.seek(here)
+        return finished
+
+    def seek(self, instruction: int) -> None:
+        """Move the processor to just before the given instruction index by restoring the nearest earlier snapshot and
+        replaying forward from it."""
+        candidates = [snapshot for snapshot in self.snapshots if snapshot[0] <= instruction]
+        if len(candidates) == 0:
+            log(f"No snapshot at or before instruction {instruction} to replay from.", "ERROR")
+        count, position, data = candidates[-1]
+        self.proc.restore(data)
+        self.position = position
+        self.file.seek(self.recordsStart + position * RECORD.size)
+        self.nextSnapshot = count + self.snapshotInterval
+        if instruction > count:
+            self.proc.run(maxInstructions=instruction - count)
+
+    def stepBack(self, steps: int = 1) -> None:
+        """Go back the given number of instructions."""
+        self.seek(max(self.proc.instructionCount - steps, 0))
+
+    def close(self) -> None:
+        """Stop replaying."""
+        self.uninstall()
+        self.file.close()
@@ -0,0 +1,241 @@
+import sys
+import mmap
+import struct
+from array import array
+from multiprocessing import shared_memory, resource_tracker
+from utils import *
+from memory import *
+
+SHARED_MAGIC = b"CYSH"
+SHARED_VERSION = 1
+
+SHARED_BANKS = ("ram", "registers", "io")
+
+# magic, version, byte order of the bank data (0 little, 1 big), bank count
+SHARED_HEADER = struct.Struct("<4sHBB")
+# sequence counter, odd while the status below is being written
+SEQUENCE = struct.Struct("<Q")
+SEQUENCE_OFFSET = 8
+# pc, instruction count, ticks, 1 while the processor is running
+STATUS = struct.Struct("<QQQQ")
+STATUS_OFFSET = 16
+# bank name, byte offset of its words, word count, bytes per word, word size in bits
+BANK_ENTRY = struct.Struct("<16sQQHH4x")
+BANK_OFFSET = 48
+# Each bank's words start on a multiple of this
+ALIGNMENT = 64
+
+# Names of the shared memory segments created by this process
+createdSegments = set()
+
+def getTypecodeForBytes(itemSize: int) -> str | None:
+    """Returns the unsigned array typecode whose items take itemSize bytes, or None if there isn't one."""
+    for typecode in ("B", "H", "I", "L", "Q"):
+        if array(typecode).itemsize == itemSize:
+            return typecode
+    return None
+
+def openSegment(name: str, path: str, size: int = None):
+    """Open (or create, if size is given) a shared memory segment or a memory mapped file. Returns the handle and its buffer."""
+    try:
+        if path is not None:
+            if size is not None:
+                with open(path, "wb") as f:
+                    f.truncate(size)
+            with open(path, "r+b") as f:
+                segment = mmap.mmap(f.fileno(), 0)
+            return segment, segment
+        if size is not None:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+            createdSegments.add(segment.name)
+        else:
+            segment = shared_memory.SharedMemory(name=name)
+            # Only the creator should remove the segment, not a reader when it exits
+            if segment.name not in createdSegments:
+                resource_tracker.unregister(segment._name, "shared_memory")
+        return segment, segment.buf
+    except (OSError, ValueError) as e:
+        log(f"Couldn't open shared state {path if path is not None else name}: {e}", "ERROR")
+
+class SharedState:
+    def __init__(self, proc, name: str = None, path: str = None, publishEvery: int = 10000) -> None:
+        """Moves the RAM, registers and IO of a processor into a shared memory segment (or a memory mapped file), so other
+        local processes can read them and write IO inputs while the processor runs, without copying anything.
+
+        The banks keep working as before, their words just live in the segment. The layout (all header fields little
+        endian, bank words in the byte order given in the header):
+
+        - 0: magic "CYSH", version (u16), byte order (u8, 0 little, 1 big), bank count (u8)
+        - 8: sequence (u64)
+        - 16: pc, instruction count, ticks, running (u64 each)
+        - 48: one 40 byte entry per bank: name (16 bytes, padded with zeros), byte offset, word count (u64 each), bytes
+          per word, word size in bits (u16 each), 4 bytes of padding
+        - each bank's words at its offset, aligned to 64 bytes
+
+        The sequence counter is a seqlock: it is made odd while the status is written and even again after, every
+        publishEvery instructions of run() and when it stops. See SharedStateReader for reading it.
+
+        Args:
+            proc (Processor): The processor whose banks are shared.
+            name (str, optional): The name of the shared memory segment. Defaults to None (a random name, see self.name).
+            path (str, optional): Map this file instead of a shared memory segment. Defaults to None.
+            publishEvery (int, optional): Instructions between status updates while running. Defaults to 10000.
+        """
+        if publishEvery < 1:
+            log(f"publishEvery must be at least 1 instruction, got {publishEvery}", "ERROR")
+        self.proc = proc
+        self.path = path
+        self.publishEvery = publishEvery
+        self.sequence = 0
+
+        self.layout = []
+        offset = BANK_OFFSET + BANK_ENTRY.size * len(SHARED_BANKS)
+        for bankName in SHARED_BANKS:
+            bank = proc.state[bankName]
+            if bank.typecode is None:
+                log(f"{bankName} has {bank.wordSize} bit words, which can't be shared. Shared banks need words of 64 bits or less.", "ERROR")
+            offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+            itemSize = bank.data.itemsize
+            self.layout.append((bankName, offset, bank.size, itemSize, bank.wordSize))
+            offset += bank.size * itemSize
+        self.size = max(offset, 1)
+
+        self.segment, self.buffer = openSegment(name, path, self.size)
+        self.name = path if path is not None else self.segment.name
+        SHARED_HEADER.pack_into(self.buffer, 0, SHARED_MAGIC, SHARED_VERSION, 0 if sys.byteorder == "little" else 1, len(SHARED_BANKS))
+        for index, (bankName, offset, count, itemSize, wordSize) in enumerate(self.layout):
+            BANK_ENTRY.pack_into(self.buffer, BANK_OFFSET + index * BANK_ENTRY.size, bankName.encode("utf-8"), offset, count, itemSize, wordSize)
+        self.views = []
+        self.attach()
+        log(f"Sharing {', '.join(SHARED_BANKS)} in {self.name} ({self.size} bytes).", "INFO")
+
+    def attach(self) -> None:
+        """Copy the current words of the processor's banks into the segment and point the banks at it. Called again by
+        Processor.reset(), which makes new banks."""
+        self.release()
+        for bankName, offset, count, itemSize, wordSize in self.layout:
+            bank = self.proc.state[bankName]
+            if bank.size != count or bank.wordSize != wordSize:
+                log(f"{bankName} doesn't match the shared layout any more.", "ERROR")
+            view = memoryview(self.buffer)[offset:offset + count * itemSize].cast(bank.typecode)
+            view[:] = bank.data
+            bank.data = view
+            self.views.append(view)
+        self.publish(False)
+
+    def release(self) -> None:
+        """Give the banks their own copy of their words again, so the segment can be closed."""
+        for (bankName, offset, count, itemSize, wordSize), view in zip(self.layout, self.views):
+            bank = self.proc.state[bankName]
+            if bank.data is view:
+                bank.data = array(bank.typecode, view)
+            view.release()
+        self.views = []
+
+    def publish(self, running: bool = None) -> None:
+        """Write the pc, instruction count, ticks and running flag of the processor for readers, under the seqlock."""
+        proc = self.proc
+        buffer = self.buffer
+        if running is None:
+            running = proc.isRunning
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, SEQUENCE_OFFSET, self.sequence)
+        STATUS.pack_into(buffer, STATUS_OFFSET, proc.state["pc"], proc.instructionCount, proc.ticks, 1 if running else 0)
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self, unlink: bool = True) -> None:
+        """Stop sharing. The banks keep their words. A shared memory segment is also removed unless unlink is False
+        (a mapped file is always kept)."""
+        self.release()
+        if self.path is not None:
+            self.segment.close()
+        else:
+            self.buffer = None
+            self.segment.close()
+            if unlink:
+                self.segment.unlink()
+                createdSegments.discard(self.segment.name)
+        log(f"Stopped sharing state in {self.name}.", "INFO")
+
+class SharedStateReader:
+    def __init__(self, name: str = None, path: str = None) -> None:
+        """Opens the state shared by a processor (see Processor.shareState()) from another process.
+
+        Bank words can be read at any time straight from the segment with get() or view(). Each word is always read
+        whole, but while the processor runs, different words may be from different instructions. snapshot() retries
+        until its copy was made between two status updates, so it matches the state at most publishEvery instructions
+        after the status it returns, and matches it exactly once the processor has stopped.
+
+        Args:
+            name (str, optional): The name of the shared memory segment.
+            path (str, optional): The mapped file, if the processor shares its state through one.
+        """
+        if (name is None) == (path is None):
+            log("Give either the name of a shared memory segment or the path of a mapped file.", "ERROR")
+        self.name = path if path is not None else name
+        self.path = path
+        self.segment, self.buffer = openSegment(name, path)
+
+        magic, version, byteorder, bankCount = SHARED_HEADER.unpack_from(self.buffer, 0)
+        if magic != SHARED_MAGIC:
+            log(f"{self.name} isn't shared CYAN state.", "ERROR")
+        if version != SHARED_VERSION:
+            log(f"Unsupported shared state version {version} in {self.name}", "ERROR")
+        if byteorder != (0 if sys.byteorder == "little" else 1):
+            log(f"{self.name} was written on a machine with a different byte order.", "ERROR")
+
+        self.banks = {}
+        self.masks = {}
+        for index in range(bankCount):
+            rawName, offset, count, itemSize, wordSize = BANK_ENTRY.unpack_from(self.buffer, BANK_OFFSET + index * BANK_ENTRY.size)
+            bankName = rawName.rstrip(b"\x00").decode("utf-8")
+            typecode = getTypecodeForBytes(itemSize)
+            if typecode is None:
+                log(f"{bankName} in {self.name} has {itemSize} byte words, which this machine can't read.", "ERROR")
+            self.banks[bankName] = memoryview(self.buffer)[offset:offset + count * itemSize].cast(typecode)
+            self.masks[bankName] = (1 << wordSize) - 1
+
+    def getSequence(self) -> int:
+        return SEQUENCE.unpack_from(self.buffer, SEQUENCE_OFFSET)[0]
+
+    def getStatus(self) -> dict:
+        """Returns the last published sequence, pc, instruction count, ticks and running flag, read consistently."""
+        while True:
+            before = self.getSequence()
+            if before % 2 == 1:
+                continue
+            pc, instructions, ticks, running = STATUS.unpack_from(self.buffer, STATUS_OFFSET)
+            if self.getSequence() == before:
+                return {"sequence" : before, "pc" : pc, "instructions" : instructions, "ticks" : ticks, "running" : running == 1}
+
+    def get(self, bank: str, address: int) -> int:
+        return self.banks[bank][address]
+
+    def view(self, bank: str) -> memoryview:
+        """Returns the words of a bank in the segment, without copying. Only valid until close()."""
+        return self.banks[bank]
+
+    def snapshot(self, banks: tuple = SHARED_BANKS) -> dict:
+        """Copy the status and the given banks (as arrays) between two status updates. See the class docstring.
+
+        Returns:
+            dict: The status from getStatus(), plus one array per bank.
+        """
+        while True:
+            status = self.getStatus()
+            copies = {bank : array(self.banks[bank].format, self.banks[bank]) for bank in banks}
+            if self.getSequence() == status["sequence"]:
+                status.update(copies)
+                return status
+
+    def writeIO(self, port: int, value: int) -> None:
+        """Set an IO port, which the processor sees the next time it reads the port (unless a device is bound to it)."""
+        self.banks["io"][port] = value & self.masks["io"]
+
+    def close(self) -> None:
+        for view in self.banks.values():
+            view.release()
+        self.banks = {}
+        self.buffer = None
+        self.segment.close()
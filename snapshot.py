@@ -0,0 +1,157 @@
+import io
+import sys
+import mmap
+import struct
+from utils import *
+from memory import *
+
+SNAPSHOT_MAGIC = b"CYSN"
+# 2 added the stacks (BANK and SPTR sections) and the TICK section
+SNAPSHOT_VERSION = 2
+
+# magic, version, byte order of the bank data (0 little, 1 big), pc, instruction count
+HEADER = struct.Struct("<4sHBqQ")
+# tag, name length
+SECTION = struct.Struct("<4sH")
+# payload length
+LENGTH = struct.Struct("<Q")
+# word size, word count
+BANK = struct.Struct("<IQ")
+
+BANKS = ("ram", "prom", "registers", "io", "stack", "callstack")
+STACKS = ("stack", "callstack")
+
+def writeSection(f, tag: bytes, name: str, *payload) -> None:
+    encoded = name.encode("utf-8")
+    f.write(SECTION.pack(tag, len(encoded)))
+    f.write(encoded)
+    f.write(LENGTH.pack(sum(len(part) for part in payload)))
+    for part in payload:
+        f.write(part)
+
+def writeSnapshot(proc, f) -> None:
+    """Write the full state of a processor to a binary file object.
+
+    The file is a header followed by tagged sections: one BANK section per memory bank (word size, word count, lock bits,
+    raw words), one SPTR section per stack with its pointer, one CREG section per custom register, one FLAG section per flag, an FVAL section with the value
+    the flags were last computed from and a TICK section. Readers skip tags they don't know.
+
+    Args:
+        proc (Processor): The processor to save.
+        f (file): A binary file object open for writing.
+    """
+    f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0 if sys.byteorder == "little" else 1, proc.state["pc"], proc.instructionCount))
+
+    for name in BANKS:
+        bank = proc.state[name]
+        data = bank.toBytes()
+        writeSection(f, b"BANK", name, BANK.pack(bank.wordSize, bank.size), bank.locks, data)
+    for name in STACKS:
+        writeSection(f, b"SPTR", name, LENGTH.pack(proc.state[name].pointer))
+
+    for name, reg in proc.state["custom_regs"].items():
+        writeSection(f, b"CREG", name, reg.data.to_bytes((reg.wordSize + 7) // 8, "little"))
+
+    for name, value in proc.getFlags().items():
+        writeSection(f, b"FLAG", name, bytes([1 if value else 0]))
+    if proc.flagValue is not None:
+        writeSection(f, b"FVAL", "flags", proc.flagValue.to_bytes((proc.flagValue.bit_length() + 8) // 8, "little", signed=True))
+
+    writeSection(f, b"TICK", "ticks", LENGTH.pack(proc.ticks))
+
+def readSnapshot(proc, data) -> None:
+    """Load a snapshot written by writeSnapshot() into a processor with the same config.
+
+    Args:
+        proc (Processor): The processor to load the state into.
+        data (bytes-like): The snapshot, e.g. bytes or an mmap of a snapshot file.
+    """
+    view = memoryview(data)
+    # Every view of data is released before returning, even on an error, so an mmap passed in can be closed
+    views = [view]
+    try:
+        magic, version, byteorder, pc, instructionCount = HEADER.unpack_from(view, 0)
+        if magic != SNAPSHOT_MAGIC:
+            log("Not a CYAN snapshot.", "ERROR")
+        if version > SNAPSHOT_VERSION:
+            log(f"Snapshot is too new. Expected {SNAPSHOT_VERSION}, got {version}", "ERROR")
+        byteorder = "little" if byteorder == 0 else "big"
+
+        flags = {}
+        flagValue = None
+        # Older snapshots have no stacks or ticks, so they restore as empty and 0
+        ticks = 0
+        banks = set()
+        pointers = {}
+        offset = HEADER.size
+        while offset < len(view):
+            tag, nameLength = SECTION.unpack_from(view, offset)
+            offset += SECTION.size
+            name = bytes(view[offset:offset + nameLength]).decode("utf-8")
+            offset += nameLength
+            (length,) = LENGTH.unpack_from(view, offset)
+            offset += LENGTH.size
+            payload = view[offset:offset + length]
+            views.append(payload)
+            offset += length
+
+            if tag == b"BANK":
+                bank = proc.state.get(name)
+                wordSize, size = BANK.unpack_from(payload, 0)
+                if not isinstance(bank, MemoryBank) or bank.wordSize != wordSize or bank.size != size:
+                    log(f"Snapshot bank {name} ({size} words of {wordSize} bits) doesn't match the processor.", "ERROR")
+                locks = payload[BANK.size:BANK.size + size]
+                words = payload[BANK.size + size:]
+                views += [locks, words]
+                bank.loadLocks(locks)
+                bank.loadBytes(words, byteorder)
+                banks.add(name)
+            elif tag == b"SPTR":
+                if not isinstance(proc.state.get(name), Stack):
+                    log(f"Snapshot stack {name} doesn't exist on the processor.", "ERROR")
+                (pointers[name],) = LENGTH.unpack_from(payload, 0)
+            elif tag == b"CREG":
+                if name not in proc.state["custom_regs"]:
+                    log(f"Snapshot custom register {name} doesn't exist on the processor.", "ERROR")
+                proc.state["custom_regs"][name].data = int.from_bytes(payload, "little")
+            elif tag == b"FLAG":
+                flags[name] = payload[0] == 1
+            elif tag == b"FVAL":
+                flagValue = int.from_bytes(payload, "little", signed=True)
+            elif tag == b"TICK":
+                (ticks,) = LENGTH.unpack_from(payload, 0)
+    finally:
+        for view in views:
+            view.release()
+
+    for name in STACKS:
+        stack = proc.state[name]
+        if name not in banks:
+            stack.clear()
+        stack.pointer = pointers.get(name, 0)
+    proc.state["pc"] = pc
+    proc.instructionCount = instructionCount
+    proc.ticks = ticks
+    # The saved flags go straight into the cache, the value is only needed once the next write clears it
+    proc.flagValue = flagValue
+    proc.flagCache.clear()
+    for name in proc.flagNames:
+        proc.flagCache[name] = flags.get(name, False)
+
+def saveSnapshot(proc, filePath: str = None) -> bytes | None:
+    """Save a snapshot of a processor to a file, or return it as bytes if no file is given."""
+    if filePath is None:
+        f = io.BytesIO()
+        writeSnapshot(proc, f)
+        return f.getvalue()
+    with open(filePath, "wb") as f:
+        writeSnapshot(proc, f)
+    return None
+
+def loadSnapshot(proc, source: str | bytes) -> None:
+    """Load a snapshot into a processor from bytes, or from a file through mmap."""
+    if not isinstance(source, str):
+        readSnapshot(proc, source)
+        return
+    with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        readSnapshot(proc, mapped)
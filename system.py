@@ -0,0 +1,193 @@
+from utils import *
+from config import *
+from memory import *
+from processor import *
+
+class System:
+    def __init__(self, config: dict, cores: int = 2, quantum: int = 1000) -> None:
+        """Several Processor cores that share one RAM bank and one set of IO ports, run by a round robin scheduler.
+
+        Every core has its own registers, PC, flags, stacks and caches. The scheduler runs each core for a quantum of
+        instructions at a time, in core order, so a run is deterministic and each switch costs one call, not one per
+        instruction. Instructions are atomic, and cores can also share locks through acquireLock()/releaseLock().
+
+        Args:
+            config (dict | CpuConfig): The configuration dictionary for every core, or a CpuConfig.
+            cores (int, optional): The number of cores. Defaults to 2.
+            quantum (int, optional): Instructions a core runs before the next core gets a turn. Defaults to 1000.
+        """
+        if cores < 1:
+            log(f"A system needs at least one core, got {cores}", "ERROR")
+        if quantum < 1:
+            log(f"The quantum must be at least 1 instruction, got {quantum}", "ERROR")
+
+        self.cpu = config if isinstance(config, CpuConfig) else CpuConfig(config)
+        # The shared banks are made once and handed to every core, so no core allocates its own
+        banks = self.newSharedBanks()
+        self.cores = [Processor(self.cpu, sharedBanks=banks) for _ in range(cores)]
+        self.quantum = quantum
+        self.devices = self.cores[0].devices
+        # Lock id to the index of the core holding it
+        self.locks = {}
+        self.finished = set()
+        self.exitReason = None
+        self.quanta = [0] * cores
+        self.lockWaits = [0] * cores
+        for index, core in enumerate(self.cores):
+            core.system = self
+            core.coreId = index
+            core.devices = self.devices
+        log(f"Created a system with {cores} cores.", "INFO")
+
+    def newSharedBanks(self) -> dict:
+        """Make a fresh RAM bank and set of IO ports for the cores to share."""
+        cpu = self.cpu
+        self.ram = MemoryBank("ram", cpu.ram, cpu.wordSize, cpu.ramError)
+        self.io = MemoryBank("io", cpu.ioCount, cpu.ioSize, cpu.ioError)
+        return {"ram" : self.ram, "io" : self.io}
+
+    def setInstructionsFile(self, instructionsFile: str) -> bool:
+        """Load an instructions file once and use it on every core."""
+        first = self.cores[0]
+        first.setInstructionsFile(instructionsFile)
+        for core in self.cores[1:]:
+            core.instructionsFile = first.instructionsFile
+            core.instructionSet = first.instructionSet
+            core.initEagerFlags()
+            core.redecode()
+        return True
+
+    def loadProgram(self, programFile: str, core: int = None) -> bool:
+        """Load a program onto one core, or onto every core if core is None (decoded once and shared).
+
+        Cores running the same program can tell themselves apart with getCoreId().
+        """
+        if core is not None:
+            self.finished.discard(core)
+            return self.cores[core].loadProgram(programFile)
+
+        first = self.cores[0]
+        if not first.loadProgram(programFile):
+            return False
+        for other in self.cores[1:]:
+            if other.instructionSet is not first.instructionSet:
+                other.instructionsFile = first.instructionsFile
+                other.instructionSet = first.instructionSet
+                other.initEagerFlags()
+            other.program = list(first.program)
+            other.imageLength = None
+            other.parsedProgram = first.parsedProgram
+            other.instructionTicks = first.instructionTicks
+        self.finished.clear()
+        return True
+
+    def run(self, engine: str = "interpreter", maxInstructions: int = None) -> str:
+        """Run every core until they have all stopped.
+
+        Args:
+            engine (str, optional): "interpreter" or "compiled", as for Processor.run(). Defaults to "interpreter".
+            maxInstructions (int, optional): Stop after about this many more instructions over all cores. It is
+                checked after each quantum. Defaults to None (no limit).
+
+        Returns:
+            str: "halted" once every core has stopped, or "instruction_limit".
+        """
+        if engine not in ("interpreter", "compiled"):
+            log(f"Unknown engine: {engine}", "ERROR")
+        live = [index for index, core in enumerate(self.cores) if index not in self.finished and core.parsedProgram is not None]
+        if len(live) == 0:
+            log("No program loaded on any running core.", "WARNING")
+            return None
+        log(f"Starting {len(live)} core(s) with the {engine} engine and a quantum of {self.quantum}.", "INFO")
+        steps = [core.executeBlock if engine == "compiled" and len(core.instrumentation) == 0 else core.executeLine for core in self.cores]
+        for index in live:
+            self.cores[index].exitReason = None
+        self.exitReason = None
+
+        quantum = self.quantum
+        remaining = maxInstructions
+        while len(live) > 0:
+            for index in list(live):
+                core = self.cores[index]
+                core.isRunning = True
+                core.yielded = False
+                before = core.instructionCount
+                core.runBatch(steps[index], quantum)
+                self.quanta[index] += 1
+                if not core.isRunning and not core.yielded:
+                    live.remove(index)
+                    self.coreStopped(index)
+                if remaining is not None:
+                    remaining -= core.instructionCount - before
+                    if remaining <= 0 and len(live) > 0:
+                        self.exitReason = "instruction_limit"
+                        return self.exitReason
+
+        self.exitReason = "halted"
+        return self.exitReason
+
+    def coreStopped(self, index: int) -> None:
+        core = self.cores[index]
+        if core.exitReason is None:
+            core.exitReason = "halted"
+        self.finished.add(index)
+        held = [lockId for lockId, owner in self.locks.items() if owner == index]
+        for lockId in held:
+            log(f"Core {index} stopped while holding lock {lockId}. Releasing it.", "WARNING")
+            del self.locks[lockId]
+        log(f"Core {index} stopped: {core.exitReason}", "INFO")
+
+    def acquireLock(self, core: int, lockId: int) -> bool:
+        """Take a lock for a core if it is free (or already held by that core).
+
+        If the lock is held by another core, the rest of the waiting core's quantum is given up, so spinning on a lock
+        doesn't use up the quantum.
+
+        Returns:
+            bool: True if the core now holds the lock.
+        """
+        owner = self.locks.get(lockId)
+        if owner is None or owner == core:
+            self.locks[lockId] = core
+            return True
+        self.lockWaits[core] += 1
+        self.cores[core].yielded = True
+        self.cores[core].isRunning = False
+        return False
+
+    def releaseLock(self, core: int, lockId: int) -> None:
+        owner = self.locks.get(lockId)
+        if owner != core:
+            log(f"Core {core} released lock {lockId}, which it doesn't hold.", "WARNING")
+            return
+        del self.locks[lockId]
+
+    def bindDevice(self, port: int, device: Device) -> None:
+        """Connect a shared IO port to a device, for every core."""
+        self.cores[0].bindDevice(port, device)
+
+    def reset(self) -> None:
+        """Reset every core and give them a fresh shared RAM and IO."""
+        banks = self.newSharedBanks()
+        for core in self.cores:
+            core.sharedBanks = banks
+            core.reset()
+        self.locks = {}
+        self.finished = set()
+        self.quanta = [0] * len(self.cores)
+        self.lockWaits = [0] * len(self.cores)
+
+    def getStats(self) -> dict:
+        """Returns the instructions, ticks, quanta and lock waits of each core, and the totals."""
+        cores = [{
+            "instructions" : core.instructionCount,
+            "ticks" : core.ticks,
+            "quanta" : self.quanta[index],
+            "lock_waits" : self.lockWaits[index],
+            "exit_reason" : core.exitReason
+        } for index, core in enumerate(self.cores)]
+        return {
+            "cores" : cores,
+            "instructions" : sum(core["instructions"] for core in cores),
+            "ticks" : max(core["ticks"] for core in cores)
+        }
@@ -1,26 +1,117 @@
 import json
+import atexit
 import importlib
 import datetime
 
 printLogs = True
 
-def log(message: str, level: str) -> None:
-    with open("./log.txt", "a") as f:
-        f.write(f"[{datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]}] {level.upper()}: {message}\n")
-
-    if level == "INFO" or level == "WARNING":
-        if printLogs:
-            print(f"{level.upper()}: {message}")
-    elif level == "ERROR" or level == "FATAL":
-        print(f"{level.upper()}: {message}")
-        print("Exiting the program...")
-        with open("./log.txt", "a") as f:
-            f.write(str(f"[{datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]}] {level.upper()}: Exiting the program...\n"))
-        exit(1)
-    
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+FATAL = 50
+OFF = 100
+
+LOG_LEVELS = {
+    "DEBUG" : DEBUG,
+    "INFO" : INFO,
+    "WARNING" : WARNING,
+    "ERROR" : ERROR,
+    "FATAL" : FATAL,
+    "OFF" : OFF
+}
+
+class CyanError(Exception):
+    """Raised when the emulator logs an ERROR or FATAL message."""
+
+    def __init__(self, message: str, level: str = "ERROR") -> None:
+        super().__init__(message)
+        self.level = level
+
+class Logger:
+    def __init__(self, filePath: str = "./log.txt", level: str = "INFO", printLevel: str = "INFO", bufferSize: int = 1024) -> None:
+        """A level gated logger that buffers lines in memory and appends them to the log file in batches.
+
+        Args:
+            filePath (str, optional): The log file. Defaults to "./log.txt".
+            level (str, optional): The minimum level written to the log file. Defaults to "INFO".
+            printLevel (str, optional): The minimum level printed to stdout (if printLogs is True). Defaults to "INFO".
+            bufferSize (int, optional): The maximum number of buffered lines before they are flushed. Defaults to 1024.
+        """
+        self.filePath = filePath
+        self.level = LOG_LEVELS[level.upper()]
+        self.printLevel = LOG_LEVELS[printLevel.upper()]
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.minLevel = min(self.level, self.printLevel)
+
+    def isEnabled(self, level: int) -> bool:
+        """Check if a message of the given level would go anywhere.
+
+        Hot paths should compare against logger.minLevel directly (`if logger.minLevel <= DEBUG:`) to skip building the message.
+        """
+        return level >= self.level or (printLogs and level >= self.printLevel)
+
+    def log(self, message: str, level: str, error: type = None) -> None:
+        level = level.upper()
+        levelNo = LOG_LEVELS[level]
+
+        if levelNo >= self.level:
+            self.buffer.append(f"[{datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]}] {level}: {message}\n")
+            if len(self.buffer) >= self.bufferSize or levelNo >= ERROR:
+                self.flush()
+
+        if printLogs and levelNo >= self.printLevel:
+            print(f"{level}: {message}")
+
+        if levelNo >= ERROR:
+            raise (error or CyanError)(message, level)
+
+    def flush(self) -> None:
+        """Write all buffered lines to the log file."""
+        if len(self.buffer) == 0 or self.filePath is None:
+            self.buffer.clear()
+            return
+        with open(self.filePath, "a") as f:
+            f.writelines(self.buffer)
+        self.buffer.clear()
+
+    def reset(self) -> None:
+        """Drop any buffered lines and empty the log file."""
+        self.buffer.clear()
+        if self.filePath is not None:
+            with open(self.filePath, "w") as f:
+                f.write("")
+
+logger = Logger()
+atexit.register(logger.flush)
+
+def log(message: str, level: str, error: type = None) -> None:
+    """Log a message through the global logger. ERROR and FATAL messages raise a CyanError, or the given subclass of it."""
+    logger.log(message, level, error)
+
+def configureLogger(filePath: str = None, level: str = None, printLevel: str = None, bufferSize: int = None) -> None:
+    """Change the settings of the global logger. Any argument left as None is unchanged. Use "OFF" to disable a level.
+
+    Args:
+        filePath (str, optional): The log file, or "" for no log file. Buffered lines are flushed to the old file first.
+        level (str, optional): The minimum level written to the log file.
+        printLevel (str, optional): The minimum level printed to stdout.
+        bufferSize (int, optional): The maximum number of buffered lines.
+    """
+    if filePath is not None:
+        logger.flush()
+        logger.filePath = filePath or None
+    if level is not None:
+        logger.level = LOG_LEVELS[level.upper()]
+    if printLevel is not None:
+        logger.printLevel = LOG_LEVELS[printLevel.upper()]
+    if bufferSize is not None:
+        logger.bufferSize = bufferSize
+    logger.minLevel = min(logger.level, logger.printLevel)
+
 def resetLogger():
-    with open("./log.txt", "w") as f:
-        f.write("")
+    logger.reset()
 
 def dumpOutput(stateDict: dict):
     """
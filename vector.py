@@ -0,0 +1,322 @@
+from utils import *
+from config import *
+from processor import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class LaneView:
+    def __init__(self, vproc, lane: int) -> None:
+        """The scalar processor API for a single lane of a VectorProcessor.
+
+        Instructions without a `vector` method are run once per lane against one of these, so they behave exactly as
+        they would on a Processor.
+
+        Args:
+            vproc (VectorProcessor): The vector processor.
+            lane (int): The lane index.
+        """
+        self.vproc = vproc
+        self.lane = lane
+        self.config = vproc.config
+
+    def setReg(self, address: int, data: int, setFlags: bool) -> None:
+        self.vproc.setRegV(self.lane, address, data, setFlags)
+
+    def setRAM(self, address: int, data: int, setFlags: bool) -> None:
+        self.vproc.setRAMV(self.lane, address, data, setFlags)
+
+    def setIO(self, address: int, data: int) -> None:
+        self.vproc.setIOV(self.lane, address, data)
+
+    def setCustomReg(self, name: str, data: int, setFlags: bool) -> None:
+        self.vproc.setCustomRegV(self.lane, name, data, setFlags)
+
+    def getReg(self, address: int) -> int:
+        return int(self.vproc.registers[self.lane, address])
+
+    def getRAM(self, address: int) -> int:
+        return int(self.vproc.ram[self.lane, address])
+
+    def getIO(self, address: int) -> int:
+        return int(self.vproc.io[self.lane, address])
+
+    def getProm(self, address: int) -> int:
+        return self.vproc.template.getProm(address)
+
+    def getCustomReg(self, name: str) -> int:
+        return int(self.vproc.customRegs[name][self.lane])
+
+    def setIOLock(self, address: int, lockState: bool) -> None:
+        self.vproc.setIOLockV(self.lane, address, lockState)
+
+    def getFlag(self, name: str) -> bool:
+        return bool(self.vproc.getFlagV(self.lane, name))
+
+    def getPC(self) -> int:
+        return int(self.vproc.pc[self.lane])
+
+    def setPC(self, address: int) -> None:
+        self.vproc.pc[self.lane] = address
+
+    def offsetPC(self, offset: int) -> None:
+        self.vproc.pc[self.lane] += offset
+
+    def incrementPC(self) -> None:
+        self.vproc.pc[self.lane] += 1
+
+    def stop(self) -> None:
+        self.vproc.running[self.lane] = False
+
+class VectorProcessor:
+    def __init__(self, config: dict, lanes: int) -> None:
+        """Runs one program on many independent machine states at once, stored as NumPy arrays with one row per lane.
+
+        Each step, the running lanes are grouped by PC and every group runs its instruction once: as a single vectorized
+        call if the instruction class has a `vector(vproc, lanes, operands)` method, otherwise once per lane through a
+        LaneView. Every lane ends in the same state as a Processor that ran the same input alone.
+
+        Only vectorized instructions are fast: the LaneView fallback runs several times slower per lane than a plain
+        Processor, so an instruction set needs `vector` methods (see benchmarks/isa/instructions.py) to gain anything.
+
+        Word sizes must be 62 bits or less. Caches, stacks, profiling and the compiled engine are not available in vector mode.
+
+        Args:
+            config (dict | CpuConfig): The configuration dictionary for the processor, or a CpuConfig.
+            lanes (int): The number of lanes.
+        """
+        if np is None:
+            log("VectorProcessor requires NumPy (pip install numpy).", "ERROR")
+
+        self.template = Processor(config)
+        self.cpu = self.template.cpu
+        self.config = self.template.config
+        self.lanes = lanes
+        cpu = self.cpu
+        for key, size in (("word_size", cpu.wordSize), ("io_size", cpu.ioSize)):
+            if size > 62:
+                log(f"VectorProcessor supports word sizes up to 62 bits, {key} is {size}", "ERROR")
+
+        self.wordMask = cpu.wordMask
+        self.ioMask = cpu.ioMask
+        self.regError = cpu.regError
+        self.ramError = cpu.ramError
+        self.ioError = cpu.ioError
+        self.zeroRegister = cpu.zeroRegister
+        self.initState()
+
+    def initState(self) -> None:
+        """Initialize every lane to the default state."""
+        lanes = self.lanes
+        cpu = self.cpu
+        self.registers = np.zeros((lanes, cpu.registers), dtype=np.int64)
+        self.ram = np.zeros((lanes, cpu.ram), dtype=np.int64)
+        self.io = np.zeros((lanes, cpu.ioCount), dtype=np.int64)
+        self.ioLocks = np.zeros((lanes, cpu.ioCount), dtype=bool)
+        self.customRegs = {name : np.zeros(lanes, dtype=np.int64) for name in self.template.state["custom_regs"]}
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.running = np.zeros(lanes, dtype=bool)
+        self.instructionCount = np.zeros(lanes, dtype=np.int64)
+        self.ticks = np.zeros(lanes, dtype=np.int64)
+        self.flagValue = np.zeros(lanes, dtype=np.int64)
+        self.flagWritten = np.zeros(lanes, dtype=bool)
+
+    def reset(self) -> None:
+        self.initState()
+
+    def loadProgram(self, programFile: str) -> bool:
+        return self.template.loadProgram(programFile)
+
+    def setInstructionsFile(self, instructionsFile: str) -> bool:
+        return self.template.setInstructionsFile(instructionsFile)
+
+    def loadLane(self, lane: int, proc: Processor) -> None:
+        """Copy the state of a scalar processor into a lane."""
+        self.registers[lane] = list(proc.state["registers"])
+        self.ram[lane] = list(proc.state["ram"])
+        self.io[lane] = list(proc.state["io"])
+        self.ioLocks[lane] = list(proc.state["io"].locks)
+        for name, reg in proc.state["custom_regs"].items():
+            self.customRegs[name][lane] = reg.get()
+        self.pc[lane] = proc.state["pc"]
+        self.flagWritten[lane] = proc.flagValue is not None
+        self.flagValue[lane] = proc.flagValue or 0
+
+    def getLaneState(self, lane: int) -> dict:
+        """Returns the state of a lane as plain Python values, in the same shape as the batch runner results."""
+        return {
+            "pc" : int(self.pc[lane]),
+            "registers" : self.registers[lane].tolist(),
+            "ram" : self.ram[lane].tolist(),
+            "io" : self.io[lane].tolist(),
+            "custom_regs" : {name : int(values[lane]) for name, values in self.customRegs.items()},
+            "flags" : {name : bool(self.getFlagV(lane, name)) for name in self.template.flagNames},
+            "instructions" : int(self.instructionCount[lane]),
+            "ticks" : int(self.ticks[lane])
+        }
+
+    def run(self, maxSteps: int = None) -> int:
+        """Run every lane until it stops (or runs past the end of the program).
+
+        Args:
+            maxSteps (int, optional): Stop after this many lockstep steps. Defaults to None (no limit).
+
+        Returns:
+            int: The number of steps taken.
+        """
+        program = self.template.parsedProgram
+        if program is None:
+            log("No program loaded.", "WARNING")
+            return 0
+        instructionTicks = self.template.instructionTicks
+        log(f"Starting vector processor with {self.lanes} lanes.", "INFO")
+        self.running[:] = True
+
+        steps = 0
+        while maxSteps is None or steps < maxSteps:
+            active = np.flatnonzero(self.running)
+            if active.size == 0:
+                break
+            steps += 1
+
+            # Regroup the running lanes by PC, every group runs one instruction
+            pcs = self.pc[active]
+            order = np.argsort(pcs, kind="stable")
+            active = active[order]
+            boundaries = np.flatnonzero(np.diff(pcs[order])) + 1
+            for group in np.split(active, boundaries):
+                pc = int(self.pc[group[0]])
+                if pc < 0 or pc >= len(program):
+                    log(f"Program counter {pc} is past the end of the program in {group.size} lane(s).", "WARNING")
+                    self.running[group] = False
+                    continue
+                entry = program[pc]
+                if entry is None:
+                    self.pc[group] = pc + 1
+                    continue
+
+                instr_class, operands = entry
+                vector = getattr(instr_class, "vector", None)
+                if vector is not None:
+                    vector(self, group, operands)
+                else:
+                    for lane in group.tolist():
+                        instr_class(LaneView(self, lane), operands)
+
+                # Same rule as the interpreter: only step forward if the instruction left the PC alone
+                stayed = group[self.pc[group] == pc]
+                self.pc[stayed] = pc + 1
+                self.instructionCount[group] += 1
+                self.ticks[group] += instructionTicks[pc]
+
+        log(f"Vector processor finished after {steps} steps.", "INFO")
+        return steps
+
+    def broadcast(self, lanes, address, values):
+        """Returns lanes, addresses and values as 1D arrays of the same length, so each can be one value or one per lane."""
+        return np.broadcast_arrays(np.atleast_1d(lanes), np.atleast_1d(address), np.atleast_1d(np.asarray(values, dtype=np.int64)))
+
+    def writeBank(self, bank, lanes, address, values, mask: int, error: bool, name: str) -> None:
+        outOfRange = (values < 0) | (values > mask)
+        if outOfRange.any():
+            if error:
+                log(f"Data out of range in {name}", "ERROR")
+            values = values & mask
+        bank[lanes, address] = values
+
+    def setRegV(self, lanes, address, values, setFlags: bool) -> None:
+        """Write values (one per lane, or one for all) to a register (or one register per lane) in the given lanes."""
+        lanes, address, values = self.broadcast(lanes, address, values)
+        flagLanes, flagValues = lanes, values
+        if self.zeroRegister:
+            keep = address != 0
+            if not keep.all():
+                log("Attemped to write to locked memory", "WARNING")
+                lanes, address, values = lanes[keep], address[keep], values[keep]
+        self.writeBank(self.registers, lanes, address, values, self.wordMask, self.regError, "registers")
+        if setFlags:
+            self.updateFlagsV(flagLanes, flagValues)
+
+    def setRAMV(self, lanes, address, values, setFlags: bool) -> None:
+        """Write values to a RAM address (or one address per lane) in the given lanes."""
+        lanes, address, values = self.broadcast(lanes, address, values)
+        self.writeBank(self.ram, lanes, address, values, self.wordMask, self.ramError, "ram")
+        if setFlags:
+            self.updateFlagsV(lanes, values)
+
+    def setIOV(self, lanes, address, values) -> None:
+        """Write values to an IO port (or one port per lane) in the given lanes, skipping lanes where it is locked."""
+        lanes, address, values = self.broadcast(lanes, address, values)
+        keep = ~self.ioLocks[lanes, address]
+        if not keep.all():
+            log("Attemped to write to locked memory", "WARNING")
+            lanes, address, values = lanes[keep], address[keep], values[keep]
+        self.writeBank(self.io, lanes, address, values, self.ioMask, self.ioError, "io")
+
+    def setIOLockV(self, lanes, address, lockState: bool) -> None:
+        self.ioLocks[lanes, address] = lockState
+
+    def setCustomRegV(self, lanes, name: str, values, setFlags: bool) -> None:
+        """Write values to a custom register in the given lanes, adding them instead for accumulating registers."""
+        reg = self.template.state["custom_regs"][name]
+        values = np.asarray(values, dtype=np.int64)
+        if isinstance(reg, AccumulatedMemory):
+            values = self.customRegs[name][lanes] + values
+        outOfRange = (values < 0) | (values > reg.mask)
+        if outOfRange.any():
+            if reg.error:
+                log("Data out of range", "ERROR")
+            values = values & reg.mask
+        self.customRegs[name][lanes] = values
+        if setFlags:
+            self.updateFlagsV(lanes, values)
+
+    def getRegV(self, lanes, address):
+        """Returns a register (or one register per lane) of the given lanes as an array."""
+        return self.registers[lanes, address]
+
+    def getRAMV(self, lanes, address):
+        """Returns a RAM address (or one address per lane) of the given lanes as an array."""
+        return self.ram[lanes, address]
+
+    def getIOV(self, lanes, address):
+        """Returns an IO port (or one port per lane) of the given lanes as an array."""
+        return self.io[lanes, address]
+
+    def getCustomRegV(self, lanes, name: str):
+        return self.customRegs[name][lanes]
+
+    def updateFlagsV(self, lanes, values) -> None:
+        self.flagValue[lanes] = values
+        self.flagWritten[lanes] = True
+
+    def getFlagV(self, lanes, name: str):
+        """Returns a flag of the given lanes as a bool array (or a bool for a single lane).
+
+        The flag class's get(value) is called with the whole array first. If it doesn't return a matching bool
+        array (e.g. it uses `or`), it is called once per lane instead.
+        """
+        if name not in self.template.flagNames:
+            log(f"Unable to locate {name} flag", "WARNING")
+            return np.zeros(np.shape(lanes), dtype=bool)
+        getter = self.template.instructionSet.flags[name]
+        values = self.flagValue[lanes]
+        try:
+            result = np.asarray(getter(values), dtype=bool)
+            if result.shape != values.shape:
+                raise ValueError()
+        except (ValueError, TypeError):
+            result = np.array([getter(int(value)) for value in np.ravel(values)], dtype=bool).reshape(values.shape)
+        return result & self.flagWritten[lanes]
+
+    def setPCV(self, lanes, address) -> None:
+        """Set the PC of the given lanes to an address (or one address per lane)."""
+        self.pc[lanes] = address
+
+    def offsetPCV(self, lanes, offset) -> None:
+        self.pc[lanes] += offset
+
+    def stopV(self, lanes) -> None:
+        self.running[lanes] = False